@@ -0,0 +1,154 @@
+"""
+Canal UDP opcional del cliente de Cowboy Battle.
+Recibe los snapshots (`estado`) por datagramas y envía la posición del jugador
+por el mismo camino. Solo se usa el snapshot más nuevo: los que llegan tarde o
+desordenados se descartan. Si el canal deja de recibir, el cliente vuelve al
+WebSocket.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict
+
+# Reintentos del saludo inicial (y segundos entre cada uno)
+INTENTOS_HOLA = 10
+INTERVALO_HOLA = 0.2
+
+# Cada cuánto se avisa al servidor que el canal sigue vivo (en segundos)
+INTERVALO_LATIDO = 0.5
+
+# Segundos sin snapshots en plena partida para volver al WebSocket
+TIMEOUT_SNAPSHOTS = 1.0
+
+
+class _ProtocoloCliente(asyncio.DatagramProtocol):
+    """Pasa cada datagrama recibido al canal."""
+
+    def __init__(self, canal: "CanalUDP"):
+        self.canal = canal
+
+    def datagram_received(self, datos: bytes, direccion):
+        self.canal._recibir(datos)
+
+    def error_received(self, error: Exception):
+        # Por ejemplo, "puerto inalcanzable" si el servidor no escucha UDP
+        print(f"Error en el canal UDP: {error}")
+
+
+class CanalUDP:
+    """
+    Canal de datagramas hacia el servidor, identificado por el token que el
+    servidor entregó por el WebSocket.
+
+    - `abrir()`: saluda al servidor hasta recibir respuesta
+    - `siguiente()`: último snapshot recibido que todavía no se procesó
+    - `enviar_posicion()` / `latido()`: datagramas hacia el servidor
+    """
+
+    def __init__(self, host: str, puerto: int, token: str):
+        self.host = host
+        self.puerto = puerto
+        self.token = token
+        self.transporte = None
+        self.seq = 0
+        self.confirmado = asyncio.Event()
+        self.pendiente: str | None = None   # Snapshot más nuevo sin procesar (JSON)
+        self.ultimo_tick = -1
+        self.ultimo_recibido = 0.0
+        self.ultimo_envio = 0.0
+        self.recibidos = 0
+        self.descartados = 0
+
+    async def abrir(self) -> bool:
+        """Abre el socket y saluda al servidor. Devuelve True si el servidor respondió."""
+        try:
+            self.transporte, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _ProtocoloCliente(self),
+                remote_addr=(self.host, self.puerto)
+            )
+        except OSError as e:
+            print(f"No se pudo abrir el canal UDP: {e}")
+            return False
+        for _ in range(INTENTOS_HOLA):
+            self._enviar({"tipo": "hola"})
+            try:
+                await asyncio.wait_for(self.confirmado.wait(), INTERVALO_HOLA)
+                self.ultimo_recibido = time.time()
+                return True
+            except asyncio.TimeoutError:
+                pass
+        self.cerrar()
+        return False
+
+    def _enviar(self, mensaje: Dict[str, Any]):
+        if self.transporte is None:
+            return
+        self.seq += 1
+        mensaje["token"] = self.token
+        mensaje["seq"] = self.seq
+        self.transporte.sendto(json.dumps(mensaje).encode("utf-8"))
+        self.ultimo_envio = time.time()
+
+    def _recibir(self, datos: bytes):
+        try:
+            mensaje = json.loads(datos)
+        except ValueError:
+            self.descartados += 1
+            return
+        if not isinstance(mensaje, dict):
+            self.descartados += 1
+            return
+        tipo = mensaje.get("tipo")
+        if tipo == "hola_ok":
+            self.confirmado.set()
+        elif tipo == "estado":
+            tick = mensaje.get("tick", -1)
+            if tick <= self.ultimo_tick:
+                # Llegó después de uno más nuevo: ya no sirve
+                self.descartados += 1
+                return
+            if self.pendiente is not None:
+                # El anterior nunca se procesó: lo reemplaza el más nuevo
+                self.descartados += 1
+            self.ultimo_tick = tick
+            self.pendiente = datos.decode("utf-8")
+            self.recibidos += 1
+            self.ultimo_recibido = time.time()
+
+    def hay_pendiente(self) -> bool:
+        return self.pendiente is not None
+
+    def siguiente(self) -> str | None:
+        """Devuelve (y consume) el snapshot más nuevo recibido, si hay uno."""
+        mensaje, self.pendiente = self.pendiente, None
+        return mensaje
+
+    def enviar_posicion(self, x: float, y: float):
+        """Envía la posición del jugador (el servidor sabe de quién es por el token)."""
+        self._enviar({"tipo": "update_pos", "x": x, "y": y})
+
+    def latido(self, posicion: tuple | None = None):
+        """
+        Mantiene vivo el canal si no se envió nada en INTERVALO_LATIDO. En partida
+        el latido repite la posición, por si se perdió el último datagrama con ella.
+        """
+        if time.time() - self.ultimo_envio < INTERVALO_LATIDO:
+            return
+        if posicion is not None:
+            self.enviar_posicion(*posicion)
+        else:
+            self._enviar({"tipo": "latido"})
+
+    def esperar_snapshots(self):
+        """Empieza a contar el silencio desde ahora (al iniciar una partida)."""
+        self.ultimo_recibido = time.time()
+
+    def sin_snapshots(self) -> bool:
+        """Indica si pasó demasiado tiempo sin recibir snapshots."""
+        return time.time() - self.ultimo_recibido > TIMEOUT_SNAPSHOTS
+
+    def cerrar(self):
+        if self.transporte is not None:
+            self.transporte.close()
+            self.transporte = None
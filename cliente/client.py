@@ -11,13 +11,45 @@ import sys
 import math
 import time
 from typing import Dict
+from urllib.parse import urlparse
 import cowboy_theme as theme
+import canal_udp
+import duelo
+import rollback
+import sincronizacion
 
 # Configuración de Pygame
 ANCHO_VENTANA = 800
 ALTO_VENTANA = 600
 VELOCIDAD_MOVIMIENTO = 5
 
+# Reanudación de sesión tras un corte en plena partida (debe coincidir con el servidor)
+VENTANA_REANUDACION = 15.0
+INTERVALO_REINTENTO = 1.0  # Segundos entre intentos de reconexión
+
+# Mensajes extra que se leen por frame durante un duelo (entradas del rival)
+MAX_MENSAJES_POR_FRAME_DUELO = 8
+
+# Snapshots que se piden al servidor: por segundo (máximo 60) y bytes por segundo
+# (None = sin límite). En conexiones lentas conviene bajarlos: el servidor manda
+# primero lo más importante (tus balas, lo que está cerca) y el resto menos seguido
+TASA_SNAPSHOTS = 60
+PRESUPUESTO_SNAPSHOTS = None
+
+
+async def reconectar(uri: str, token: str):
+    """
+    Abre una conexión nueva y pide reanudar la sesión con el token. Corre como
+    tarea aparte para que la ventana no se congele mientras la red no responde.
+    """
+    websocket = await websockets.connect(uri, open_timeout=INTERVALO_REINTENTO)
+    try:
+        await websocket.send(json.dumps({"tipo": "reanudar", "token": token}))
+    except Exception:
+        await websocket.close()
+        raise
+    return websocket
+
 
 async def cliente():
     """
@@ -40,9 +72,11 @@ async def cliente():
     # Estados del juego
     en_menu_principal = True  # Pantalla inicial (crear/unirse)
     ingresando_codigo = False  # Pantalla para ingresar código de sala
+    en_cola = False           # Esperando que el servidor arme una partida rápida
     en_lobby = False          # En la sala esperando
     en_juego = False
     game_over = False
+    es_espectador = False     # Mirando la partida de otros (sin jugar)
     yo_listo = False
     necesita_sincronizar_posicion_inicial = False  # Bandera para sincronizar posición al iniciar partida
 
@@ -50,6 +84,7 @@ async def cliente():
     estado_sala = {}
     ganador_id = None
     motivo_victoria = None  # "abandono" o None para victoria normal
+    ranking = []  # Top de jugadores del servidor (se pide al terminar la partida)
 
     # Estado de todos los jugadores recibido del servidor
     # Clave: player_id, Valor: {"x": x, "y": y}
@@ -86,6 +121,30 @@ async def cliente():
     INTERVALO_ACTUALIZACION_POS = 0.05  # 50ms = 20 actualizaciones por segundo
     ultimo_envio_posicion = 0.0
 
+    # Medición de RTT, jitter y desfase con el reloj del servidor (ping/pong)
+    reloj_servidor = sincronizacion.RelojSincronizado()
+
+    # Reanudación de sesión: token entregado por el servidor y momento del corte
+    token_reanudacion = None
+    reanudando_desde = None
+    ultimo_intento_reanudar = 0.0
+    tarea_reconexion = None  # Intento de reconexión en curso (no bloquea el loop de Pygame)
+
+    # Canal UDP opcional para snapshots y posiciones (se negocia por el WebSocket)
+    canal = None          # canal_udp.CanalUDP mientras exista
+    tarea_canal = None    # Saludo inicial en curso
+    udp_activo = False    # El servidor ya envía los snapshots por UDP
+
+    # Partida rápida: lugar en la cola que informa el servidor y momento en que se pidió
+    cola_posicion = None
+    cola_total = None
+    cola_desde = 0.0
+    inicio_cliente = time.time()  # Para medir cuánto tarda en empezar la primera partida
+
+    # Modo duelo: simulación con rollback (mientras dure el duelo) e ids de los dos jugadores
+    partida_duelo = None
+    ids_duelo = []
+
     # Inicializar Pygame
     pygame.init()
     pantalla = pygame.display.set_mode((ANCHO_VENTANA, ALTO_VENTANA))
@@ -163,6 +222,19 @@ async def cliente():
                             if len(texto_codigo) < 6 and evento.unicode.isalnum():
                                 texto_codigo += evento.unicode.upper()
 
+                    # ---- Cancelar la partida rápida (ESC) ----
+                    elif en_cola:
+                        if evento.key == pygame.K_ESCAPE:
+                            en_cola = False
+                            en_menu_principal = True
+                            if websocket is not None:
+                                try:
+                                    await websocket.send(json.dumps({"tipo": "cancelar_quick_play"}))
+                                    await websocket.close()
+                                except Exception as e:
+                                    print(f"Error al cancelar la partida rápida: {e}")
+                                websocket = None
+
                     # ---- Controles cuando NO estamos en el menú principal ----
                     else:
                         # Disparo solo si estamos en juego
@@ -197,12 +269,64 @@ async def cliente():
                             except Exception as e:
                                 print(f"Error al enviar ready: {e}")
 
+                        # Cambiar el modo de la partida (tecla D, solo el host)
+                        if (
+                            evento.key == pygame.K_d
+                            and player_id is not None
+                            and en_lobby
+                            and es_host
+                            and websocket is not None
+                        ):
+                            try:
+                                await websocket.send(json.dumps({
+                                    "tipo": "modo_duelo",
+                                    "player_id": player_id,
+                                    "activo": estado_sala.get("modo") != "duelo",
+                                }))
+                            except Exception as e:
+                                print(f"Error al enviar modo_duelo: {e}")
+
+                        # Agregar un bot a la sala (tecla B, solo el host)
+                        if (
+                            evento.key == pygame.K_b
+                            and player_id is not None
+                            and en_lobby
+                            and es_host
+                            and websocket is not None
+                        ):
+                            try:
+                                await websocket.send(json.dumps({
+                                    "tipo": "agregar_bot",
+                                    "player_id": player_id,
+                                }))
+                                print("Solicitando un bot...")
+                            except Exception as e:
+                                print(f"Error al enviar agregar_bot: {e}")
+
+                        # Publicar la sala en el explorador o volverla privada (tecla P, solo el host)
+                        if (
+                            evento.key == pygame.K_p
+                            and player_id is not None
+                            and en_lobby
+                            and es_host
+                            and websocket is not None
+                        ):
+                            try:
+                                await websocket.send(json.dumps({
+                                    "tipo": "sala_publica",
+                                    "publica": not estado_sala.get("publica", False),
+                                }))
+                                print("Sala pública" if not estado_sala.get("publica", False) else "Sala privada")
+                            except Exception as e:
+                                print(f"Error al enviar sala_publica: {e}")
+
                 # ---- Clicks en el menú principal ----
                 elif evento.type == pygame.MOUSEBUTTONDOWN and en_menu_principal:
                     mouse_pos = pygame.mouse.get_pos()
                     (
                         boton_crear_rect,
                         boton_unirse_rect,
+                        boton_rapida_rect,
                         campo_nombre_rect,
                     ) = theme.draw_menu_principal(
                         pantalla,
@@ -250,6 +374,31 @@ async def cliente():
                             mensaje_error = None
                         else:
                             mensaje_error = "Por favor ingresa un nombre primero"
+
+                    # Botón "Partida Rápida" - esperar en la cola del servidor
+                    elif boton_rapida_rect.collidepoint(mouse_pos):
+                        if texto_ingresado.strip():
+                            nombre_jugador = texto_ingresado.strip()
+                            try:
+                                print(f"Conectando a {uri}...")
+                                websocket = await websockets.connect(uri)
+                                print("Conectado al servidor")
+
+                                await websocket.send(json.dumps({
+                                    "tipo": "quick_play",
+                                    "nombre": nombre_jugador,
+                                }))
+                                en_menu_principal = False
+                                en_cola = True
+                                cola_posicion = None
+                                cola_total = None
+                                cola_desde = time.time()
+                                mensaje_error = None
+                            except Exception as e:
+                                mensaje_error = f"Error al conectar: {e}"
+                                print(mensaje_error)
+                        else:
+                            mensaje_error = "Por favor ingresa un nombre primero"
                 
                 # ---- Clicks en pantalla de ingresar código ----
                 elif evento.type == pygame.MOUSEBUTTONDOWN and ingresando_codigo:
@@ -257,6 +406,7 @@ async def cliente():
                     (
                         boton_cancelar_rect,
                         boton_unirse_rect,
+                        boton_espectar_rect,
                         campo_codigo_rect,
                     ) = theme.draw_ingresar_codigo(
                         pantalla,
@@ -302,6 +452,29 @@ async def cliente():
                                 print(mensaje_error)
                         else:
                             mensaje_error = "Por favor ingresa un código"
+
+                    # Botón "Mirar" - conectar como espectador de la sala
+                    elif boton_espectar_rect.collidepoint(mouse_pos):
+                        if texto_codigo.strip():
+                            codigo_ingresado = texto_codigo.strip().upper()
+                            try:
+                                print(f"Conectando a {uri}...")
+                                websocket = await websockets.connect(uri)
+                                print("Conectado al servidor")
+
+                                mensaje_espectar = {
+                                    "tipo": "espectar",
+                                    "codigo_sala": codigo_ingresado,
+                                }
+                                await websocket.send(json.dumps(mensaje_espectar))
+                                print(f"Mensaje enviado: {mensaje_espectar}")
+                                ingresando_codigo = False
+                                mensaje_error = None
+                            except Exception as e:
+                                mensaje_error = f"Error al conectar: {e}"
+                                print(mensaje_error)
+                        else:
+                            mensaje_error = "Por favor ingresa un código"
                 
                 # ---- Clicks en pantalla de lobby ----
                 elif evento.type == pygame.MOUSEBUTTONDOWN and en_lobby:
@@ -358,6 +531,7 @@ async def cliente():
                         puntuacion,
                         nombres_jugadores_temp,
                         motivo_victoria,
+                        ranking,
                     )
 
                     # Botón "Volver a jugar" - resetear y volver al menú principal
@@ -375,6 +549,7 @@ async def cliente():
                         game_over = False
                         en_juego = False
                         en_lobby = False
+                        es_espectador = False
                         en_menu_principal = True
                         player_id = None
                         es_host = False
@@ -391,6 +566,10 @@ async def cliente():
                         estrella_pos = None
                         jugadores_invencibles = {}
                         sprite_indices = {}
+                        partida_duelo = None
+                        reloj_servidor = sincronizacion.RelojSincronizado()
+                        token_reanudacion = None
+                        reanudando_desde = None
                         nombre_jugador = ""  # Resetear nombre para volver a ingresar
                         texto_ingresado = ""
                         mensaje_error = None
@@ -413,8 +592,8 @@ async def cliente():
             movimiento_x = 0
             movimiento_y = 0
 
-            # Solo permitir movimiento si estamos en juego
-            if en_juego and not game_over:
+            # Solo permitir movimiento si estamos en juego (en un duelo mueve la simulación)
+            if en_juego and not game_over and partida_duelo is None:
                 # DIRECCIÓN según teclas
                 if teclas[pygame.K_w] or teclas[pygame.K_UP]:
                     movimiento_y = -VELOCIDAD_MOVIMIENTO
@@ -458,10 +637,60 @@ async def cliente():
                     if not any(rect_jugador.colliderect(o) for o in obstaculos_rects):
                         y = nuevo_y
 
+            # ------------------------------
+            # Duelo con rollback: se envían solo las entradas y se dibuja la simulación
+            # ------------------------------
+            if partida_duelo is not None and en_juego and not game_over and websocket is not None:
+                entrada = 0
+                if teclas[pygame.K_w] or teclas[pygame.K_UP]:
+                    entrada |= duelo.ARRIBA
+                if teclas[pygame.K_s] or teclas[pygame.K_DOWN]:
+                    entrada |= duelo.ABAJO
+                if teclas[pygame.K_a] or teclas[pygame.K_LEFT]:
+                    entrada |= duelo.IZQUIERDA
+                if teclas[pygame.K_d] or teclas[pygame.K_RIGHT]:
+                    entrada |= duelo.DERECHA
+                if disparo_solicitado:
+                    entrada |= duelo.DISPARO
+
+                nuevas = partida_duelo.actualizar(reloj_servidor.ahora(), entrada)
+                try:
+                    if nuevas is not None:
+                        disparo_solicitado = False
+                        frame_entrada, entradas = nuevas
+                        await websocket.send(json.dumps({
+                            "tipo": "entrada",
+                            "s": partida_duelo.sesion,
+                            "f": frame_entrada,
+                            "e": entradas,
+                        }))
+                    if partida_duelo.desincronizado:
+                        # La simulación local no coincide con la del servidor: pedir su estado
+                        partida_duelo.desincronizado = False
+                        await websocket.send(json.dumps({"tipo": "resincronizar_duelo"}))
+                except Exception as e:
+                    print(f"Error al enviar entradas del duelo: {e}")
+
+                # Lo que se dibuja sale del estado (predicho) de la simulación
+                estado_duelo = partida_duelo.estado
+                for indice, (pid, jugador) in enumerate(zip(ids_duelo, estado_duelo.jugadores)):
+                    if pid == player_id:
+                        x, y = jugador[0], jugador[1]
+                    else:
+                        estado_jugadores[pid] = {"x": jugador[0], "y": jugador[1]}
+                    if jugador[3] > puntuacion.get(pid, 0):
+                        # Impacto: el rival de quien sumó se ve dañado un momento
+                        jugadores_danados[ids_duelo[1 - indice]] = time.time()
+                    puntuacion[pid] = jugador[3]
+                estado_balas = {
+                    str(indice + 1): {"x": bala[0], "y": bala[1], "player_id": ids_duelo[indice]}
+                    for indice, bala in enumerate(estado_duelo.balas) if bala is not None
+                }
+
             # ------------------------------
             # Enviar disparo
             # ------------------------------
-            if disparo_solicitado and player_id is not None and websocket is not None:
+            if disparo_solicitado and player_id is not None and websocket is not None and partida_duelo is None:
                 mensaje_shoot = {
                     "tipo": "shoot",
                     "player_id": player_id,
@@ -487,7 +716,7 @@ async def cliente():
             # ------------------------------
             # Enviar posición (throttling)
             # ------------------------------
-            if en_juego and not game_over and websocket is not None:
+            if en_juego and not game_over and not es_espectador and websocket is not None and partida_duelo is None:
                 tiempo_actual = time.time()
                 if (x, y) != posicion_anterior and player_id is not None:
                     if tiempo_actual - ultimo_envio_posicion >= INTERVALO_ACTUALIZACION_POS:
@@ -498,227 +727,509 @@ async def cliente():
                             "y": y,
                         }
                         try:
-                            await websocket.send(json.dumps(mensaje_posicion))
+                            if udp_activo:
+                                canal.enviar_posicion(x, y)
+                            else:
+                                await websocket.send(json.dumps(mensaje_posicion))
                             posicion_anterior = (x, y)
                             ultimo_envio_posicion = tiempo_actual
                         except Exception as e:
                             print(f"Error al enviar posición: {e}")
 
+            # ------------------------------
+            # Reanudación de sesión tras un corte
+            # ------------------------------
+            if tarea_reconexion is not None and tarea_reconexion.done():
+                # La respuesta al "reanudar" (asignacion_id o error) llega por el loop de mensajes
+                try:
+                    websocket = tarea_reconexion.result()
+                    print("Reconectado, reanudando sesión...")
+                except Exception as e:
+                    print(f"Reintentando reconexión: {e}")
+                tarea_reconexion = None
+            if websocket is None and reanudando_desde is not None:
+                tiempo_actual = time.time()
+                if tiempo_actual - reanudando_desde > VENTANA_REANUDACION:
+                    # El servidor ya liberó el lugar: descartar la partida y volver al menú principal
+                    print("No se pudo reanudar la sesión a tiempo")
+                    if tarea_reconexion is not None:
+                        tarea_reconexion.cancel()
+                        tarea_reconexion = None
+                    mensaje_error = "No se pudo volver a la partida"
+                    en_menu_principal = True
+                    ingresando_codigo = False
+                    en_lobby = False
+                    en_juego = False
+                    game_over = False
+                    player_id = None
+                    es_host = False
+                    codigo_sala = None
+                    estado_sala = {}
+                    estado_jugadores = {}
+                    estado_balas = {}
+                    puntuacion = {}
+                    partida_duelo = None
+                    token_reanudacion = None
+                    reanudando_desde = None
+                    pygame.display.set_caption("Cowboy Battle - Cliente")
+                elif tarea_reconexion is None and tiempo_actual - ultimo_intento_reanudar >= INTERVALO_REINTENTO:
+                    ultimo_intento_reanudar = tiempo_actual
+                    tarea_reconexion = asyncio.create_task(reconectar(uri, token_reanudacion))
+
+            # ------------------------------
+            # Canal UDP (snapshots por datagramas)
+            # ------------------------------
+            if websocket is None and canal is not None:
+                # Sin WebSocket no hay sesión: el canal se vuelve a negociar al reconectar
+                if tarea_canal is not None:
+                    tarea_canal.cancel()
+                canal.cerrar()
+                canal = None
+                tarea_canal = None
+                udp_activo = False
+            if tarea_canal is not None and tarea_canal.done():
+                abierto = tarea_canal.result()
+                tarea_canal = None
+                if abierto:
+                    await websocket.send(json.dumps({"tipo": "usar_udp", "activo": True}))
+                    udp_activo = True
+                    print("Snapshots por UDP")
+                else:
+                    print("El servidor no responde por UDP, se sigue por WebSocket")
+                    canal = None
+            if udp_activo:
+                if en_juego and not game_over and canal.sin_snapshots():
+                    # Los datagramas no llegan (por ejemplo, un firewall): volver al WebSocket
+                    print("Sin snapshots por UDP, se vuelve al WebSocket")
+                    await websocket.send(json.dumps({"tipo": "usar_udp", "activo": False}))
+                    canal.cerrar()
+                    canal = None
+                    udp_activo = False
+                else:
+                    canal.latido((x, y) if en_juego and not game_over else None)
+
+            # ------------------------------
+            # Medición de latencia (ping/pong)
+            # ------------------------------
+            if websocket is not None:
+                mensaje_ping = reloj_servidor.crear_ping()
+                if mensaje_ping is not None:
+                    try:
+                        await websocket.send(json.dumps(mensaje_ping))
+                    except Exception as e:
+                        print(f"Error al enviar ping: {e}")
+
             # ------------------------------
             # Recibir mensajes del servidor
             # ------------------------------
             if websocket is not None:
                 try:
-                    mensaje = await asyncio.wait_for(websocket.recv(), timeout=0.005)
+                    try:
+                        # Con un snapshot UDP esperando, el WebSocket solo se revisa
+                        mensaje = await asyncio.wait_for(
+                            websocket.recv(), timeout=0.001 if canal and canal.hay_pendiente() else 0.005
+                        )
+                    except asyncio.TimeoutError:
+                        if not (canal and canal.hay_pendiente()):
+                            raise
+                        mensaje = canal.siguiente()
                     try:
                         datos = json.loads(mensaje)
                         print(f"Mensaje recibido del servidor: {datos}")
 
-                        tipo_msg = datos.get("tipo")
+                        # Un "lote" agrupa todos los mensajes de un tick del servidor
+                        # (y una "transmision" los de un intervalo, para espectadores)
+                        if datos.get("tipo") in ("lote", "transmision"):
+                            mensajes_recibidos = datos.get("mensajes", [])
+                        else:
+                            mensajes_recibidos = [datos]
 
-                        # --- Asignación de ID al entrar a sala ---
-                        if tipo_msg == "asignacion_id":
-                            player_id = datos.get("player_id")
-                            es_host = datos.get("es_host", False)
-                            codigo_sala = datos.get("codigo_sala")
-                            sprite_index = datos.get("sprite_index")
+                        # En un duelo llegan las entradas del rival en cada frame: leer también
+                        # las que ya están esperando para no acumular retraso
+                        if partida_duelo is not None:
+                            for _ in range(MAX_MENSAJES_POR_FRAME_DUELO):
+                                try:
+                                    extra = json.loads(await asyncio.wait_for(websocket.recv(), timeout=0.001))
+                                except asyncio.TimeoutError:
+                                    break
+                                if extra.get("tipo") == "lote":
+                                    mensajes_recibidos.extend(extra.get("mensajes", []))
+                                else:
+                                    mensajes_recibidos.append(extra)
+
+                        for datos in mensajes_recibidos:
+                            tipo_msg = datos.get("tipo")
+
+                            # --- Asignación de ID al entrar a sala ---
+                            if tipo_msg == "asignacion_id":
+                                player_id = datos.get("player_id")
+                                es_host = datos.get("es_host", False)
+                                codigo_sala = datos.get("codigo_sala")
+                                sprite_index = datos.get("sprite_index")
+                                token_reanudacion = datos.get("token_reanudacion", token_reanudacion)
                             
-                            # Guardar sprite_index del jugador local
-                            if sprite_index is not None:
-                                sprite_indices[player_id] = sprite_index
+                                # Guardar sprite_index del jugador local
+                                if sprite_index is not None:
+                                    sprite_indices[player_id] = sprite_index
                             
-                            print(f"Player ID asignado: {player_id} (Host: {es_host}) - Sala: {codigo_sala} - Sprite: {sprite_index}")
-
-                            # Cambiar a estado de lobby
-                            en_menu_principal = False
-                            ingresando_codigo = False
-                            en_lobby = True
-
-                            # Posición inicial
-                            x = datos.get("x", x)
-                            y = datos.get("y", y)
-                            posicion_anterior = (x, y)
-                            print(f"Posición inicial asignada: ({x}, {y})")
-
-                        # --- Error del servidor ---
-                        elif tipo_msg == "error":
-                             mensaje_error = datos.get("mensaje", "Error desconocido")
-                             print(f"❌ Error del servidor: {mensaje_error}")
-                             # Si estábamos intentando unirnos, volver a la pantalla de código
-                             if ingresando_codigo:
-                                 # Mantener en pantalla de código para que pueda intentar de nuevo
-                                 pass
-                             else:
-                                 en_menu_principal = True
-                                 ingresando_codigo = False
-                             en_lobby = False
-                             en_juego = False
-                             if websocket:
-                                 await websocket.close()
-                                 websocket = None
-
-                        # --- Estado del juego (jugadores + balas + puntuación) ---
-                        elif tipo_msg == "estado":
-                            jugadores_recibidos_raw = datos.get("jugadores", {})
-                            jugadores_recibidos = {int(pid): pos for pid, pos in jugadores_recibidos_raw.items()}
-
-                            # Sincronizar posición del jugador local con el servidor
-                            if player_id is not None and player_id in jugadores_recibidos:
-                                pos_servidor = jugadores_recibidos[player_id]
-                                servidor_x = pos_servidor["x"]
-                                servidor_y = pos_servidor["y"]
-
-                                dist_respawn = math.sqrt((x - servidor_x) ** 2 + (y - servidor_y) ** 2)
-                                # Sincronizar si hay diferencia significativa (respawn/corrección)
-                                # O si acabamos de iniciar la partida (necesitamos sincronizar posición inicial)
-                                if dist_respawn > 50 or necesita_sincronizar_posicion_inicial:
-                                    if necesita_sincronizar_posicion_inicial:
-                                        print(
-                                            f"Sincronizando posición inicial al iniciar partida: "
-                                            f"({x}, {y}) -> ({servidor_x}, {servidor_y})"
-                                        )
-                                        necesita_sincronizar_posicion_inicial = False
-                                    else:
-                                        print(
-                                            f"Respawn/corrección detectado! "
-                                            f"({x}, {y}) -> ({servidor_x}, {servidor_y})"
-                                        )
-                                    x = servidor_x
-                                    y = servidor_y
-                                    posicion_anterior = (x, y)
-                                    ultimo_envio_posicion = time.time()
-
-                            # Otros jugadores con posición del servidor
-                            estado_jugadores = {}
-                            for pid, pos in jugadores_recibidos.items():
-                                if player_id is None or pid != player_id:
-                                    estado_jugadores[pid] = pos
-
-                            # Balas
-                            balas_recibidas = datos.get("balas", {})
-
-                            # Detectar balas que desaparecieron
-                            balas_que_desaparecieron = [
-                                bala_id_ant
-                                for bala_id_ant in estado_balas_anterior.keys()
-                                if bala_id_ant not in balas_recibidas
-                            ]
-
-                            estado_balas = balas_recibidas
-
-                            # Estrella (power-up)
-                            estrella_pos = datos.get("estrella")
-
-                            # Jugadores invencibles
-                            invencibles_recibidos = datos.get("jugadores_invencibles", {})
-                            jugadores_invencibles = {
-                                int(pid): tiempo_restante 
-                                for pid, tiempo_restante in invencibles_recibidos.items()
-                            }
-
-                            # Puntuación
-                            puntuacion_recibida = datos.get("puntuacion", {})
-                            puntuacion_nueva = {
-                                int(pid): score for pid, score in puntuacion_recibida.items()
-                            }
+                                print(f"Player ID asignado: {player_id} (Host: {es_host}) - Sala: {codigo_sala} - Sprite: {sprite_index}")
 
-                            # Detectar si hubo impacto (puntuación sube)
-                            tiempo_actual_impacto = time.time()
-                            hubo_impacto = any(
-                                puntuacion_nueva.get(pid, 0) > puntuacion_anterior.get(pid, 0)
-                                for pid in puntuacion_nueva.keys()
-                            )
-
-                            # Si hubo impacto y balas desaparecieron, activar efecto daño
-                            if hubo_impacto and balas_que_desaparecieron:
-                                for bala_id_des in balas_que_desaparecieron:
-                                    if bala_id_des in estado_balas_anterior:
-                                        bala_pos = estado_balas_anterior[bala_id_des]
-                                        bx = bala_pos.get("x", 0)
-                                        by = bala_pos.get("y", 0)
-
-                                        jugador_mas_cercano = None
-                                        distancia_minima = float("inf")
-
-                                        # Jugadores remotos
-                                        for otro_pid, pos in estado_jugadores.items():
-                                            jx = pos.get("x", 0)
-                                            jy = pos.get("y", 0)
-                                            dist = math.sqrt((bx - jx) ** 2 + (by - jy) ** 2)
-                                            if dist < distancia_minima and dist < 50:
-                                                distancia_minima = dist
-                                                jugador_mas_cercano = otro_pid
-
-                                        # Jugador local
-                                        if player_id is not None:
-                                            dist_local = math.sqrt((bx - x) ** 2 + (by - y) ** 2)
-                                            if dist_local < distancia_minima and dist_local < 50:
-                                                jugador_mas_cercano = player_id
-
-                                        if jugador_mas_cercano is not None:
-                                            jugadores_danados[jugador_mas_cercano] = tiempo_actual_impacto
+                                en_menu_principal = False
+                                ingresando_codigo = False
+                                if en_cola:
+                                    en_cola = False
+                                    print(
+                                        f"Partida encontrada en {time.time() - cola_desde:.1f}s "
+                                        f"({time.time() - inicio_cliente:.1f}s desde que se abrió el cliente)"
+                                    )
+                                if datos.get("reanudado"):
+                                    # Sesión reanudada: volver a la pantalla en la que estaba la sala
+                                    reanudando_desde = None
+                                    en_juego = datos.get("estado_partida") == "jugando"
+                                    en_lobby = datos.get("estado_partida") == "lobby"
+                                    print("Sesión reanudada")
+                                else:
+                                    # Cambiar a estado de lobby
+                                    en_lobby = True
+
+                                # Posición inicial
+                                x = datos.get("x", x)
+                                y = datos.get("y", y)
+                                posicion_anterior = (x, y)
+                                print(f"Posición inicial asignada: ({x}, {y})")
+
+                                # Ofrecer el canal UDP para los snapshots
+                                if canal is None:
+                                    await websocket.send(json.dumps({"tipo": "solicitar_udp"}))
+
+                                # Declarar la tasa y el presupuesto de snapshots si no son los de siempre
+                                if TASA_SNAPSHOTS < 60 or PRESUPUESTO_SNAPSHOTS is not None:
+                                    await websocket.send(json.dumps({
+                                        "tipo": "config_snapshots",
+                                        "tasa": TASA_SNAPSHOTS,
+                                        "presupuesto": PRESUPUESTO_SNAPSHOTS
+                                    }))
+
+                            # --- Lugar en la cola de partida rápida ---
+                            elif tipo_msg == "en_cola":
+                                cola_posicion = datos.get("posicion")
+                                cola_total = datos.get("en_cola")
+
+                            # --- El servidor confirma la tasa y el presupuesto de snapshots ---
+                            elif tipo_msg == "config_snapshots":
+                                presupuesto_confirmado = datos.get("presupuesto")
+                                print(
+                                    f"Snapshots: {datos.get('tasa')}/s, "
+                                    f"{presupuesto_confirmado if presupuesto_confirmado is not None else 'sin límite de'} bytes/s"
+                                )
+
+                            # --- Canal UDP disponible: saludar al servidor por datagramas ---
+                            elif tipo_msg == "udp_disponible":
+                                if canal is None:
+                                    canal = canal_udp.CanalUDP(
+                                        urlparse(uri).hostname, datos.get("puerto"), datos.get("token")
+                                    )
+                                    tarea_canal = asyncio.create_task(canal.abrir())
+
+                            # --- El servidor dejó de recibir datagramas: todo vuelve al WebSocket ---
+                            elif tipo_msg == "udp_cerrado":
+                                print(f"Canal UDP cerrado por el servidor ({datos.get('motivo')})")
+                                if canal is not None:
+                                    canal.cerrar()
+                                canal = None
+                                tarea_canal = None
+                                udp_activo = False
+
+                            # --- Suscripción como espectador ---
+                            elif tipo_msg == "asignacion_espectador":
+                                es_espectador = True
+                                codigo_sala = datos.get("codigo_sala")
+                                en_menu_principal = False
+                                ingresando_codigo = False
+                                en_juego = datos.get("estado_partida") == "jugando"
+                                en_lobby = datos.get("estado_partida") == "lobby"
+                                pygame.display.set_caption(f"Cowboy Battle - Espectador | Sala {codigo_sala}")
+                                print(f"Mirando la sala {codigo_sala} (retraso {datos.get('retraso')}s)")
+
+                            # --- Error del servidor ---
+                            elif tipo_msg == "error":
+                                 mensaje_error = datos.get("mensaje", "Error desconocido")
+                                 print(f"❌ Error del servidor: {mensaje_error}")
+                                 if datos.get("codigo") == "reanudacion_invalida":
+                                     # La sala ya no existe o venció el lugar reservado: la partida
+                                     # se perdió, así que se descarta y se vuelve al menú principal
+                                     ingresando_codigo = False
+                                     game_over = False
+                                     player_id = None
+                                     es_host = False
+                                     codigo_sala = None
+                                     estado_sala = {}
+                                     estado_jugadores = {}
+                                     estado_balas = {}
+                                     puntuacion = {}
+                                     partida_duelo = None
+                                     token_reanudacion = None
+                                     pygame.display.set_caption("Cowboy Battle - Cliente")
+                                 reanudando_desde = None
+                                 # Si estábamos intentando unirnos, volver a la pantalla de código
+                                 if ingresando_codigo:
+                                     # Mantener en pantalla de código para que pueda intentar de nuevo
+                                     pass
+                                 else:
+                                     en_menu_principal = True
+                                     ingresando_codigo = False
+                                 en_cola = False
+                                 en_lobby = False
+                                 en_juego = False
+                                 if websocket:
+                                     await websocket.close()
+                                     websocket = None
+
+                            # --- Estado del juego (jugadores + balas + puntuación) ---
+                            elif tipo_msg == "estado":
+                                reloj_servidor.registrar_snapshot(datos)
+                                jugadores_recibidos_raw = datos.get("jugadores", {})
+                                jugadores_recibidos = {int(pid): pos for pid, pos in jugadores_recibidos_raw.items()}
+                                presentes = datos.get("presentes") if datos.get("parcial") else None
+                                if presentes is not None:
+                                    # Snapshot parcial: los rivales que no vinieron conservan su última posición
+                                    for pid in presentes.get("jugadores", []):
+                                        if pid not in jugadores_recibidos and pid in estado_jugadores:
+                                            jugadores_recibidos[pid] = estado_jugadores[pid]
+
+                                # Sincronizar posición del jugador local con el servidor
+                                if player_id is not None and player_id in jugadores_recibidos:
+                                    pos_servidor = jugadores_recibidos[player_id]
+                                    servidor_x = pos_servidor["x"]
+                                    servidor_y = pos_servidor["y"]
+
+                                    dist_respawn = math.sqrt((x - servidor_x) ** 2 + (y - servidor_y) ** 2)
+                                    # Sincronizar si hay diferencia significativa (respawn/corrección)
+                                    # O si acabamos de iniciar la partida (necesitamos sincronizar posición inicial)
+                                    if dist_respawn > 50 or necesita_sincronizar_posicion_inicial:
+                                        if necesita_sincronizar_posicion_inicial:
+                                            print(
+                                                f"Sincronizando posición inicial al iniciar partida: "
+                                                f"({x}, {y}) -> ({servidor_x}, {servidor_y})"
+                                            )
+                                            necesita_sincronizar_posicion_inicial = False
+                                        else:
                                             print(
-                                                f"Jugador {jugador_mas_cercano} fue golpeado! "
-                                                f"Mostrando imagen de daño"
+                                                f"Respawn/corrección detectado! "
+                                                f"({x}, {y}) -> ({servidor_x}, {servidor_y})"
                                             )
+                                        x = servidor_x
+                                        y = servidor_y
+                                        posicion_anterior = (x, y)
+                                        ultimo_envio_posicion = time.time()
+
+                                # Otros jugadores con posición del servidor
+                                estado_jugadores = {}
+                                for pid, pos in jugadores_recibidos.items():
+                                    if player_id is None or pid != player_id:
+                                        estado_jugadores[pid] = pos
+
+                                # Balas
+                                balas_recibidas = datos.get("balas", {})
+                                tick_snapshot = datos.get("tick", 0)
+                                if presentes is not None:
+                                    # Las balas que no vinieron siguen avanzando con su velocidad
+                                    for bala_id in map(str, presentes.get("balas", [])):
+                                        if bala_id in balas_recibidas:
+                                            balas_recibidas[bala_id]["tick"] = tick_snapshot
+                                        elif "vx" in estado_balas.get(bala_id, {}):
+                                            bala = dict(estado_balas[bala_id])
+                                            ticks = tick_snapshot - bala["tick"]
+                                            bala["x"] += bala["vx"] * ticks
+                                            bala["y"] += bala["vy"] * ticks
+                                            bala["tick"] = tick_snapshot
+                                            balas_recibidas[bala_id] = bala
+
+                                # Detectar balas que desaparecieron
+                                balas_que_desaparecieron = [
+                                    bala_id_ant
+                                    for bala_id_ant in estado_balas_anterior.keys()
+                                    if bala_id_ant not in balas_recibidas
+                                ]
+
+                                estado_balas = balas_recibidas
+
+                                # Estrella (power-up); en un parcial puede no venir aunque siga en el mapa
+                                if presentes is None or "estrella" in datos or not presentes.get("estrella"):
+                                    estrella_pos = datos.get("estrella")
+
+                                # Jugadores invencibles
+                                invencibles_recibidos = datos.get("jugadores_invencibles", {})
+                                jugadores_invencibles = {
+                                    int(pid): tiempo_restante 
+                                    for pid, tiempo_restante in invencibles_recibidos.items()
+                                }
 
-                            puntuacion = puntuacion_nueva
-                            puntuacion_anterior = puntuacion_nueva.copy()
-                            estado_balas_anterior = estado_balas.copy()
-
-                            # Limpiar estados de daño expirados
-                            tiempo_limpieza = time.time()
-                            jugadores_a_remover = [
-                                pid for pid, t_d in list(jugadores_danados.items())
-                                if tiempo_limpieza - t_d >= DURACION_DANO
-                            ]
-                            for pid in jugadores_a_remover:
-                                del jugadores_danados[pid]
-
-                        # --- Estado de sala (lobby) ---
-                        elif tipo_msg == "estado_sala":
-                            estado_sala = datos
-                            if "codigo_sala" in datos:
-                                codigo_sala = datos.get("codigo_sala")
+                                # Puntuación
+                                puntuacion_recibida = datos.get("puntuacion", {})
+                                puntuacion_nueva = {
+                                    int(pid): score for pid, score in puntuacion_recibida.items()
+                                }
 
-                            # Actualizar sprite_indices de todos los jugadores
-                            jugadores_sala = datos.get("jugadores", {})
-                            for pid_str, info in jugadores_sala.items():
-                                pid = int(pid_str)
-                                sprite_idx = info.get("sprite_index")
-                                if sprite_idx is not None:
-                                    sprite_indices[pid] = sprite_idx
-
-                            if player_id is not None:
-                                if str(player_id) in jugadores_sala:
-                                    yo_listo = jugadores_sala[str(player_id)].get("listo", False)
-                                host_id_sala = datos.get("host_id")
-                                es_host = (host_id_sala == player_id)
-
-                        # --- Inicio de partida ---
-                        elif tipo_msg == "start_game":
-                            en_lobby = False
-                            en_juego = True
-                            game_over = False
-                            print("¡Comienza la partida!")
-                            puede_disparar = True
-                            # Marcar que necesitamos sincronizar la posición inicial
-                            necesita_sincronizar_posicion_inicial = True
-
-                        # --- Game over ---
-                        elif tipo_msg == "game_over":
-                            game_over = True
-                            en_juego = False
-                            ganador_id = datos.get("ganador")
-                            motivo_victoria = datos.get("motivo")  # "abandono" o None
-                            puntuacion_recibida = datos.get("puntuacion", {})
-                            puntuacion = {
-                                int(pid): score for pid, score in puntuacion_recibida.items()
-                            }
-                            if motivo_victoria == "abandono":
-                                print(f"Game over por abandono. Ganador: Jugador {ganador_id}")
-                            else:
-                                print(f"Game over. Ganador: Jugador {ganador_id}")
+                                # Detectar si hubo impacto (puntuación sube)
+                                tiempo_actual_impacto = time.time()
+                                hubo_impacto = any(
+                                    puntuacion_nueva.get(pid, 0) > puntuacion_anterior.get(pid, 0)
+                                    for pid in puntuacion_nueva.keys()
+                                )
+
+                                # Si hubo impacto y balas desaparecieron, activar efecto daño
+                                if hubo_impacto and balas_que_desaparecieron:
+                                    for bala_id_des in balas_que_desaparecieron:
+                                        if bala_id_des in estado_balas_anterior:
+                                            bala_pos = estado_balas_anterior[bala_id_des]
+                                            bx = bala_pos.get("x", 0)
+                                            by = bala_pos.get("y", 0)
+
+                                            jugador_mas_cercano = None
+                                            distancia_minima = float("inf")
+
+                                            # Jugadores remotos
+                                            for otro_pid, pos in estado_jugadores.items():
+                                                jx = pos.get("x", 0)
+                                                jy = pos.get("y", 0)
+                                                dist = math.sqrt((bx - jx) ** 2 + (by - jy) ** 2)
+                                                if dist < distancia_minima and dist < 50:
+                                                    distancia_minima = dist
+                                                    jugador_mas_cercano = otro_pid
+
+                                            # Jugador local
+                                            if player_id is not None:
+                                                dist_local = math.sqrt((bx - x) ** 2 + (by - y) ** 2)
+                                                if dist_local < distancia_minima and dist_local < 50:
+                                                    jugador_mas_cercano = player_id
+
+                                            if jugador_mas_cercano is not None:
+                                                jugadores_danados[jugador_mas_cercano] = tiempo_actual_impacto
+                                                print(
+                                                    f"Jugador {jugador_mas_cercano} fue golpeado! "
+                                                    f"Mostrando imagen de daño"
+                                                )
+
+                                puntuacion = puntuacion_nueva
+                                puntuacion_anterior = puntuacion_nueva.copy()
+                                estado_balas_anterior = estado_balas.copy()
+
+                                # Limpiar estados de daño expirados
+                                tiempo_limpieza = time.time()
+                                jugadores_a_remover = [
+                                    pid for pid, t_d in list(jugadores_danados.items())
+                                    if tiempo_limpieza - t_d >= DURACION_DANO
+                                ]
+                                for pid in jugadores_a_remover:
+                                    del jugadores_danados[pid]
+
+                            # --- Respuesta a ping: actualizar medidas de red ---
+                            elif tipo_msg == "pong":
+                                reloj_servidor.procesar_pong(datos)
+                                if reloj_servidor.rtt is not None:
+                                    pygame.display.set_caption(
+                                        f"Cowboy Battle - Cliente | RTT {reloj_servidor.rtt * 1000:.0f} ms "
+                                        f"(jitter {reloj_servidor.jitter * 1000:.0f} ms)"
+                                    )
+
+                            # --- Estado de sala (lobby) ---
+                            elif tipo_msg == "estado_sala":
+                                estado_sala = datos
+                                if "codigo_sala" in datos:
+                                    codigo_sala = datos.get("codigo_sala")
+
+                                # Actualizar sprite_indices de todos los jugadores
+                                jugadores_sala = datos.get("jugadores", {})
+                                for pid_str, info in jugadores_sala.items():
+                                    pid = int(pid_str)
+                                    sprite_idx = info.get("sprite_index")
+                                    if sprite_idx is not None:
+                                        sprite_indices[pid] = sprite_idx
+
+                                if player_id is not None:
+                                    if str(player_id) in jugadores_sala:
+                                        yo_listo = jugadores_sala[str(player_id)].get("listo", False)
+                                    host_id_sala = datos.get("host_id")
+                                    es_host = (host_id_sala == player_id)
+
+                            # --- Inicio de partida ---
+                            elif tipo_msg == "start_game":
+                                en_lobby = False
+                                en_juego = True
+                                game_over = False
+                                print("¡Comienza la partida!")
+                                puede_disparar = True
+                                # Marcar que necesitamos sincronizar la posición inicial
+                                necesita_sincronizar_posicion_inicial = True
+                                if udp_activo:
+                                    canal.esperar_snapshots()
+
+                            # --- Duelo: empieza (o se resincroniza) la simulación con rollback ---
+                            elif tipo_msg == "inicio_duelo":
+                                ids_duelo = datos.get("ids", [])
+                                if player_id in ids_duelo:
+                                    t_inicio = datos.get("t_inicio", 0.0)
+                                    if reloj_servidor.desfase is not None:
+                                        inicio_local = t_inicio - reloj_servidor.desfase
+                                    else:
+                                        # Sin medición del reloj todavía: suponer que el mensaje llegó al instante
+                                        inicio_local = reloj_servidor.ahora() + t_inicio - datos.get("t_servidor", t_inicio)
+                                    partida_duelo = rollback.SesionRollback(
+                                        datos.get("sesion"),
+                                        ids_duelo.index(player_id),
+                                        duelo.EstadoDuelo.desde_dict(datos["estado"]),
+                                        inicio_local,
+                                    )
+                                    frame_entrada, entradas = partida_duelo.entradas_iniciales()
+                                    await websocket.send(json.dumps({
+                                        "tipo": "entrada",
+                                        "s": partida_duelo.sesion,
+                                        "f": frame_entrada,
+                                        "e": entradas,
+                                    }))
+                                    en_juego = True
+                                    estado_jugadores = {}
+                                    print(f"Duelo con rollback desde el frame {partida_duelo.estado.frame}")
+
+                            # --- Duelo: entradas del rival ---
+                            elif tipo_msg == "entrada":
+                                if partida_duelo is not None and datos.get("s") == partida_duelo.sesion:
+                                    partida_duelo.recibir_entradas(datos.get("f", 0), datos.get("e", []))
+
+                            # --- Duelo: suma de control del estado del servidor ---
+                            elif tipo_msg == "control_duelo":
+                                if partida_duelo is not None and datos.get("s") == partida_duelo.sesion:
+                                    partida_duelo.verificar(datos.get("f", 0), datos.get("suma"))
+
+                            # --- Game over ---
+                            elif tipo_msg == "game_over":
+                                game_over = True
+                                en_juego = False
+                                if partida_duelo is not None:
+                                    print(
+                                        f"Duelo terminado: {partida_duelo.rollbacks} rollbacks, "
+                                        f"{partida_duelo.frames_resimulados} frames re-simulados, "
+                                        f"profundidad máxima {partida_duelo.profundidad_maxima}"
+                                    )
+                                    partida_duelo = None
+                                ganador_id = datos.get("ganador")
+                                motivo_victoria = datos.get("motivo")  # "abandono" o None
+                                puntuacion_recibida = datos.get("puntuacion", {})
+                                puntuacion = {
+                                    int(pid): score for pid, score in puntuacion_recibida.items()
+                                }
+                                if motivo_victoria == "abandono":
+                                    print(f"Game over por abandono. Ganador: Jugador {ganador_id}")
+                                else:
+                                    print(f"Game over. Ganador: Jugador {ganador_id}")
+                                # Pedir el ranking actualizado para mostrarlo junto al marcador
+                                ranking = []
+                                await websocket.send(json.dumps({"tipo": "ranking", "limite": 5}))
+
+                            # --- Ranking de jugadores ---
+                            elif tipo_msg == "ranking":
+                                ranking = datos.get("jugadores", [])
 
                     except json.JSONDecodeError:
                         print(f"Mensaje recibido (texto plano): {mensaje}")
@@ -727,14 +1238,37 @@ async def cliente():
                 except asyncio.TimeoutError:
                     # No hay mensajes, continuar con el loop
                     pass
-                except websockets.exceptions.ConnectionClosed:
+                except websockets.exceptions.ConnectionClosed as e:
                     print("Conexión cerrada por el servidor")
-                    if en_lobby:
-                        # Volver al menú principal si se desconecta en lobby
+                    # 1012 = el servidor se reinicia y restaurará la sala en el proceso nuevo
+                    reinicio_servidor = e.rcvd is not None and e.rcvd.code == 1012
+                    if token_reanudacion is not None and not game_over and (en_juego or reinicio_servidor):
+                        # Corte en plena partida o reinicio: reintentar y reanudar con el token
+                        websocket = None
+                        if reanudando_desde is None:
+                            reanudando_desde = time.time()
+                            pygame.display.set_caption("Cowboy Battle - Cliente | Reconectando...")
+                    elif not en_juego and not game_over:
+                        # Volver al menú principal si se desconecta antes de la partida
+                        # (en lobby o porque el servidor rechazó la conexión)
                         en_menu_principal = True
+                        ingresando_codigo = False
+                        en_cola = False
                         en_lobby = False
+                        websocket = None
+                        if e.rcvd is not None and e.rcvd.reason:
+                            mensaje_error = e.rcvd.reason
+                    elif game_over:
+                        # La sala terminó y el servidor la liberó: seguir mostrando los resultados
+                        websocket = None
+                    elif es_espectador:
+                        # La sala que se estaba mirando se cerró
+                        en_menu_principal = True
                         en_juego = False
+                        es_espectador = False
                         websocket = None
+                        if e.rcvd is not None and e.rcvd.reason:
+                            mensaje_error = e.rcvd.reason
                     else:
                         corriendo = False
 
@@ -750,6 +1284,17 @@ async def cliente():
                     mensaje_error,
                 )
 
+            elif en_cola:
+                theme.draw_en_cola(
+                    pantalla,
+                    ANCHO_VENTANA,
+                    ALTO_VENTANA,
+                    nombre_jugador,
+                    cola_posicion,
+                    cola_total,
+                    time.time() - cola_desde,
+                )
+
             elif ingresando_codigo:
                 theme.draw_ingresar_codigo(
                     pantalla,
@@ -789,6 +1334,7 @@ async def cliente():
                     puntuacion,
                     nombres_jugadores,
                     motivo_victoria,
+                    ranking,
                 )
 
             else:
@@ -395,7 +395,7 @@ def draw_menu_principal(
     _draw_background_cowboy(pantalla)
 
     panel_width = int(ancho * 0.5)
-    panel_height = int(alto * 0.4)
+    panel_height = int(alto * 0.5)
     panel_x = (ancho - panel_width) // 2
     panel_y = (alto - panel_height) // 2
     _draw_panel(pantalla, panel_x, panel_y, panel_width, panel_height, alpha=220)
@@ -421,7 +421,7 @@ def draw_menu_principal(
     )
     pantalla.blit(texto_render, (campo_nombre_x + 10, campo_nombre_y + 8))
 
-    boton_y = panel_y + panel_height - 70
+    boton_y = panel_y + panel_height - 130
     boton_h = 50
     boton_w = 180
     espacio = 30
@@ -440,11 +440,56 @@ def draw_menu_principal(
     texto_unirse = FONT_SUBTITULO.render("Unirse", True, (255, 255, 255))
     pantalla.blit(texto_unirse, (boton_unirse_x + (boton_w - texto_unirse.get_width()) // 2, boton_y + 12))
 
+    # Partida rápida: ocupa el ancho de los dos botones de arriba
+    boton_rapida_y = boton_y + boton_h + 10
+    boton_rapida_rect = pygame.Rect(boton_crear_x, boton_rapida_y, boton_w * 2 + espacio, boton_h)
+    color_rapida = (200, 120, 0) if texto_ingresado else (100, 100, 100)
+    pygame.draw.rect(pantalla, color_rapida, boton_rapida_rect, border_radius=5)
+    texto_rapida = FONT_SUBTITULO.render("Partida Rápida", True, (255, 255, 255))
+    pantalla.blit(
+        texto_rapida,
+        (boton_rapida_rect.x + (boton_rapida_rect.w - texto_rapida.get_width()) // 2, boton_rapida_y + 12)
+    )
+
     if mensaje_error:
         error_texto = FONT_PEQUE.render(mensaje_error, True, (255, 100, 100))
         pantalla.blit(error_texto, (panel_x + 30, panel_y + panel_height - 30))
 
-    return boton_crear_rect, boton_unirse_rect, campo_nombre_rect
+    return boton_crear_rect, boton_unirse_rect, boton_rapida_rect, campo_nombre_rect
+
+
+def draw_en_cola(
+    pantalla,
+    ancho: int,
+    alto: int,
+    nombre_jugador: str,
+    posicion: int | None,
+    en_cola: int | None,
+    segundos: float
+):
+    _draw_background_cowboy(pantalla)
+
+    panel_width = int(ancho * 0.5)
+    panel_height = int(alto * 0.35)
+    panel_x = (ancho - panel_width) // 2
+    panel_y = (alto - panel_height) // 2
+    _draw_panel(pantalla, panel_x, panel_y, panel_width, panel_height, alpha=220)
+
+    titulo = FONT_TITULO.render("Buscando partida...", True, (255, 230, 180))
+    pantalla.blit(titulo, (panel_x + (panel_width - titulo.get_width()) // 2, panel_y + 20))
+
+    nombre_texto = FONT_TEXTO.render(f"Jugador: {nombre_jugador}", True, (255, 255, 255))
+    pantalla.blit(nombre_texto, (panel_x + 30, panel_y + 85))
+
+    if posicion is not None:
+        cola_texto = FONT_TEXTO.render(f"Lugar en la cola: {posicion} de {en_cola}", True, (255, 255, 255))
+        pantalla.blit(cola_texto, (panel_x + 30, panel_y + 115))
+
+    espera_texto = FONT_TEXTO.render(f"Esperando: {int(segundos)}s", True, (255, 255, 255))
+    pantalla.blit(espera_texto, (panel_x + 30, panel_y + 145))
+
+    ayuda = FONT_PEQUE.render("ESC para cancelar", True, (220, 220, 220))
+    pantalla.blit(ayuda, (panel_x + (panel_width - ayuda.get_width()) // 2, panel_y + panel_height - 30))
 
 
 def draw_ingresar_codigo(
@@ -502,15 +547,15 @@ def draw_ingresar_codigo(
     pantalla.blit(codigo_render, (campo_codigo_x + 10, campo_codigo_y + 8))
 
     boton_h = 50
-    boton_w = 150
-    espacio = 20
+    boton_w = 110
+    espacio = 15
     boton_y = campo_codigo_y + campo_codigo_h + 10
 
     limite_inferior_panel = panel_y + panel_height
     max_boton_y = limite_inferior_panel - boton_h - 20
     boton_y = min(boton_y, max_boton_y)
 
-    boton_cancelar_x = panel_x + (panel_width - (boton_w * 2 + espacio)) // 2
+    boton_cancelar_x = panel_x + (panel_width - (boton_w * 3 + espacio * 2)) // 2
     boton_cancelar_rect = pygame.Rect(boton_cancelar_x, boton_y, boton_w, boton_h)
     pygame.draw.rect(pantalla, (150, 150, 150), boton_cancelar_rect, border_radius=5)
     texto_cancelar = FONT_SUBTITULO.render("Cancelar", True, (255, 255, 255))
@@ -531,6 +576,17 @@ def draw_ingresar_codigo(
          boton_y + 12)
     )
 
+    boton_espectar_x = boton_unirse_x + boton_w + espacio
+    boton_espectar_rect = pygame.Rect(boton_espectar_x, boton_y, boton_w, boton_h)
+    color_espectar = (140, 90, 40) if texto_codigo.strip() else (100, 100, 100)
+    pygame.draw.rect(pantalla, color_espectar, boton_espectar_rect, border_radius=5)
+    texto_espectar = FONT_SUBTITULO.render("Mirar", True, (255, 255, 255))
+    pantalla.blit(
+        texto_espectar,
+        (boton_espectar_x + (boton_w - texto_espectar.get_width()) // 2,
+         boton_y + 12)
+    )
+
     if mensaje_error:
         error_texto = FONT_PEQUE.render(mensaje_error, True, (255, 100, 100))
         error_y = boton_y + boton_h + 10
@@ -538,7 +594,7 @@ def draw_ingresar_codigo(
             error_y = limite_inferior_panel - 10 - error_texto.get_height()
         pantalla.blit(error_texto, (panel_x + 30, error_y))
 
-    return boton_cancelar_rect, boton_unirse_rect, campo_codigo_rect
+    return boton_cancelar_rect, boton_unirse_rect, boton_espectar_rect, campo_codigo_rect
 
 
 # ------------------------------------------------------------
@@ -625,6 +681,9 @@ def draw_lobby_screen(
             if player_id is not None and int(pid_str) == player_id:
                 color_nombre = (0, 230, 255)
                 etiqueta = "(Tú)"
+            elif info.get("es_bot", False):
+                color_nombre = (200, 200, 200)
+                etiqueta = "(Bot)"
             else:
                 color_nombre = (255, 255, 255)
                 etiqueta = ""
@@ -664,6 +723,14 @@ def draw_lobby_screen(
     color_estado = (0, 255, 120) if yo_listo else (255, 120, 120)
     texto_estado = FONT_TEXTO.render(f"Tu estado: {estado_txt}", True, color_estado)
     pantalla.blit(texto_estado, (panel_x + 20, y_controles))
+
+    # Modo de la partida (el host lo cambia con D)
+    if estado_sala.get("modo") == "duelo":
+        modo_txt = "Duelo 1 vs 1" if num_jugadores == 2 else "Duelo 1 vs 1 (solo con 2 jugadores)"
+    else:
+        modo_txt = "Normal"
+    texto_modo = FONT_PEQUE.render(f"Modo: {modo_txt}{' - D: cambiar' if es_host else ''}", True, (255, 230, 180))
+    pantalla.blit(texto_modo, (panel_x + panel_width - texto_modo.get_width() - 20, y_controles + 4))
     y_controles += 30
     
     # Si es el host, mostrar botón de iniciar partida
@@ -687,7 +754,7 @@ def draw_lobby_screen(
         # Mensaje de ayuda
         if not boton_habilitado:
             if num_jugadores < 2:
-                msg_ayuda = "Se necesitan al menos 2 jugadores"
+                msg_ayuda = "Se necesitan al menos 2 jugadores (B: agregar un bot)"
             else:
                 msg_ayuda = "Todos los jugadores deben estar listos"
             texto_ayuda = FONT_PEQUE.render(msg_ayuda, True, (255, 200, 100))
@@ -880,7 +947,8 @@ def draw_game_over_screen(
     ganador_id: int | None,
     puntuacion: Dict[int, int],
     nombres_jugadores: Dict[int, str] = None,
-    motivo_victoria: str = None
+    motivo_victoria: str = None,
+    ranking: list = None
 ):
     _draw_background_cowboy(pantalla)
 
@@ -946,6 +1014,23 @@ def draw_game_over_screen(
         pantalla.blit(linea, (panel_x + 40, y))
         y += 26
 
+    # Ranking del servidor en la columna derecha (llega poco después del game over)
+    if ranking:
+        y_ranking = panel_y + 130
+        columna_x = panel_x + panel_width // 2 + 20
+        encabezado_ranking = FONT_SUBTITULO.render("Ranking:", True, (255, 230, 180))
+        pantalla.blit(encabezado_ranking, (columna_x, y_ranking))
+        y_ranking += 35
+        for entrada in ranking:
+            linea = FONT_TEXTO.render(
+                f"{entrada['posicion']}. {entrada['nombre']} ({entrada['victorias']} V)",
+                True,
+                (255, 255, 255)
+            )
+            pantalla.blit(linea, (columna_x + 10, y_ranking))
+            y_ranking += 26
+        y = max(y, y_ranking)
+
     # Botones al final - calcular posición dinámicamente basado en número de jugadores
     # Asegurar al menos 50 píxeles de espacio después del último nombre
     # Y que queden dentro del panel con un margen inferior de 20 píxeles
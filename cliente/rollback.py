@@ -0,0 +1,172 @@
+"""
+Rollback del modo duelo de Cowboy Battle.
+El cliente simula el duelo sin esperar al rival: usa su propia entrada (con un
+pequeño retraso) y predice la del rival repitiendo la última conocida. Cuando
+llega la entrada real de un frame ya simulado y no coincide con la predicha,
+vuelve al último estado confirmado y re-simula hasta el frame actual.
+"""
+
+from typing import Dict, List, Tuple
+
+import duelo
+
+# Frames de retraso de la entrada local: le dan tiempo a llegar al rival sin que tenga que predecirla
+RETRASO_ENTRADA = 2
+
+# Máximo de frames que se simulan por delante de la última entrada confirmada del rival
+MAX_PREDICCION = 8
+
+# Máximo de frames que se simulan en una llamada (para ponerse al día sin congelar la pantalla)
+MAX_FRAMES_POR_LLAMADA = 10
+
+# Cada cuántos frames se compara el estado confirmado con el del servidor (debe coincidir con el servidor)
+FRAMES_ENTRE_CONTROLES = 60
+
+# Sumas propias que se guardan esperando la del servidor
+MAX_SUMAS_PENDIENTES = 10
+
+
+class SesionRollback:
+    """
+    Duelo en curso visto por un cliente.
+
+    - `estado`: estado actual (predicho) que se dibuja
+    - `confirmado`: estado en el primer frame cuya entrada del rival aún no llegó
+    - `inicio_local`: hora (reloj local) que corresponde al frame `frame_inicio`
+    - `sesion`: número de sesión del servidor (cambia al resincronizar)
+    """
+
+    def __init__(self, sesion: int, indice_local: int, estado: duelo.EstadoDuelo, inicio_local: float):
+        self.sesion = sesion
+        self.local = indice_local
+        self.remoto = 1 - indice_local
+        self.frame_inicio = estado.frame
+        self.inicio_local = inicio_local
+        self.estado = estado.copiar()
+        self.confirmado = estado.copiar()
+        # Entradas conocidas por jugador: frame -> bits (las locales de los primeros frames son 0)
+        self.entradas: Tuple[Dict[int, int], Dict[int, int]] = ({}, {})
+        for frame in range(estado.frame, estado.frame + RETRASO_ENTRADA):
+            self.entradas[self.local][frame] = 0
+        self.ultima_remota = 0
+        self.predicciones: Dict[int, int] = {}  # frame -> entrada del rival que se supuso
+        self.volver_desde: int | None = None     # Primer frame mal predicho desde el último avance
+        # Sumas de verificación (frame -> suma) que esperan a la otra parte para compararse
+        self.sumas_propias: Dict[int, int] = {}
+        self.sumas_servidor: Dict[int, int] = {}
+        self.desincronizado = False
+        # Estadísticas
+        self.rollbacks = 0
+        self.frames_resimulados = 0
+        self.profundidad_maxima = 0
+        self.frames_en_espera = 0
+
+    def entradas_iniciales(self) -> Tuple[int, List[int]]:
+        """Entradas locales de los primeros RETRASO_ENTRADA frames (se envían al empezar)."""
+        return self.frame_inicio, [0] * RETRASO_ENTRADA
+
+    def frame_objetivo(self, ahora: float) -> int:
+        """Frame en el que debería estar la simulación a la hora local `ahora`."""
+        return self.frame_inicio + int((ahora - self.inicio_local) * duelo.FRAMES_POR_SEGUNDO)
+
+    def _entrada_rival(self, frame: int) -> int:
+        entrada = self.entradas[self.remoto].get(frame)
+        if entrada is None:
+            # Predicción: sigue moviéndose igual, pero no se inventan disparos
+            entrada = self.ultima_remota & ~duelo.DISPARO
+            self.predicciones[frame] = entrada
+        return entrada
+
+    def _entradas(self, frame: int) -> Tuple[int, int]:
+        local = self.entradas[self.local][frame]
+        rival = self._entrada_rival(frame)
+        return (local, rival) if self.local == 0 else (rival, local)
+
+    def recibir_entradas(self, frame: int, entradas: List[int]):
+        """Registra entradas del rival desde `frame` y marca si hay que volver atrás."""
+        for desplazamiento, entrada in enumerate(entradas):
+            actual = frame + desplazamiento
+            if actual < self.confirmado.frame or actual in self.entradas[self.remoto]:
+                continue
+            self.entradas[self.remoto][actual] = entrada
+            self.ultima_remota = entrada
+            predicha = self.predicciones.pop(actual, None)
+            if predicha is not None and predicha != entrada:
+                if self.volver_desde is None or actual < self.volver_desde:
+                    self.volver_desde = actual
+
+    def _avanzar_confirmado(self):
+        """Avanza el estado confirmado mientras se conozcan las entradas de los dos jugadores."""
+        while (self.confirmado.frame in self.entradas[self.remoto]
+               and self.confirmado.frame in self.entradas[self.local]
+               and self.confirmado.frame < self.estado.frame):
+            frame = self.confirmado.frame
+            duelo.avanzar(self.confirmado, self._entradas(frame))
+            # Las entradas de frames confirmados ya no se necesitan
+            self.entradas[self.remoto].pop(frame)
+            self.entradas[self.local].pop(frame)
+            if self.confirmado.frame % FRAMES_ENTRE_CONTROLES == 0:
+                self._comparar_suma(self.confirmado.frame, propia=self.confirmado.suma())
+
+    def _volver_atras(self):
+        """Re-simula desde el estado confirmado hasta el frame actual con las entradas corregidas."""
+        frame_actual = self.estado.frame
+        self.estado = self.confirmado.copiar()
+        while self.estado.frame < frame_actual:
+            duelo.avanzar(self.estado, self._entradas(self.estado.frame))
+        profundidad = frame_actual - self.volver_desde
+        self.rollbacks += 1
+        self.frames_resimulados += frame_actual - self.confirmado.frame
+        self.profundidad_maxima = max(self.profundidad_maxima, profundidad)
+        self.volver_desde = None
+
+    def actualizar(self, ahora: float, entrada_local: int) -> Tuple[int, List[int]] | None:
+        """
+        Corrige lo mal predicho y avanza la simulación hasta el frame que
+        corresponde a `ahora`. Devuelve las entradas locales nuevas (frame inicial
+        y lista) para enviarlas al servidor, o None si no se avanzó.
+        """
+        if self.volver_desde is not None:
+            self._volver_atras()
+
+        primer_frame = self.estado.frame + RETRASO_ENTRADA
+        nuevas: List[int] = []
+        objetivo = min(self.frame_objetivo(ahora), self.estado.frame + MAX_FRAMES_POR_LLAMADA)
+        while self.estado.frame < objetivo:
+            if self.estado.frame - self.confirmado.frame >= MAX_PREDICCION:
+                # Demasiado adelante del rival: esperar a sus entradas
+                self.frames_en_espera += 1
+                break
+            # Un disparo cuenta solo en el primer frame (mantener la tecla no dispara de nuevo)
+            entrada = entrada_local if not nuevas else entrada_local & ~duelo.DISPARO
+            self.entradas[self.local][self.estado.frame + RETRASO_ENTRADA] = entrada
+            nuevas.append(entrada)
+            duelo.avanzar(self.estado, self._entradas(self.estado.frame))
+        self._avanzar_confirmado()
+        if not nuevas:
+            return None
+        return primer_frame, nuevas
+
+    def _comparar_suma(self, frame: int, propia: int | None = None, servidor: int | None = None):
+        if propia is None:
+            propia = self.sumas_propias.pop(frame, None)
+        if servidor is None:
+            servidor = self.sumas_servidor.pop(frame, None)
+        if propia is None or servidor is None:
+            # Falta una de las dos: guardar la que llegó (sin acumular de más)
+            pendientes = self.sumas_propias if propia is not None else self.sumas_servidor
+            pendientes[frame] = propia if propia is not None else servidor
+            if len(pendientes) > MAX_SUMAS_PENDIENTES:
+                del pendientes[min(pendientes)]
+            return
+        if propia != servidor:
+            self.desincronizado = True
+
+    def verificar(self, frame: int, suma: int):
+        """
+        Compara la suma de verificación del servidor en `frame` con la del estado
+        confirmado propio (ahora o cuando se confirme). Si difieren, marca `desincronizado`.
+        """
+        if frame < self.confirmado.frame and frame not in self.sumas_propias:
+            return
+        self._comparar_suma(frame, servidor=suma)
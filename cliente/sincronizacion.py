@@ -0,0 +1,109 @@
+"""
+Sincronización de reloj con el servidor de Cowboy Battle.
+Mide continuamente RTT, jitter y el desfase entre el reloj local y el del servidor
+mediante mensajes ping/pong, para usar medidas reales en vez de suposiciones.
+"""
+
+import time
+from collections import deque
+from typing import Any, Dict
+
+# Cada cuánto se envía un ping al servidor (en segundos)
+INTERVALO_PING = 1.0
+
+# Pesos de los promedios móviles (los mismos que usa TCP para el RTT)
+SUAVIZADO_RTT = 0.125
+SUAVIZADO_JITTER = 0.25
+
+# Cantidad de muestras recientes de las que se toma el desfase
+MUESTRAS_DESFASE = 8
+
+
+class RelojSincronizado:
+    """
+    Estima la latencia y el reloj del servidor.
+
+    - `rtt`: tiempo de ida y vuelta suavizado (segundos)
+    - `jitter`: variación promedio del RTT (segundos)
+    - `desfase`: cuánto hay que sumar al reloj local para obtener el del servidor
+    - `tick_servidor`: último tick del servidor recibido
+    """
+
+    def __init__(self):
+        self.rtt: float | None = None
+        self.jitter = 0.0
+        self.desfase: float | None = None
+        self.tick_servidor: int | None = None
+        self.siguiente_id = 1
+        self.ultimo_ping = 0.0
+        # (rtt, desfase) de las últimas muestras: el desfase más fiable es el de menor RTT
+        self.muestras: deque = deque(maxlen=MUESTRAS_DESFASE)
+
+    @staticmethod
+    def ahora() -> float:
+        """Reloj local usado para todas las medidas."""
+        return time.monotonic()
+
+    def crear_ping(self) -> Dict[str, Any] | None:
+        """Devuelve el siguiente ping si ya toca enviarlo, o None."""
+        ahora = self.ahora()
+        if ahora - self.ultimo_ping < INTERVALO_PING:
+            return None
+        self.ultimo_ping = ahora
+
+        ping = {
+            "tipo": "ping",
+            "id": self.siguiente_id,
+            "t_cliente": ahora,
+        }
+        self.siguiente_id += 1
+        # Compartir con el servidor lo que se ha medido hasta ahora
+        if self.rtt is not None:
+            ping["rtt"] = self.rtt
+            ping["jitter"] = self.jitter
+            ping["desfase"] = self.desfase
+        return ping
+
+    def procesar_pong(self, datos: Dict[str, Any]):
+        """Actualiza las estimaciones con la respuesta del servidor a un ping."""
+        ahora = self.ahora()
+        t_cliente = datos.get("t_cliente")
+        t_servidor = datos.get("t_servidor")
+        if t_cliente is None or t_servidor is None:
+            return
+
+        muestra_rtt = ahora - t_cliente
+        if muestra_rtt < 0:
+            return
+
+        if self.rtt is None:
+            self.rtt = muestra_rtt
+            self.jitter = muestra_rtt / 2
+        else:
+            self.jitter += SUAVIZADO_JITTER * (abs(muestra_rtt - self.rtt) - self.jitter)
+            self.rtt += SUAVIZADO_RTT * (muestra_rtt - self.rtt)
+
+        # El servidor respondió, en promedio, a mitad del viaje
+        self.muestras.append((muestra_rtt, t_servidor + muestra_rtt / 2 - ahora))
+        self.desfase = min(self.muestras)[1]
+
+        if datos.get("tick") is not None:
+            self.tick_servidor = datos["tick"]
+
+    def registrar_snapshot(self, datos: Dict[str, Any]):
+        """Guarda el tick del servidor de un snapshot recibido."""
+        if datos.get("tick") is not None:
+            self.tick_servidor = datos["tick"]
+
+    def tiempo_servidor(self) -> float | None:
+        """Hora actual estimada en el reloj del servidor."""
+        if self.desfase is None:
+            return None
+        return self.ahora() + self.desfase
+
+    def antiguedad(self, t_servidor: float) -> float | None:
+        """Cuánto tiempo hace (según el reloj del servidor) que se generó algo con sello `t_servidor`."""
+        actual = self.tiempo_servidor()
+        if actual is None:
+            return None
+        return max(0.0, actual - t_servidor)
@@ -0,0 +1,362 @@
+"""
+Proxy de red con deterioro para medir el netcode de Cowboy Battle en local.
+Se pone entre el cliente y el servidor (TCP/WebSocket) y, por sentido (subida:
+cliente -> servidor, bajada: servidor -> cliente), aplica retraso, jitter,
+límite de ancho de banda y cortes (el flujo se congela un rato, como cuando TCP
+retransmite tras una pérdida). Las condiciones salen de un perfil: una lista de
+etapas con duración, así una misma corrida es repetible (`--semilla`).
+
+El proxy separa el flujo en mensajes (el handshake HTTP y cada frame de
+WebSocket) y retrasa mensajes enteros, sin reordenarlos (TCP entrega en orden:
+un mensaje demorado demora a los que vienen atrás). Cada mensaje se registra
+con su retraso real en un archivo JSONL.
+
+Uso:
+    python herramientas/proxy_red.py --perfil movil --registro retrasos.jsonl
+    python herramientas/proxy_red.py --escuchar 9100 --destino localhost:9000 --retraso 80 --jitter 20
+    python herramientas/proxy_red.py --perfil mi_perfil.json
+
+El cliente se conecta al proxy (`uri = "ws://localhost:9100"` en cliente/client.py).
+El canal UDP de snapshots no pasa por el proxy: para medir con el proxy, los
+clientes no deben pedirlo (todo sigue por WebSocket).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import time
+from typing import Any, Dict, List, Tuple
+
+# Perfiles incluidos. Cada etapa dura `segundos` (None = hasta el final) y define las
+# condiciones de "subida", "bajada" o "ambas":
+# - retraso: milisegundos de retraso base
+# - jitter: milisegundos que se suman o restan al azar a cada mensaje
+# - ancho_banda: bytes por segundo (0 = sin límite); los mensajes hacen cola detrás del anterior
+# - cortes_por_minuto: cortes al azar (proceso de Poisson) en los que el flujo no avanza
+# - duracion_corte: milisegundos que dura cada corte
+# - cortado: True congela el sentido toda la etapa
+# `repetir` vuelve a la primera etapa al terminar la última
+PERFILES: Dict[str, Dict[str, Any]] = {
+    "local": {
+        "etapas": [{"segundos": None, "ambas": {}}]
+    },
+    "wifi": {
+        "etapas": [{"segundos": None, "ambas": {"retraso": 8, "jitter": 4, "cortes_por_minuto": 0.5, "duracion_corte": 150}}]
+    },
+    "dsl": {
+        "etapas": [{
+            "segundos": None,
+            "subida": {"retraso": 25, "jitter": 5, "ancho_banda": 64_000},
+            "bajada": {"retraso": 25, "jitter": 5, "ancho_banda": 1_000_000}
+        }]
+    },
+    "movil": {
+        "etapas": [{
+            "segundos": None,
+            "subida": {"retraso": 60, "jitter": 30, "ancho_banda": 60_000, "cortes_por_minuto": 3, "duracion_corte": 400},
+            "bajada": {"retraso": 60, "jitter": 30, "ancho_banda": 250_000, "cortes_por_minuto": 3, "duracion_corte": 400}
+        }]
+    },
+    "transatlantico": {
+        "etapas": [{"segundos": None, "ambas": {"retraso": 85, "jitter": 6}}]
+    },
+    "degradacion": {
+        "repetir": True,
+        "etapas": [
+            {"nombre": "estable", "segundos": 20, "ambas": {"retraso": 10, "jitter": 3}},
+            {"nombre": "congestion", "segundos": 15, "subida": {"retraso": 120, "jitter": 60},
+             "bajada": {"retraso": 120, "jitter": 60, "ancho_banda": 40_000}},
+            {"nombre": "corte", "segundos": 3, "ambas": {"cortado": True}},
+            {"nombre": "recuperacion", "segundos": 15, "ambas": {"retraso": 40, "jitter": 15}}
+        ]
+    }
+}
+
+SENTIDOS = ("subida", "bajada")
+
+# Nombres de los opcodes de WebSocket para el registro
+OPCODES = {0: "continuacion", 1: "texto", 2: "binario", 8: "cierre", 9: "ping", 10: "pong"}
+
+# Tamaño de lectura cuando el flujo no es WebSocket (el servidor rechazó el handshake)
+TAMAÑO_LECTURA = 65536
+
+
+class Perfil:
+    """Etapas de un perfil y la condición de cada sentido en un momento dado."""
+
+    def __init__(self, nombre: str, datos: Dict[str, Any]):
+        self.nombre = nombre
+        self.etapas = datos["etapas"]
+        self.repetir = datos.get("repetir", False)
+        self.duracion = sum(etapa["segundos"] or 0 for etapa in self.etapas)
+        self.inicio = time.monotonic()
+        for etapa in self.etapas:
+            condiciones = [etapa.get(clave, {}) for clave in ("ambas", *SENTIDOS)]
+            if etapa["segundos"] is None and any(condicion.get("cortado") for condicion in condiciones):
+                raise ValueError(f"Perfil {nombre}: una etapa sin duración no puede estar cortada")
+
+    @classmethod
+    def cargar(cls, nombre_o_ruta: str) -> "Perfil":
+        """Un perfil incluido (por nombre) o un archivo JSON con el mismo formato."""
+        if nombre_o_ruta in PERFILES:
+            return cls(nombre_o_ruta, PERFILES[nombre_o_ruta])
+        with open(nombre_o_ruta, encoding="utf-8") as archivo:
+            return cls(os.path.basename(nombre_o_ruta), json.load(archivo))
+
+    def condicion(self, sentido: str, ahora: float) -> Tuple[str, Dict[str, Any], float]:
+        """Nombre de la etapa vigente en `ahora`, condiciones del sentido y cuándo termina la etapa."""
+        transcurrido = ahora - self.inicio
+        if self.repetir and self.duracion > 0:
+            transcurrido %= self.duracion
+        indice = len(self.etapas) - 1
+        for i, etapa in enumerate(self.etapas):
+            if etapa["segundos"] is None or transcurrido < etapa["segundos"]:
+                indice = i
+                break
+            transcurrido -= etapa["segundos"]
+        etapa = self.etapas[indice]
+        fin = float("inf") if etapa["segundos"] is None else ahora + max(0.0, etapa["segundos"] - transcurrido)
+        return etapa.get("nombre", str(indice)), {**etapa.get("ambas", {}), **etapa.get(sentido, {})}, fin
+
+
+class Sentido:
+    """
+    Un sentido de una conexión: decide cuándo se entrega cada mensaje y los
+    entrega en orden. Lleva el fin de la última transmisión (ancho de banda),
+    la última entrega (orden de TCP) y el próximo corte al azar.
+    """
+
+    def __init__(self, nombre: str, perfil: Perfil, rng: random.Random):
+        self.nombre = nombre
+        self.perfil = perfil
+        self.rng = rng
+        self.fin_transmision = 0.0
+        self.ultima_entrega = 0.0
+        self.proximo_corte: float | None = None
+        self.cola: asyncio.Queue = asyncio.Queue()
+
+    def _saltar_cortes(self, entrega: float, condicion: Dict[str, Any]) -> float:
+        """Mueve la entrega al final de los cortes al azar que la alcanzan."""
+        tasa = condicion.get("cortes_por_minuto", 0)
+        if tasa <= 0:
+            self.proximo_corte = None
+            return entrega
+        duracion = condicion.get("duracion_corte", 0) / 1000
+        if self.proximo_corte is None:
+            self.proximo_corte = entrega + self.rng.expovariate(tasa / 60)
+        while self.proximo_corte <= entrega:
+            fin_corte = self.proximo_corte + duracion
+            if entrega < fin_corte:
+                entrega = fin_corte
+            self.proximo_corte = fin_corte + self.rng.expovariate(tasa / 60)
+        return entrega
+
+    def programar(self, datos: bytes, ahora: float) -> Tuple[float, str]:
+        """Momento de entrega de un mensaje que llegó en `ahora`, y la etapa del perfil."""
+        etapa, condicion, fin_etapa = self.perfil.condicion(self.nombre, ahora)
+        while condicion.get("cortado"):
+            # Sentido congelado: el mensaje se empieza a transmitir cuando termina la etapa
+            ahora = fin_etapa + 1e-6
+            etapa, condicion, fin_etapa = self.perfil.condicion(self.nombre, ahora)
+        # Ancho de banda: el mensaje se transmite detrás del anterior
+        inicio = max(ahora, self.fin_transmision)
+        ancho_banda = condicion.get("ancho_banda", 0)
+        self.fin_transmision = inicio + (len(datos) / ancho_banda if ancho_banda > 0 else 0.0)
+        jitter = condicion.get("jitter", 0)
+        retraso = max(0.0, condicion.get("retraso", 0) + self.rng.uniform(-jitter, jitter)) / 1000
+        entrega = self._saltar_cortes(self.fin_transmision + retraso, condicion)
+        # TCP no reordena: un mensaje no sale antes que el anterior
+        entrega = max(entrega, self.ultima_entrega)
+        self.ultima_entrega = entrega
+        return entrega, etapa
+
+
+class Proxy:
+    """Acepta conexiones, abre una al destino por cada una y aplica el perfil en ambos sentidos."""
+
+    def __init__(self, destino: Tuple[str, int], perfil: Perfil, semilla: int, registro):
+        self.destino = destino
+        self.perfil = perfil
+        self.semilla = semilla
+        self.registro = registro
+        self.conexiones = 0
+        self.retrasos: Dict[str, List[float]] = {sentido: [] for sentido in SENTIDOS}
+
+    async def atender(self, lector_cliente: asyncio.StreamReader, escritor_cliente: asyncio.StreamWriter):
+        self.conexiones += 1
+        numero = self.conexiones
+        try:
+            lector_servidor, escritor_servidor = await asyncio.open_connection(*self.destino)
+        except OSError as e:
+            print(f"[{numero}] No se pudo conectar a {self.destino[0]}:{self.destino[1]} ({e})")
+            escritor_cliente.close()
+            return
+        print(f"[{numero}] Conexión de {escritor_cliente.get_extra_info('peername')}")
+        # Cada conexión tiene su propio generador: la misma semilla repite la misma corrida
+        rng = random.Random(f"{self.semilla}-{numero}")
+        tareas = []
+        for nombre, lector, escritor in (("subida", lector_cliente, escritor_servidor),
+                                         ("bajada", lector_servidor, escritor_cliente)):
+            sentido = Sentido(nombre, self.perfil, rng)
+            tareas.append(asyncio.create_task(self.recibir(numero, sentido, lector)))
+            tareas.append(asyncio.create_task(self.entregar(numero, sentido, escritor)))
+        try:
+            await asyncio.gather(*tareas)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            escritor_cliente.close()
+            escritor_servidor.close()
+            print(f"[{numero}] Conexión cerrada")
+
+    async def recibir(self, numero: int, sentido: Sentido, lector: asyncio.StreamReader):
+        """Separa el flujo en mensajes y los pone en la cola con su momento de entrega."""
+        try:
+            async for datos, tipo in leer_mensajes(lector):
+                llegada = time.monotonic()
+                entrega, etapa = sentido.programar(datos, llegada)
+                sentido.cola.put_nowait((entrega, llegada, datos, tipo, etapa))
+        finally:
+            sentido.cola.put_nowait(None)
+
+    async def entregar(self, numero: int, sentido: Sentido, escritor: asyncio.StreamWriter):
+        """Escribe cada mensaje cuando le toca y lo registra con su retraso real."""
+        while True:
+            item = await sentido.cola.get()
+            if item is None:
+                if escritor.can_write_eof():
+                    escritor.write_eof()
+                return
+            entrega, llegada, datos, tipo, etapa = item
+            espera = entrega - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            escritor.write(datos)
+            await escritor.drain()
+            retraso = time.monotonic() - llegada
+            self.retrasos[sentido.nombre].append(retraso)
+            if self.registro is not None:
+                self.registro.write(json.dumps({
+                    "t": round(llegada - self.perfil.inicio, 4),
+                    "conexion": numero,
+                    "sentido": sentido.nombre,
+                    "tipo": tipo,
+                    "bytes": len(datos),
+                    "etapa": etapa,
+                    "retraso_ms": round(retraso * 1000, 2)
+                }) + "\n")
+
+    def resumen(self) -> str:
+        lineas = []
+        for sentido, retrasos in self.retrasos.items():
+            if not retrasos:
+                continue
+            ordenados = sorted(retrasos)
+            p50, p90, p99 = (ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))] * 1000
+                             for q in (0.5, 0.9, 0.99))
+            lineas.append(f"{sentido}: {len(ordenados)} mensajes, retraso p50 {p50:.1f}ms, "
+                          f"p90 {p90:.1f}ms, p99 {p99:.1f}ms, máx {ordenados[-1] * 1000:.1f}ms")
+        return "\n".join(lineas)
+
+
+async def leer_mensajes(lector: asyncio.StreamReader):
+    """
+    Genera (bytes, tipo) por mensaje: primero el handshake HTTP y después cada
+    frame de WebSocket entero (cabecera, máscara y datos). Si el handshake no
+    termina en un cambio de protocolo, el resto pasa en bloques.
+    """
+    try:
+        handshake = await lector.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            yield e.partial, "crudo"
+        return
+    yield handshake, "handshake"
+    es_websocket = handshake.startswith(b"GET ") or b" 101 " in handshake.split(b"\r\n", 1)[0]
+    while True:
+        if not es_websocket:
+            datos = await lector.read(TAMAÑO_LECTURA)
+            if not datos:
+                return
+            yield datos, "crudo"
+            continue
+        try:
+            cabecera = await lector.readexactly(2)
+        except asyncio.IncompleteReadError:
+            return
+        opcode = cabecera[0] & 0x0F
+        largo = cabecera[1] & 0x7F
+        extra = b""
+        if largo == 126:
+            extra = await lector.readexactly(2)
+            largo = int.from_bytes(extra, "big")
+        elif largo == 127:
+            extra = await lector.readexactly(8)
+            largo = int.from_bytes(extra, "big")
+        mascara = await lector.readexactly(4) if cabecera[1] & 0x80 else b""
+        carga = await lector.readexactly(largo)
+        yield cabecera + extra + mascara + carga, OPCODES.get(opcode, str(opcode))
+
+
+def perfil_de_argumentos(argumentos) -> Perfil:
+    """El perfil pedido, o uno de una sola etapa con los valores de la línea de comandos."""
+    if argumentos.perfil:
+        return Perfil.cargar(argumentos.perfil)
+    condicion = {
+        "retraso": argumentos.retraso,
+        "jitter": argumentos.jitter,
+        "ancho_banda": argumentos.ancho_banda,
+        "cortes_por_minuto": argumentos.cortes_por_minuto,
+        "duracion_corte": argumentos.duracion_corte
+    }
+    return Perfil("linea_de_comandos", {"etapas": [{"segundos": None, "ambas": condicion}]})
+
+
+async def ejecutar(argumentos):
+    host, _, puerto = argumentos.destino.rpartition(":")
+    perfil = perfil_de_argumentos(argumentos)
+    registro = open(argumentos.registro, "w", encoding="utf-8") if argumentos.registro else None
+    proxy = Proxy((host or "localhost", int(puerto)), perfil, argumentos.semilla, registro)
+    servidor = await asyncio.start_server(proxy.atender, "0.0.0.0", argumentos.escuchar)
+    print(f"Proxy en 0.0.0.0:{argumentos.escuchar} -> {argumentos.destino} (perfil {perfil.nombre})")
+    detener = asyncio.Event()
+    try:
+        # SIGTERM termina igual que Ctrl+C: se cierra el registro y se imprime el resumen
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, detener.set)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows: solo Ctrl+C
+    try:
+        async with servidor:
+            await detener.wait()
+    finally:
+        if registro is not None:
+            registro.close()
+        print(proxy.resumen())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy TCP/WebSocket con retraso, jitter, ancho de banda y cortes")
+    parser.add_argument("--escuchar", type=int, default=9100, help="puerto donde se conectan los clientes")
+    parser.add_argument("--destino", default="localhost:9000", help="servidor (host:puerto)")
+    parser.add_argument("--perfil", help=f"perfil incluido ({', '.join(PERFILES)}) o archivo JSON")
+    parser.add_argument("--retraso", type=float, default=0, help="ms de retraso por sentido (sin --perfil)")
+    parser.add_argument("--jitter", type=float, default=0, help="ms de jitter (sin --perfil)")
+    parser.add_argument("--ancho-banda", type=float, default=0, help="bytes/s por sentido, 0 sin límite (sin --perfil)")
+    parser.add_argument("--cortes-por-minuto", type=float, default=0, help="cortes al azar (sin --perfil)")
+    parser.add_argument("--duracion-corte", type=float, default=300, help="ms de cada corte (sin --perfil)")
+    parser.add_argument("--semilla", type=int, default=0, help="misma semilla, mismos retrasos")
+    parser.add_argument("--registro", help="archivo JSONL con el retraso de cada mensaje")
+    argumentos = parser.parse_args()
+    try:
+        asyncio.run(ejecutar(argumentos))
+    except KeyboardInterrupt:
+        print("\nProxy detenido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+"""
+Prueba de resistencia (soak) del servidor de Cowboy Battle.
+Levanta el servidor en el mismo proceso y lo hace rotar salas durante horas:
+varios trabajadores repiten ciclos de crear, unirse, jugar, desconectarse
+(cerrando bien o cortando la conexión), reanudar, espectar, revancha,
+partida rápida (también sola, completada con un bot) y salas con bots. Cada tanto mide el RSS del proceso, el tamaño de `salas`,
+`websocket_a_sala` y el resto de los registros del servidor, y las tareas de
+asyncio. Con la cantidad de trabajadores fija, todo eso tiene que estabilizarse:
+si alguna medida sigue creciendo (el mínimo del último cuarto de la prueba
+supera al máximo del primero), la prueba falla. Al final se cierran todos los
+clientes y, pasados los TTL, el servidor tiene que quedar vacío.
+
+Uso:
+    python herramientas/prueba_resistencia.py --duracion 7200 --trabajadores 16
+    python herramientas/prueba_resistencia.py --duracion 600 --acelerar 10 --salida soak.json
+
+Sale con código 1 si encuentra una fuga (sirve como control de regresión).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "servidor"))
+
+import emparejamiento
+import historial
+import memoria
+import server
+
+# Tiempo máximo esperando una respuesta del servidor (en segundos)
+ESPERA_RESPUESTA = 5.0
+
+# Tiempo máximo de una partida de la prueba antes de abandonarla (en segundos)
+DURACION_MAXIMA_PARTIDA = 30.0
+
+# Mensajes que los clientes de la prueba guardan (el resto, como los estados, se descarta al leerlos)
+MENSAJES_GUARDADOS = {"asignacion_id", "start_game", "game_over", "en_cola", "salas_publicas", "error"}
+
+# Parte inicial de la prueba que no se compara (el servidor todavía se está llenando). Nunca es
+# menos que el TTL más largo: la rueda descarta los temporizadores cancelados recién cuando
+# llega su vencimiento, así que hasta entonces crecen aunque no haya fuga
+FRACCION_CALENTAMIENTO = 0.2
+
+# Crecimiento tolerado por medida: (relativo, absoluto). La medida crece sin límite si el
+# mínimo del último cuarto supera al máximo del primero en más de lo tolerado
+TOLERANCIAS = {
+    "rss_mb": (0.10, 16.0),
+    "salas": (0.25, 4),
+    "websocket_a_sala": (0.25, 8),
+    "conexiones": (0.25, 8),
+    "sesiones": (0.25, 8),
+    "espectadores": (0.25, 4),
+    "suspendidos": (0.25, 4),
+    "temporizadores": (0.25, 16),
+    "tareas_servidor": (0.25, 16),
+    "tareas_cierre": (0.25, 8),
+    "salas_publicas": (0.25, 4),
+    "en_cola": (0.25, 4),
+}
+
+# Registros que tienen que quedar vacíos cuando no hay clientes y vencieron los TTL
+VACIOS_AL_FINAL = ("salas", "websocket_a_sala", "conexiones", "sesiones", "espectadores", "suspendidos", "en_cola")
+
+
+class Rechazo(Exception):
+    """El servidor respondió con un error (por ejemplo, servidor ocupado)."""
+
+
+class Cliente:
+    """Un cliente de la prueba: una conexión con su lector, que nunca deja de leer."""
+
+    def __init__(self, ws: Any, tareas: set):
+        self.ws = ws
+        self.mensajes: asyncio.Queue = asyncio.Queue()
+        self.player_id = None
+        self.token = None
+        self.codigo_sala = None
+        self.lector = asyncio.create_task(self._leer())
+        tareas.add(self.lector)
+        self.lector.add_done_callback(tareas.discard)
+
+    async def _leer(self):
+        # Leer todo lo que llega: un cliente que no lee frena los envíos del servidor
+        try:
+            async for crudo in self.ws:
+                if isinstance(crudo, bytes):
+                    continue
+                datos = json.loads(crudo)
+                for mensaje in datos["mensajes"] if datos.get("tipo") == "lote" else [datos]:
+                    if mensaje.get("tipo") in MENSAJES_GUARDADOS:
+                        self.mensajes.put_nowait(mensaje)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def enviar(self, **datos):
+        await self.ws.send(json.dumps(datos))
+
+    async def esperar(self, tipo: str, timeout: float = ESPERA_RESPUESTA) -> Dict[str, Any]:
+        """Espera un mensaje de `tipo` (un error en el medio se convierte en Rechazo)."""
+        limite = time.monotonic() + timeout
+        while True:
+            mensaje = await asyncio.wait_for(self.mensajes.get(), max(0.0, limite - time.monotonic()))
+            if mensaje["tipo"] == tipo:
+                if tipo == "asignacion_id":
+                    self.player_id = mensaje["player_id"]
+                    self.token = mensaje.get("token_reanudacion")
+                    self.codigo_sala = mensaje["codigo_sala"]
+                return mensaje
+            if mensaje["tipo"] == "error":
+                raise Rechazo(mensaje.get("codigo") or mensaje.get("mensaje"))
+
+    async def cerrar(self, abrupto: bool = False):
+        """Cierra la conexión; `abrupto` corta el transporte sin frame de cierre (como una caída de red)."""
+        if abrupto:
+            self.ws.transport.abort()
+        else:
+            await self.ws.close()
+        try:
+            await asyncio.wait_for(self.lector, ESPERA_RESPUESTA)
+        except asyncio.TimeoutError:
+            self.lector.cancel()
+
+
+class Prueba:
+    """Estado de una ejecución: clientes abiertos, tareas propias, ciclos y muestras."""
+
+    def __init__(self, puerto: int, semilla: int):
+        self.url = f"ws://127.0.0.1:{puerto}"
+        self.rng = random.Random(semilla)
+        self.tareas: set = set()          # Tareas de la prueba (no cuentan como tareas del servidor)
+        self.ciclos: Dict[str, int] = defaultdict(int)
+        self.muestras: List[Dict[str, float]] = []
+
+    async def conectar(self, abiertos: list) -> Cliente:
+        cliente = Cliente(await websockets.connect(self.url), self.tareas)
+        abiertos.append(cliente)
+        return cliente
+
+    async def armar_sala(self, abiertos: list, jugadores: int) -> List[Cliente]:
+        """Un host crea una sala y los demás se unen. Devuelve los clientes (el host primero)."""
+        host = await self.conectar(abiertos)
+        await host.enviar(tipo="crear_partida", nombre="Host")
+        codigo_sala = (await host.esperar("asignacion_id"))["codigo_sala"]
+        clientes = [host]
+        for i in range(1, jugadores):
+            invitado = await self.conectar(abiertos)
+            await invitado.enviar(tipo="unirse_partida", nombre=f"Invitado{i}", codigo_sala=codigo_sala)
+            await invitado.esperar("asignacion_id")
+            clientes.append(invitado)
+        return clientes
+
+    async def iniciar(self, clientes: List[Cliente]):
+        """Todos listos y el host inicia (reintenta si algún "listo" todavía no llegó)."""
+        for cliente in clientes:
+            await cliente.enviar(tipo="ready", player_id=cliente.player_id, listo=True)
+        for intento in range(5):
+            await asyncio.sleep(0.2)
+            await clientes[0].enviar(tipo="iniciar_partida", player_id=clientes[0].player_id)
+            try:
+                await clientes[0].esperar("start_game", 1.0)
+                return
+            except (Rechazo, asyncio.TimeoutError):
+                if intento == 4:
+                    raise
+
+    async def jugar(self, clientes: List[Cliente]) -> bool:
+        """
+        Juega hasta el game_over: el host se pone debajo de los demás y dispara
+        hacia arriba hasta sumar 3 impactos. Devuelve False si no terminó a tiempo.
+        """
+        host = clientes[0]
+        for cliente in clientes[1:]:
+            await cliente.enviar(tipo="update_pos", player_id=cliente.player_id, x=250, y=400)
+        limite = time.monotonic() + DURACION_MAXIMA_PARTIDA
+        while time.monotonic() < limite:
+            await host.enviar(tipo="update_pos", player_id=host.player_id, x=250, y=500)
+            await host.enviar(tipo="shoot", player_id=host.player_id, direccion="up")
+            try:
+                await host.esperar("game_over", 0.3)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    # --- Escenarios: cada uno es un ciclo completo de uno o más clientes ---
+
+    async def escenario_lobby(self, abiertos: list):
+        """Sala que nunca empieza: listos, sala pública y salida en cualquier orden."""
+        clientes = await self.armar_sala(abiertos, self.rng.randint(2, 4))
+        await clientes[0].enviar(tipo="sala_publica", publica=True)
+        explorador = await self.conectar(abiertos)
+        await explorador.enviar(tipo="explorar_salas")
+        await explorador.esperar("salas_publicas")
+        for cliente in clientes:
+            await cliente.enviar(tipo="ready", player_id=cliente.player_id, listo=self.rng.random() < 0.5)
+        self.rng.shuffle(clientes)
+        for cliente in clientes:
+            await cliente.cerrar(abrupto=self.rng.random() < 0.5)
+
+    async def escenario_partida(self, abiertos: list):
+        """Partida completa hasta el game_over; después todos se van (la sala queda terminada)."""
+        clientes = await self.armar_sala(abiertos, self.rng.randint(2, 4))
+        await self.iniciar(clientes)
+        await self.jugar(clientes)
+
+    async def escenario_revancha(self, abiertos: list):
+        """Después del game_over, el host crea otra sala desde la misma conexión y los demás lo siguen."""
+        clientes = await self.armar_sala(abiertos, 2)
+        await self.iniciar(clientes)
+        if not await self.jugar(clientes):
+            return
+        host = clientes[0]
+        await host.enviar(tipo="crear_partida", nombre="Host")
+        codigo_sala = (await host.esperar("asignacion_id"))["codigo_sala"]
+        for cliente in clientes[1:]:
+            await cliente.enviar(tipo="unirse_partida", nombre="Revancha", codigo_sala=codigo_sala)
+            await cliente.esperar("asignacion_id")
+        await self.iniciar(clientes)
+        await self.jugar(clientes)
+
+    async def escenario_abandono(self, abiertos: list):
+        """Un jugador corta la conexión en plena partida (queda suspendido) y los demás se van después."""
+        clientes = await self.armar_sala(abiertos, self.rng.randint(2, 4))
+        await self.iniciar(clientes)
+        await clientes[-1].cerrar(abrupto=True)
+        await asyncio.sleep(self.rng.uniform(0.0, 2.0))
+
+    async def escenario_reanudacion(self, abiertos: list):
+        """Un jugador corta la conexión, reanuda con su token y la partida termina."""
+        clientes = await self.armar_sala(abiertos, 2)
+        await self.iniciar(clientes)
+        caido = clientes[-1]
+        await caido.cerrar(abrupto=True)
+        await asyncio.sleep(0.5)
+        vuelto = await self.conectar(abiertos)
+        await vuelto.enviar(tipo="reanudar", token=caido.token)
+        await vuelto.esperar("asignacion_id")
+        await self.jugar([clientes[0], vuelto])
+
+    async def escenario_espectador(self, abiertos: list):
+        """Espectadores que entran y salen de una partida en curso."""
+        clientes = await self.armar_sala(abiertos, 2)
+        await self.iniciar(clientes)
+        for _ in range(self.rng.randint(1, 3)):
+            espectador = await self.conectar(abiertos)
+            await espectador.enviar(tipo="espectar", codigo_sala=clientes[0].codigo_sala)
+            await asyncio.sleep(self.rng.uniform(0.1, 1.0))
+            await espectador.cerrar(abrupto=self.rng.random() < 0.5)
+        await self.jugar(clientes)
+
+    async def escenario_rapida(self, abiertos: list):
+        """Partida rápida: cuatro entran a la cola (alguno se arrepiente) y juegan la sala emparejada."""
+        clientes = [await self.conectar(abiertos) for _ in range(4)]
+        for cliente in clientes:
+            await cliente.enviar(tipo="quick_play", nombre="Rapido")
+        if self.rng.random() < 0.25:
+            await clientes[-1].enviar(tipo="cancelar_quick_play")
+            await clientes[-1].cerrar()
+            clientes.pop()
+        for cliente in clientes:
+            await cliente.esperar("asignacion_id")
+        await asyncio.sleep(self.rng.uniform(0.5, 2.0))
+
+    async def escenario_rapida_bot(self, abiertos: list):
+        """Partida rápida de un solo jugador: espera hasta que la completan con un bot y la abandona."""
+        jugador = await self.conectar(abiertos)
+        await jugador.enviar(tipo="quick_play", nombre="Solitario")
+        # Si en el medio llegan otros de la cola se arma con ellos; si no, con bots
+        espera_sola = emparejamiento.ESCALONES_TAMAÑO[-1][0] + server.INTERVALO_EMPAREJAMIENTO
+        await jugador.esperar("asignacion_id", espera_sola + ESPERA_RESPUESTA)
+        await jugador.esperar("start_game")
+        await asyncio.sleep(self.rng.uniform(0.5, 3.0))
+        await jugador.cerrar(abrupto=self.rng.random() < 0.5)
+
+    async def escenario_lobby_bots(self, abiertos: list):
+        """El host agrega bots a su sala y se va antes de empezar: la sala se elimina con sus bots."""
+        clientes = await self.armar_sala(abiertos, self.rng.randint(1, 2))
+        host = clientes[0]
+        for _ in range(self.rng.randint(1, 2)):
+            await host.enviar(tipo="agregar_bot")
+        await asyncio.sleep(self.rng.uniform(0.1, 1.0))
+        await host.cerrar(abrupto=self.rng.random() < 0.5)
+        await asyncio.sleep(self.rng.uniform(0.0, 1.0))
+        for cliente in clientes[1:]:
+            await cliente.cerrar(abrupto=self.rng.random() < 0.5)
+
+    async def trabajador(self, fin: float):
+        """Repite escenarios al azar hasta `fin`; cada ciclo cierra todas sus conexiones."""
+        escenarios = {
+            "lobby": self.escenario_lobby,
+            "partida": self.escenario_partida,
+            "revancha": self.escenario_revancha,
+            "abandono": self.escenario_abandono,
+            "reanudacion": self.escenario_reanudacion,
+            "espectador": self.escenario_espectador,
+            "rapida": self.escenario_rapida,
+            "rapida_bot": self.escenario_rapida_bot,
+            "lobby_bots": self.escenario_lobby_bots,
+        }
+        while time.monotonic() < fin:
+            nombre = self.rng.choice(list(escenarios))
+            abiertos: List[Cliente] = []
+            try:
+                await escenarios[nombre](abiertos)
+                self.ciclos[nombre] += 1
+            except Rechazo:
+                self.ciclos["rechazados"] += 1
+            except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed, OSError):
+                self.ciclos["fallidos"] += 1
+            finally:
+                for cliente in abiertos:
+                    if cliente.ws.state != websockets.protocol.State.CLOSED:
+                        await cliente.cerrar(abrupto=self.rng.random() < 0.3)
+
+    def muestrear(self, inicio: float) -> Dict[str, float]:
+        rss = memoria.rss_bytes()
+        return {
+            "t": round(time.monotonic() - inicio, 1),
+            "rss_mb": round(rss / 2**20, 1) if rss is not None else 0.0,
+            "salas": len(server.salas),
+            "websocket_a_sala": len(server.websocket_a_sala),
+            "conexiones": len(server.conexiones),
+            "sesiones": len(server.sesiones),
+            "espectadores": len(server.espectador_a_sala),
+            "suspendidos": sum(len(sala["suspendidos"]) for sala in server.salas.values()),
+            "temporizadores": len(server.rueda_temporizadores),
+            "tareas_servidor": len(asyncio.all_tasks()) - len(self.tareas),
+            "tareas_cierre": len(server.tareas_cierre),
+            "salas_publicas": len(server.indice_salas.salas),
+            "en_cola": len(server.cola_emparejamiento),
+        }
+
+
+def crece_sin_limite(valores: List[float], relativo: float, absoluto: float) -> bool:
+    """
+    Una medida que se estabiliza vuelve a sus valores de antes; una fuga no:
+    el mínimo del último cuarto supera al máximo del primero (más lo tolerado).
+    """
+    if len(valores) < 8:
+        return False
+    cuarto = len(valores) // 4
+    return min(valores[-cuarto:]) > max(valores[:cuarto]) * (1 + relativo) + absoluto
+
+
+def acelerar_servidor(factor: float):
+    """
+    Acorta los TTL de las salas, la ventana de reanudación y las esperas de la
+    partida rápida (la de un solo jugador dura 20s) para ver antes si se estabilizan.
+    """
+    server.TTL_SALA_POR_ESTADO = {estado: ttl / factor for estado, ttl in server.TTL_SALA_POR_ESTADO.items()}
+    server.VENTANA_REANUDACION /= factor
+    emparejamiento.ESCALONES_TAMAÑO = tuple((desde / factor, jugadores) for desde, jugadores in emparejamiento.ESCALONES_TAMAÑO)
+    server.INTERVALO_LIMPIEZA = min(server.INTERVALO_LIMPIEZA, max(server.TTL_SALA_POR_ESTADO["game_over"] / 4, 0.5))
+
+
+async def ejecutar(argumentos) -> int:
+    prueba = Prueba(argumentos.puerto, argumentos.semilla)
+    salida = sys.stdout
+
+    def informar(texto: str):
+        print(texto, file=salida, flush=True)
+
+    server.escritor_historial = historial.EscritorHistorial(server.ARCHIVO_HISTORIAL)
+    async with websockets.serve(server.manejar_cliente, "127.0.0.1", argumentos.puerto,
+                                ping_interval=server.PING_INTERVALO, ping_timeout=server.PING_TIMEOUT):
+        for loop in (server.loop_actualizacion_balas, server.loop_temporizadores, server.loop_limpieza_salas,
+                     server.loop_medir_lag, server.loop_emparejamiento, server.loop_explorador,
+                     server.loop_transmision):
+            asyncio.create_task(loop())
+        await asyncio.sleep(0.5)
+
+        inicio = time.monotonic()
+        fin = inicio + argumentos.duracion
+        # El servidor imprime cada evento: durante la prueba va a /dev/null
+        with open(os.devnull, "w") as nulo:
+            sys.stdout = nulo
+            try:
+                trabajadores = [asyncio.create_task(prueba.trabajador(fin)) for _ in range(argumentos.trabajadores)]
+                prueba.tareas.update(trabajadores)
+                while time.monotonic() < fin:
+                    await asyncio.sleep(min(argumentos.intervalo, max(0.0, fin - time.monotonic())))
+                    muestra = prueba.muestrear(inicio)
+                    prueba.muestras.append(muestra)
+                    informar(" ".join(f"{clave}={valor}" for clave, valor in muestra.items()))
+                await asyncio.gather(*trabajadores)
+
+                # Sin clientes, todo lo que queda tiene que irse con los TTL
+                espera_final = (max(server.TTL_SALA_POR_ESTADO["game_over"], server.VENTANA_REANUDACION)
+                                + server.INTERVALO_LIMPIEZA + 2.0)
+                informar(f"Ciclos: {dict(prueba.ciclos)}. Esperando {espera_final:.0f}s a que venzan los TTL...")
+                await asyncio.sleep(espera_final)
+                final = prueba.muestrear(inicio)
+            finally:
+                sys.stdout = salida
+                server.escritor_historial.cerrar()
+
+    # Evaluar las muestras después del calentamiento
+    calentamiento = max(argumentos.duracion * FRACCION_CALENTAMIENTO,
+                        max(server.TTL_SALA_POR_ESTADO.values()) + server.VENTANA_REANUDACION)
+    medidas = [muestra for muestra in prueba.muestras if muestra["t"] >= calentamiento]
+    if len(medidas) < 8:
+        informar(f"AVISO: con {calentamiento:.0f}s de calentamiento quedan muy pocas muestras para buscar "
+                 f"crecimiento (alargar --duracion o usar --acelerar)")
+    fugas = [
+        nombre for nombre, (relativo, absoluto) in TOLERANCIAS.items()
+        if crece_sin_limite([muestra[nombre] for muestra in medidas], relativo, absoluto)
+    ]
+    residuos = {nombre: final[nombre] for nombre in VACIOS_AL_FINAL if final[nombre] > 0}
+
+    informar(f"Final: {final}")
+    if fugas:
+        informar(f"FALLA: crecen sin límite: {', '.join(fugas)}")
+    if residuos:
+        informar(f"FALLA: quedaron registros sin liberar: {residuos}")
+    if not fugas and not residuos:
+        informar("OK: todas las medidas se estabilizaron y el servidor quedó vacío")
+
+    if argumentos.salida:
+        with open(argumentos.salida, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "ciclos": prueba.ciclos,
+                "muestras": prueba.muestras,
+                "final": final,
+                "fugas": fugas,
+                "residuos": residuos
+            }, archivo, indent=2)
+    return 1 if fugas or residuos else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de resistencia del servidor con detección de fugas")
+    parser.add_argument("--duracion", type=float, default=3600.0, help="segundos de carga (por defecto 3600)")
+    parser.add_argument("--trabajadores", type=int, default=8, help="ciclos de clientes simultáneos")
+    parser.add_argument("--intervalo", type=float, default=10.0, help="segundos entre muestras")
+    parser.add_argument("--acelerar", type=float, default=1.0, help="divide los TTL de salas y la ventana de reanudación")
+    parser.add_argument("--puerto", type=int, default=9300)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="archivo JSON con todas las muestras")
+    argumentos = parser.parse_args()
+
+    if argumentos.acelerar != 1.0:
+        acelerar_servidor(argumentos.acelerar)
+    # Historial y analítica de la prueba en un directorio temporal
+    salida = argumentos.salida and os.path.abspath(argumentos.salida)
+    argumentos.salida = salida
+    os.chdir(tempfile.mkdtemp(prefix="prueba_resistencia_"))
+    sys.exit(asyncio.run(ejecutar(argumentos)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Estadísticas por partida del servidor de Cowboy Battle.
+Mientras se juega, el tick va sumando en arreglos de NumPy de tamaño fijo
+(uno por sala) los disparos, impactos, estrellas y tiempo invencible de cada
+jugador, y mapas de calor del mapa: dónde pasa el tiempo cada jugador, desde
+dónde se dispara y dónde se recibe cada impacto. Cada evento es una o dos
+sumas sobre un arreglo ya creado; al terminar la partida se arma el resumen y
+los mapas se guardan en un .npz para el balance del mapa.
+"""
+
+import json
+import math
+import os
+import sys
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+# Tamaño de cada celda de los mapas de calor (en píxeles): 800x600 -> 32x24 celdas
+TAMAÑO_CELDA = 25
+
+# Columnas de la tabla de contadores por jugador
+DISPAROS = 0
+IMPACTOS = 1
+RECIBIDOS = 2
+ESTRELLAS = 3
+
+
+class EstadisticasPartida:
+    """
+    Acumuladores de una partida. Cada jugador tiene una fila fija (su índice en
+    `ids`); los jugadores que no estaban al empezar no se cuentan.
+
+    - `contadores`: disparos, impactos, impactos recibidos y estrellas por jugador
+    - `invencible`: segundos de invencibilidad ganados por jugador
+    - `permanencia`: segundos que pasó cada jugador en cada celda del mapa
+    - `calor_disparos` / `calor_impactos`: celdas desde donde se disparó y donde se recibió un impacto
+    """
+
+    def __init__(self, participantes: Dict[int, str], posiciones: Dict[int, Dict[str, float]],
+                 ancho: int, alto: int, ahora: float):
+        self.ids = list(participantes)
+        self.nombres = [participantes[pid] for pid in self.ids]
+        self.fila = {pid: i for i, pid in enumerate(self.ids)}
+        self.columnas = math.ceil(ancho / TAMAÑO_CELDA)
+        self.filas = math.ceil(alto / TAMAÑO_CELDA)
+        celdas = self.filas * self.columnas
+
+        self.contadores = np.zeros((len(self.ids), 4), dtype=np.int32)
+        self.invencible = np.zeros(len(self.ids), dtype=np.float64)
+        self.permanencia = np.zeros((len(self.ids), celdas), dtype=np.float64)
+        self.calor_disparos = np.zeros(celdas, dtype=np.int32)
+        self.calor_impactos = np.zeros(celdas, dtype=np.int32)
+
+        # Celda y momento de la última posición conocida de cada jugador (-1 = sin posición)
+        self.celda_actual = [-1] * len(self.ids)
+        self.desde = [ahora] * len(self.ids)
+        self.inicio = ahora
+        for pid, pos in posiciones.items():
+            self.posicion(pid, pos["x"], pos["y"], ahora)
+
+    def _celda(self, x: float, y: float) -> int:
+        columna = min(max(int(x) // TAMAÑO_CELDA, 0), self.columnas - 1)
+        fila = min(max(int(y) // TAMAÑO_CELDA, 0), self.filas - 1)
+        return fila * self.columnas + columna
+
+    def posicion(self, player_id: int, x: float, y: float, ahora: float):
+        """
+        Registra una posición nueva: el tiempo desde la anterior se suma a la
+        celda donde estaba el jugador, así el mapa no depende de cada cuánto llegan.
+        """
+        i = self.fila.get(player_id)
+        if i is None:
+            return
+        celda = self._celda(x, y)
+        if celda == self.celda_actual[i]:
+            return  # Sigue en la misma celda: se suma cuando salga
+        if self.celda_actual[i] >= 0:
+            self.permanencia[i, self.celda_actual[i]] += ahora - self.desde[i]
+        self.celda_actual[i] = celda
+        self.desde[i] = ahora
+
+    def disparo(self, player_id: int, x: float, y: float):
+        i = self.fila.get(player_id)
+        if i is None:
+            return
+        self.contadores[i, DISPAROS] += 1
+        self.calor_disparos[self._celda(x, y)] += 1
+
+    def impacto(self, tirador: int, objetivo: int, x: float, y: float):
+        i = self.fila.get(tirador)
+        if i is not None:
+            self.contadores[i, IMPACTOS] += 1
+        j = self.fila.get(objetivo)
+        if j is not None:
+            self.contadores[j, RECIBIDOS] += 1
+        self.calor_impactos[self._celda(x, y)] += 1
+
+    def estrella(self, player_id: int, duracion: float):
+        i = self.fila.get(player_id)
+        if i is None:
+            return
+        self.contadores[i, ESTRELLAS] += 1
+        self.invencible[i] += duracion
+
+    def cerrar(self, ahora: float, invencibilidad_restante: Dict[int, float]) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """
+        Termina la partida: suma la última permanencia de cada jugador, descuenta
+        la invencibilidad que no llegó a usarse y devuelve el resumen (JSON) y
+        los mapas de calor (filas x columnas).
+        """
+        for i, celda in enumerate(self.celda_actual):
+            if celda >= 0:
+                self.permanencia[i, celda] += ahora - self.desde[i]
+                self.desde[i] = ahora
+        for pid, restante in invencibilidad_restante.items():
+            i = self.fila.get(pid)
+            if i is not None:
+                self.invencible[i] -= min(restante, self.invencible[i])
+
+        jugadores = []
+        for i, pid in enumerate(self.ids):
+            disparos, impactos, recibidos, estrellas = (int(v) for v in self.contadores[i])
+            jugadores.append({
+                "player_id": pid,
+                "nombre": self.nombres[i],
+                "disparos": disparos,
+                "impactos": impactos,
+                "precision": round(impactos / disparos, 3) if disparos else None,
+                "impactos_recibidos": recibidos,
+                "estrellas": estrellas,
+                "segundos_invencible": round(float(self.invencible[i]), 2)
+            })
+        resumen = {
+            "duracion": round(ahora - self.inicio, 2),
+            "tamaño_celda": TAMAÑO_CELDA,
+            "jugadores": jugadores
+        }
+        forma = (self.filas, self.columnas)
+        mapas = {
+            "player_ids": np.array(self.ids, dtype=np.int64),
+            "permanencia": self.permanencia.reshape(len(self.ids), *forma).astype(np.float32),
+            "disparos": self.calor_disparos.reshape(forma),
+            "impactos": self.calor_impactos.reshape(forma)
+        }
+        return resumen, mapas
+
+
+def guardar_partida(directorio: str, nombre: str, resumen: Dict[str, Any], mapas: Dict[str, np.ndarray]):
+    """
+    Escribe el resumen (`nombre`.json) y los mapas de calor (`nombre`.npz) de
+    una partida. Es bloqueante: el servidor lo llama fuera del event loop.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, nombre)
+    np.savez_compressed(ruta + ".npz", **mapas)
+    temporal = ruta + ".json.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(resumen, archivo, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta + ".json")
+
+
+def sumar_mapas(directorio: str) -> Dict[str, np.ndarray]:
+    """Suma los mapas de calor de todas las partidas guardadas en `directorio` (para el balance del mapa)."""
+    total: Dict[str, np.ndarray] = {}
+    for nombre in sorted(os.listdir(directorio)):
+        if not nombre.endswith(".npz"):
+            continue
+        with np.load(os.path.join(directorio, nombre)) as datos:
+            mapas = {
+                "permanencia": datos["permanencia"].sum(axis=0),
+                "disparos": datos["disparos"],
+                "impactos": datos["impactos"]
+            }
+        for clave, mapa in mapas.items():
+            total[clave] = total[clave] + mapa if clave in total else mapa.astype(np.float64)
+    return total
+
+
+if __name__ == "__main__":
+    # Muestra en la terminal los mapas de calor sumados de todas las partidas guardadas
+    directorio = sys.argv[1] if len(sys.argv) > 1 else "analitica_partidas"
+    niveles = " .:-=+*#%@"
+    for clave, mapa in sumar_mapas(directorio).items():
+        print(f"{clave} (total {mapa.sum():.1f})")
+        escala = mapa / mapa.max() if mapa.max() > 0 else mapa
+        for fila in escala:
+            print("".join(niveles[int(v * (len(niveles) - 1))] for v in fila))
+        print()
@@ -0,0 +1,291 @@
+"""
+Jugadores controlados por el servidor (bots) de Cowboy Battle.
+Un bot ocupa un lugar en la sala como cualquier jugador, con una conexión falsa.
+Se mueve con campos de flujo sobre una grilla de navegación que se calcula una
+sola vez para el mapa, y apunta con chequeos baratos de línea de vista.
+Sus decisiones solo dependen de su semilla y del estado de la sala, así que
+también sirven como carga reproducible para pruebas de rendimiento.
+"""
+
+import math
+import random
+from array import array
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+# Lado de cada celda de la grilla de navegación (en píxeles)
+TAMAÑO_CELDA = 40
+
+# Medio lado del jugador: una celda es transitable si el jugador cabe centrado en ella
+RADIO_BOT = 30
+
+# Píxeles que avanza un bot por tick (igual que un jugador con el teclado)
+VELOCIDAD_BOT = 5
+
+# Un bot decide (objetivo, disparo, esquive) cada tantos ticks; entre decisiones solo se mueve
+TICKS_ENTRE_DECISIONES = 3
+
+# Distancia a la que un bot intenta esquivar una bala que viene hacia él
+DISTANCIA_ESQUIVE = 180
+
+# Tolerancia para considerar al objetivo alineado con el disparo (menor que el radio de impacto)
+TOLERANCIA_PUNTERIA = 18
+
+# Rectángulo de un obstáculo: (izquierda, arriba, derecha, abajo)
+Rectangulo = Tuple[float, float, float, float]
+
+# Dirección de disparo según el eje y el sentido
+_DIRECCIONES = {(1, 0): "right", (-1, 0): "left", (0, 1): "down", (0, -1): "up"}
+
+
+class GrillaNavegacion:
+    """
+    Grilla de celdas transitables del mapa con un campo de flujo por celda destino.
+    Todo se calcula al crearla (una vez por mapa); después, encontrar el siguiente
+    paso hacia cualquier destino es una sola lectura.
+    """
+
+    def __init__(self, ancho: int, alto: int, obstaculos: List[Rectangulo]):
+        self.ancho = ancho
+        self.alto = alto
+        self.obstaculos = obstaculos
+        self.columnas = ancho // TAMAÑO_CELDA
+        self.filas = alto // TAMAÑO_CELDA
+        total = self.columnas * self.filas
+
+        self.transitable = [self._cabe_jugador(*self.centro(celda)) for celda in range(total)]
+        self.vecinos: List[List[int]] = [self._vecinos(celda) for celda in range(total)]
+        # Campo de flujo por destino: celda -> siguiente celda hacia el destino (-1 si no hay camino)
+        self.campos: List[array] = [self._campo_de_flujo(destino) for destino in range(total)]
+
+    def celda(self, x: float, y: float) -> int:
+        """Índice de la celda que contiene el punto (recortado a los bordes del mapa)."""
+        columna = min(self.columnas - 1, max(0, int(x) // TAMAÑO_CELDA))
+        fila = min(self.filas - 1, max(0, int(y) // TAMAÑO_CELDA))
+        return fila * self.columnas + columna
+
+    def centro(self, celda: int) -> Tuple[float, float]:
+        fila, columna = divmod(celda, self.columnas)
+        return (columna + 0.5) * TAMAÑO_CELDA, (fila + 0.5) * TAMAÑO_CELDA
+
+    def siguiente(self, desde: int, destino: int) -> int:
+        """Siguiente celda en el camino más corto de `desde` a `destino` (-1 si no hay)."""
+        return self.campos[destino][desde]
+
+    def libre(self, x: float, y: float) -> bool:
+        """Indica si el jugador cabe en una posición cualquiera (no solo en centros de celda)."""
+        return self._cabe_jugador(x, y)
+
+    def linea_de_vista(self, x1: float, y1: float, x2: float, y2: float) -> bool:
+        """Indica si el segmento entre dos puntos no atraviesa ningún obstáculo."""
+        return not any(_segmento_cruza(x1, y1, x2, y2, rect) for rect in self.obstaculos)
+
+    def _cabe_jugador(self, x: float, y: float) -> bool:
+        if not (RADIO_BOT <= x <= self.ancho - RADIO_BOT and RADIO_BOT <= y <= self.alto - RADIO_BOT):
+            return False
+        return not any(
+            izquierda - RADIO_BOT < x < derecha + RADIO_BOT and arriba - RADIO_BOT < y < abajo + RADIO_BOT
+            for izquierda, arriba, derecha, abajo in self.obstaculos
+        )
+
+    def _vecinos(self, celda: int) -> List[int]:
+        if not self.transitable[celda]:
+            return []
+        fila, columna = divmod(celda, self.columnas)
+        vecinos = []
+        for df, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            f, c = fila + df, columna + dc
+            if 0 <= f < self.filas and 0 <= c < self.columnas:
+                vecina = f * self.columnas + c
+                if self.transitable[vecina]:
+                    vecinos.append(vecina)
+        return vecinos
+
+    def _campo_de_flujo(self, destino: int) -> array:
+        """Recorrido en anchura desde el destino: cada celda apunta a la vecina por la que llegó."""
+        campo = array("h", [-1]) * len(self.transitable)
+        if not self.transitable[destino]:
+            return campo
+        visitadas = bytearray(len(self.transitable))
+        visitadas[destino] = 1
+        pendientes = deque([destino])
+        while pendientes:
+            actual = pendientes.popleft()
+            for vecina in self.vecinos[actual]:
+                if not visitadas[vecina]:
+                    visitadas[vecina] = 1
+                    campo[vecina] = actual
+                    pendientes.append(vecina)
+        return campo
+
+
+def _segmento_cruza(x1: float, y1: float, x2: float, y2: float, rect: Rectangulo) -> bool:
+    """Intersección segmento-rectángulo (recorte de Liang-Barsky)."""
+    izquierda, arriba, derecha, abajo = rect
+    dx, dy = x2 - x1, y2 - y1
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x1 - izquierda), (dx, derecha - x1), (-dy, y1 - arriba), (dy, abajo - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+class ConexionBot:
+    """
+    Conexión falsa de un bot. El servidor le envía lo mismo que a cualquier jugador;
+    se descarta, pero se cuenta (sirve para medir la salida en pruebas de carga).
+    """
+
+    def __init__(self, player_id: int):
+        self.player_id = player_id
+        self.mensajes = 0
+        self.bytes = 0
+
+    async def send(self, mensaje: str):
+        self.mensajes += 1
+        self.bytes += len(mensaje)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+    def __repr__(self) -> str:
+        return f"ConexionBot({self.player_id})"
+
+
+class Bot:
+    """
+    Estado y decisiones de un bot. El servidor llama a `pensar` cada
+    TICKS_ENTRE_DECISIONES ticks (si queda presupuesto de CPU) y a `mover` en
+    todos los ticks; el bot nunca modifica la sala directamente.
+    """
+
+    def __init__(self, player_id: int, semilla: str):
+        self.player_id = player_id
+        self.conexion = ConexionBot(player_id)
+        self.aleatorio = random.Random(semilla)
+        self.proxima_decision = 0  # Tick en el que le toca volver a decidir
+        self.destino: int | None = None  # Celda hacia la que navega
+        self.paso: Tuple[float, float] | None = None  # Centro de la próxima celda del camino
+        self.esquive: Tuple[float, float] | None = None  # Desvío perpendicular a una bala
+
+    def pensar(self, sala: Dict[str, Any], grilla: GrillaNavegacion, tick: int) -> str | None:
+        """
+        Elige objetivo y destino, decide si esquivar y devuelve la dirección de
+        disparo ("up", "down", "left", "right") o None.
+        """
+        # Cada bot decide en su propia fase para que no decidan todos en el mismo tick
+        self.proxima_decision = tick + TICKS_ENTRE_DECISIONES - (tick + self.player_id) % TICKS_ENTRE_DECISIONES
+        posicion = sala["estado"].get(self.player_id)
+        if posicion is None:
+            return None
+        x, y = posicion["x"], posicion["y"]
+
+        self.esquive = self._esquive(sala, grilla, x, y)
+
+        # Objetivo: el rival vulnerable más cercano (a igual distancia, el de menor id)
+        rivales = sorted(
+            (abs(pos["x"] - x) + abs(pos["y"] - y), pid, pos)
+            for pid, pos in sala["estado"].items()
+            if pid != self.player_id and pid not in sala["jugadores_invencibles"]
+        )
+        objetivo = rivales[0][2] if rivales else None
+
+        # La estrella vale la pena si está más cerca que el objetivo
+        estrella = sala["estrella_actual"]
+        if estrella is not None and self.player_id not in sala["jugadores_invencibles"]:
+            distancia_estrella = abs(estrella["x"] - x) + abs(estrella["y"] - y)
+            if objetivo is None or distancia_estrella < rivales[0][0]:
+                self.destino = grilla.celda(estrella["x"], estrella["y"])
+            else:
+                self.destino = grilla.celda(objetivo["x"], objetivo["y"])
+        elif objetivo is not None:
+            self.destino = grilla.celda(objetivo["x"], objetivo["y"])
+        else:
+            self.destino = None
+
+        if objetivo is None:
+            return None
+        direccion = self._apuntar(grilla, x, y, objetivo)
+        if direccion is not None:
+            # Alineado y con vista: quedarse quieto para no perder el ángulo
+            self.destino = grilla.celda(x, y)
+            self.paso = None
+            # Solo se puede tener una bala en el aire
+            if any(bala["player_id"] == self.player_id for bala in sala["balas"].values()):
+                return None
+        return direccion
+
+    def mover(self, grilla: GrillaNavegacion, x: float, y: float) -> Tuple[float, float]:
+        """Avanza un tick hacia el desvío o por el camino hacia el destino."""
+        if self.esquive is not None:
+            nuevo = _avanzar(x, y, *self.esquive)
+            if (nuevo[0], nuevo[1]) == self.esquive:
+                self.esquive = None
+            return nuevo
+        if self.destino is None:
+            return x, y
+
+        if self.paso is None or (x, y) == self.paso:
+            actual = grilla.celda(x, y)
+            if actual == self.destino:
+                self.paso = None
+                return x, y
+            siguiente = grilla.siguiente(actual, self.destino)
+            # Fuera de la grilla transitable (por ejemplo, al aparecer): ir al centro de la celda
+            self.paso = grilla.centro(siguiente if siguiente >= 0 else actual)
+        nuevo = _avanzar(x, y, *self.paso)
+        if nuevo == self.paso:
+            self.paso = None
+        return nuevo
+
+    def _apuntar(self, grilla: GrillaNavegacion, x: float, y: float, objetivo: Dict[str, float]) -> str | None:
+        """Las balas viajan en los cuatro ejes: dispara si el objetivo está alineado y a la vista."""
+        dx, dy = objetivo["x"] - x, objetivo["y"] - y
+        if abs(dy) <= TOLERANCIA_PUNTERIA and dx:
+            eje = (1 if dx > 0 else -1, 0)
+        elif abs(dx) <= TOLERANCIA_PUNTERIA and dy:
+            eje = (0, 1 if dy > 0 else -1)
+        else:
+            return None
+        if not grilla.linea_de_vista(x, y, objetivo["x"], objetivo["y"]):
+            return None
+        return _DIRECCIONES[eje]
+
+    def _esquive(self, sala: Dict[str, Any], grilla: GrillaNavegacion, x: float, y: float):
+        """Si una bala rival viene directo hacia el bot, elige un punto libre fuera de su línea."""
+        for bala in sala["balas"].values():
+            if bala["player_id"] == self.player_id:
+                continue
+            # Separación perpendicular a la bala y distancia que le falta por recorrer
+            if bala["vx"]:
+                separacion, faltante = y - bala["y"], (x - bala["x"]) * math.copysign(1, bala["vx"])
+            else:
+                separacion, faltante = x - bala["x"], (y - bala["y"]) * math.copysign(1, bala["vy"])
+            if not (0 < faltante <= DISTANCIA_ESQUIVE and abs(separacion) <= RADIO_BOT + 10):
+                continue
+            lado = 1 if separacion >= 0 else -1
+            opciones = [lado, -lado] if self.aleatorio.random() < 0.8 else [-lado, lado]
+            for sentido in opciones:
+                desvio = sentido * (RADIO_BOT + 15) - separacion
+                punto = (x, y + desvio) if bala["vx"] else (x + desvio, y)
+                if grilla.libre(*punto):
+                    return punto
+        return None
+
+
+def _avanzar(x: float, y: float, destino_x: float, destino_y: float) -> Tuple[float, float]:
+    """Avanza VELOCIDAD_BOT píxeles hacia un punto (sin pasarse)."""
+    dx, dy = destino_x - x, destino_y - y
+    distancia = math.hypot(dx, dy)
+    if distancia <= VELOCIDAD_BOT:
+        return destino_x, destino_y
+    return x + dx / distancia * VELOCIDAD_BOT, y + dy / distancia * VELOCIDAD_BOT
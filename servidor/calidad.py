@@ -0,0 +1,111 @@
+"""
+Control de calidad de servicio del servidor de Cowboy Battle.
+Cuando la CPU no alcanza, en lugar de dejar que todos los ticks se estiren y
+todas las salas empeoren a la vez, el servidor baja por una escalera de niveles
+definida de antemano: primero envía menos snapshots a las salas en lobby y a los
+espectadores, después a las salas en partida y, por último, simula menos ticks
+por segundo con un paso más largo. Cuando la carga baja, vuelve a subir solo.
+"""
+
+from collections import deque
+from typing import Any, Deque, Dict
+
+# Escalera de degradación, de mejor a peor calidad:
+# - "lobby": cada cuántos ticks se envía el estado a las salas en lobby o game_over
+# - "partida": cada cuántos ticks se envía el estado a las salas en partida
+# - "transmision": por cuánto se multiplica el intervalo de la transmisión de espectadores
+# - "pasos": ticks de 1/60s que avanza la simulación en cada vuelta del loop
+NIVELES = (
+    {"nombre": "normal", "lobby": 1, "partida": 1, "transmision": 1, "pasos": 1},
+    {"nombre": "lobby_reducido", "lobby": 6, "partida": 1, "transmision": 2, "pasos": 1},
+    {"nombre": "partida_30hz", "lobby": 12, "partida": 2, "transmision": 3, "pasos": 1},
+    {"nombre": "partida_20hz", "lobby": 12, "partida": 3, "transmision": 5, "pasos": 1},
+    {"nombre": "simulacion_30hz", "lobby": 12, "partida": 4, "transmision": 5, "pasos": 2},
+    {"nombre": "simulacion_20hz", "lobby": 12, "partida": 6, "transmision": 10, "pasos": 3},
+)
+
+# Sobrecarga: fracción del tick usada o lag del event loop (en segundos) por encima de los
+# que se baja un nivel, si se mantienen durante ESPERA_BAJAR segundos
+UMBRAL_SOBRECARGA_USO = 0.9
+UMBRAL_SOBRECARGA_LAG = 0.03
+ESPERA_BAJAR = 0.5
+
+# Holgura: por debajo de estos valores (estimados para el nivel anterior) durante
+# ESPERA_SUBIR segundos se recupera un nivel. La distancia entre los umbrales y la
+# espera más larga evitan que el servidor oscile entre dos niveles
+UMBRAL_HOLGURA_USO = 0.5
+UMBRAL_HOLGURA_LAG = 0.01
+ESPERA_SUBIR = 5.0
+
+# Transiciones recientes que se guardan para exportar
+MAX_TRANSICIONES = 50
+
+
+class ControlCalidad:
+    """
+    Elige el nivel de la escalera según el uso del tick y el lag del event loop
+    (los promedios móviles de salud del servidor).
+
+    - `nivel`: índice actual en NIVELES (0 = normal)
+    - `transiciones`: últimos cambios de nivel, con el motivo y las mediciones
+    """
+
+    def __init__(self, ahora: float):
+        self.nivel = 0
+        self.sobrecarga_desde: float | None = None
+        self.holgura_desde: float | None = None
+        self.transiciones: Deque[Dict[str, Any]] = deque(maxlen=MAX_TRANSICIONES)
+        self.ultima_transicion = ahora
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return NIVELES[self.nivel]
+
+    def actualizar(self, uso_tick: float, lag_loop: float, ahora: float) -> Dict[str, Any] | None:
+        """
+        Registra una medición y cambia de nivel si corresponde. Devuelve la
+        transición (para registrarla) o None si el nivel no cambió.
+        """
+        sobrecarga = uso_tick > UMBRAL_SOBRECARGA_USO or lag_loop > UMBRAL_SOBRECARGA_LAG
+        # El uso se mide contra el tick actual: con menos pasos por vuelta, el mismo trabajo usa más del tick
+        uso_nivel_anterior = uso_tick
+        if self.nivel > 0:
+            uso_nivel_anterior = uso_tick * self.config["pasos"] / NIVELES[self.nivel - 1]["pasos"]
+        holgura = (self.nivel > 0 and uso_nivel_anterior < UMBRAL_HOLGURA_USO
+                   and lag_loop < UMBRAL_HOLGURA_LAG)
+
+        self.sobrecarga_desde = (self.sobrecarga_desde or ahora) if sobrecarga else None
+        self.holgura_desde = (self.holgura_desde or ahora) if holgura else None
+
+        if (self.sobrecarga_desde is not None and ahora - self.sobrecarga_desde >= ESPERA_BAJAR
+                and self.nivel < len(NIVELES) - 1):
+            return self._cambiar(self.nivel + 1, "sobrecarga", uso_tick, lag_loop, ahora)
+        if self.holgura_desde is not None and ahora - self.holgura_desde >= ESPERA_SUBIR:
+            return self._cambiar(self.nivel - 1, "recuperacion", uso_tick, lag_loop, ahora)
+        return None
+
+    def _cambiar(self, nivel: int, motivo: str, uso_tick: float, lag_loop: float, ahora: float) -> Dict[str, Any]:
+        transicion = {
+            "desde": NIVELES[self.nivel]["nombre"],
+            "hasta": NIVELES[nivel]["nombre"],
+            "nivel": nivel,
+            "motivo": motivo,
+            "uso_tick": round(uso_tick, 3),
+            "lag_loop": round(lag_loop, 4),
+            "segundos_en_nivel_anterior": round(ahora - self.ultima_transicion, 1)
+        }
+        self.nivel = nivel
+        self.ultima_transicion = ahora
+        # Cada nivel se mide de cero: las mediciones anteriores eran con otra carga
+        self.sobrecarga_desde = None
+        self.holgura_desde = None
+        self.transiciones.append(transicion)
+        return transicion
+
+    def reporte(self) -> Dict[str, Any]:
+        """Nivel actual y últimas transiciones (se exporta con las métricas)."""
+        return {
+            "nivel": self.nivel,
+            "nombre": self.config["nombre"],
+            "transiciones": list(self.transiciones)
+        }
@@ -0,0 +1,55 @@
+"""
+Checkpoints del estado de las salas del servidor de Cowboy Battle.
+Escribe y lee instantáneas compactas (JSON) de las salas en curso para que un
+proceso nuevo pueda restaurarlas tras una caída o un reinicio.
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict
+
+# Versión del formato; un checkpoint de otra versión se ignora
+VERSION_CHECKPOINT = 1
+
+
+def escribir(ruta: str, datos: Dict[str, Any]) -> int:
+    """
+    Escribe el checkpoint en `ruta` de forma atómica (archivo temporal + fsync + reemplazo)
+    y devuelve su tamaño en bytes. Es bloqueante: se llama fuera del event loop.
+    """
+    contenido = json.dumps(
+        {"version": VERSION_CHECKPOINT, "escrito_en": time.time(), **datos},
+        separators=(",", ":")
+    ).encode("utf-8")
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as archivo:
+        archivo.write(contenido)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+    return len(contenido)
+
+
+def leer(ruta: str, antiguedad_maxima: float) -> Dict[str, Any] | None:
+    """
+    Lee el checkpoint de `ruta`. Devuelve None si no existe, está dañado, es de otra
+    versión o tiene más de `antiguedad_maxima` segundos.
+    """
+    try:
+        with open(ruta, "rb") as archivo:
+            datos = json.loads(archivo.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Checkpoint {ruta} ilegible, se ignora: {e}")
+        return None
+
+    if datos.get("version") != VERSION_CHECKPOINT:
+        print(f"Checkpoint {ruta} de otra versión ({datos.get('version')}), se ignora")
+        return None
+    antiguedad = time.time() - datos.get("escrito_en", 0)
+    if antiguedad > antiguedad_maxima:
+        print(f"Checkpoint {ruta} demasiado viejo ({antiguedad:.0f}s), se ignora")
+        return None
+    return datos
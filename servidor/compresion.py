@@ -0,0 +1,123 @@
+"""
+Compresión selectiva por tipo de mensaje para el servidor de Cowboy Battle.
+Extiende permessage-deflate de websockets para decidir, mensaje por mensaje,
+si se comprime según su "tipo" y su tamaño, y registra la tasa de compresión
+y el costo de CPU de cada tipo.
+"""
+
+import time
+from collections import defaultdict
+from typing import Any, Dict
+
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import CTRL_OPCODES, Frame, Opcode
+
+# Prefijo con el que json.dumps serializa los mensajes del servidor ({"tipo": ...} siempre va primero)
+_PREFIJO_TIPO = b'{"tipo": "'
+
+# Estadísticas por tipo de mensaje (compartidas por todas las conexiones)
+estadisticas: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: {"mensajes": 0, "comprimidos": 0, "bytes_originales": 0, "bytes_enviados": 0, "cpu_ns": 0}
+)
+
+
+def tipo_mensaje(datos: Any) -> str:
+    """Extrae el "tipo" de un mensaje JSON sin decodificarlo completo."""
+    inicio = bytes(datos[:48])
+    if not inicio.startswith(_PREFIJO_TIPO):
+        return "otro"
+    fin = inicio.find(b'"', len(_PREFIJO_TIPO))
+    if fin == -1:
+        return "otro"
+    return inicio[len(_PREFIJO_TIPO):fin].decode("utf-8", "replace")
+
+
+class PoliticaCompresion:
+    """
+    Decide qué mensajes se comprimen.
+
+    `umbrales` asocia cada tipo de mensaje con el tamaño mínimo (en bytes) a partir
+    del cual se comprime; None significa que ese tipo nunca se comprime. Los tipos
+    que no aparecen usan `umbral_por_defecto`.
+    """
+
+    def __init__(self, umbrales: Dict[str, int | None], umbral_por_defecto: int | None):
+        self.umbrales = umbrales
+        self.umbral_por_defecto = umbral_por_defecto
+
+    def debe_comprimir(self, tipo: str, tamaño: int) -> bool:
+        umbral = self.umbrales.get(tipo, self.umbral_por_defecto)
+        return umbral is not None and tamaño >= umbral
+
+
+class DeflateSelectivo(PerMessageDeflate):
+    """permessage-deflate que solo comprime los mensajes que acepta la política."""
+
+    def __init__(self, politica: PoliticaCompresion, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.politica = politica
+        self.tipo_actual = "otro"
+        self.comprimir_actual = False
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+
+        # La decisión se toma en el primer fragmento y vale para todo el mensaje
+        if frame.opcode is not Opcode.CONT:
+            self.tipo_actual = tipo_mensaje(frame.data)
+            self.comprimir_actual = self.politica.debe_comprimir(self.tipo_actual, len(frame.data))
+
+        acumulado = estadisticas[self.tipo_actual]
+        if frame.fin:
+            acumulado["mensajes"] += 1
+        acumulado["bytes_originales"] += len(frame.data)
+
+        if not self.comprimir_actual:
+            acumulado["bytes_enviados"] += len(frame.data)
+            return frame
+
+        inicio = time.perf_counter_ns()
+        codificado = super().encode(frame)
+        acumulado["cpu_ns"] += time.perf_counter_ns() - inicio
+        acumulado["bytes_enviados"] += len(codificado.data)
+        if frame.fin:
+            acumulado["comprimidos"] += 1
+        return codificado
+
+
+class FabricaDeflateSelectivo(ServerPerMessageDeflateFactory):
+    """Negocia permessage-deflate como siempre, pero crea extensiones DeflateSelectivo."""
+
+    def __init__(self, politica: PoliticaCompresion, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.politica = politica
+
+    def process_request_params(self, params, accepted_extensions):
+        respuesta, extension = super().process_request_params(params, accepted_extensions)
+        return respuesta, DeflateSelectivo(
+            self.politica,
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+        )
+
+
+def reporte() -> Dict[str, Dict[str, float]]:
+    """Resume por tipo de mensaje la tasa de compresión y el costo de CPU."""
+    resultado = {}
+    for tipo, acumulado in list(estadisticas.items()):
+        resultado[tipo] = {
+            "mensajes": acumulado["mensajes"],
+            "comprimidos": acumulado["comprimidos"],
+            "bytes_originales": acumulado["bytes_originales"],
+            "bytes_enviados": acumulado["bytes_enviados"],
+            "tasa": acumulado["bytes_enviados"] / acumulado["bytes_originales"] if acumulado["bytes_originales"] else 1.0,
+            "cpu_us_por_mensaje": acumulado["cpu_ns"] / 1000 / acumulado["comprimidos"] if acumulado["comprimidos"] else 0.0,
+        }
+    return resultado
@@ -0,0 +1,54 @@
+"""
+Canal UDP opcional del servidor de Cowboy Battle.
+Los snapshots (`estado`) y la posición de los jugadores pueden viajar por
+datagramas en lugar del WebSocket: un paquete perdido ya no retrasa a los
+siguientes (sin bloqueo de cabeza de línea). Los eventos siguen por TCP.
+"""
+
+import asyncio
+import json
+from typing import Any, Callable, Dict, Tuple
+
+# Tamaño máximo de un datagrama (cabe en un paquete sin fragmentarse en casi cualquier red)
+MAX_DATAGRAMA = 1200
+
+# Respuesta al saludo de un cliente (confirma que el camino de vuelta funciona)
+HOLA_OK = b'{"tipo": "hola_ok"}'
+
+
+class ProtocoloDatagramas(asyncio.DatagramProtocol):
+    """
+    Protocolo de asyncio para el socket UDP del servidor: decodifica cada datagrama
+    y se lo pasa a `al_recibir(datos, direccion)`. Los datagramas demasiado grandes
+    o que no son un objeto JSON se descartan.
+    """
+
+    def __init__(self, al_recibir: Callable[[Dict[str, Any], Tuple[str, int]], None]):
+        self.al_recibir = al_recibir
+        self.transporte = None
+        self.descartados = 0
+
+    def connection_made(self, transporte):
+        self.transporte = transporte
+
+    def datagram_received(self, datos: bytes, direccion: Tuple[str, int]):
+        if len(datos) > MAX_DATAGRAMA:
+            self.descartados += 1
+            return
+        try:
+            mensaje = json.loads(datos)
+        except ValueError:
+            self.descartados += 1
+            return
+        if not isinstance(mensaje, dict):
+            self.descartados += 1
+            return
+        self.al_recibir(mensaje, direccion)
+
+    def error_received(self, error: Exception):
+        # Por ejemplo, "puerto inalcanzable" de un cliente que ya se fue: no es fatal
+        print(f"Error en el canal UDP: {error}")
+
+    def enviar(self, datos: bytes, direccion: Tuple[str, int]):
+        if self.transporte is not None:
+            self.transporte.sendto(datos, direccion)
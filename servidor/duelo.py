@@ -0,0 +1,180 @@
+"""
+Simulación determinista del modo duelo (1 contra 1) de Cowboy Battle.
+Con el mismo estado y las mismas entradas, `avanzar()` produce exactamente el
+mismo estado en el servidor y en los dos clientes: solo usa enteros, sin reloj
+ni azar. Por eso en un duelo por la red solo viajan las entradas de cada frame,
+y cada cliente puede predecir, volver atrás y re-simular por su cuenta.
+
+Este archivo está repetido en servidor/ y en cliente/: las dos copias deben ser idénticas.
+"""
+
+import zlib
+from typing import Any, Dict, List, Tuple
+
+# Frames de simulación por segundo
+FRAMES_POR_SEGUNDO = 60
+
+# Bits de la entrada de un jugador en un frame
+ARRIBA = 1
+ABAJO = 2
+IZQUIERDA = 4
+DERECHA = 8
+DISPARO = 16
+ENTRADA_MAXIMA = ARRIBA | ABAJO | IZQUIERDA | DERECHA | DISPARO
+
+# Direcciones (en el orden de DIRECCIONES) y su velocidad unitaria
+DIRECCIONES = ("up", "down", "left", "right")
+_VECTORES = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+# Reglas del juego (deben coincidir con el modo normal)
+ANCHO_MAPA = 800
+ALTO_MAPA = 600
+TAMAÑO_JUGADOR = 60
+VELOCIDAD_JUGADOR = 5
+VELOCIDAD_BALA = 10
+RADIO_IMPACTO = 25
+IMPACTOS_PARA_GANAR = 3
+POSICIONES_INICIALES = ((200, 300), (600, 300))
+
+# Obstáculos (tipo, x, y) y tamaño (ancho, alto) por tipo (deben coincidir con el servidor y el cliente)
+OBSTACULOS = (
+    ("barril_marron", 400, 300),
+    ("barril_naranja", 70, 100),
+    ("barril_marron", 540, 210),
+    ("cactus", 150, 150),
+    ("cactus", 650, 450),
+    ("cactus", 400, 100),
+)
+TAMAÑOS_OBSTACULO = {"cactus": (50, 80), "barril_marron": (55, 85), "barril_naranja": (55, 85)}
+
+# Rectángulos (izquierda, arriba, derecha, abajo) centrados como un pygame.Rect
+RECTANGULOS = tuple(
+    (
+        x - TAMAÑOS_OBSTACULO[tipo][0] // 2,
+        y - TAMAÑOS_OBSTACULO[tipo][1] // 2,
+        x - TAMAÑOS_OBSTACULO[tipo][0] // 2 + TAMAÑOS_OBSTACULO[tipo][0],
+        y - TAMAÑOS_OBSTACULO[tipo][1] // 2 + TAMAÑOS_OBSTACULO[tipo][1],
+    )
+    for tipo, x, y in OBSTACULOS
+)
+
+
+class EstadoDuelo:
+    """
+    Estado completo de un duelo en un frame.
+
+    - `jugadores[i]`: [x, y, direccion, impactos] (direccion es un índice de DIRECCIONES)
+    - `balas[i]`: [x, y, vx, vy] de la bala activa del jugador i, o None
+    - `ganador`: índice del jugador que ganó, o None
+    """
+
+    __slots__ = ("frame", "jugadores", "balas", "ganador")
+
+    def __init__(self, frame: int, jugadores: List[List[int]], balas: List[List[int] | None],
+                 ganador: int | None = None):
+        self.frame = frame
+        self.jugadores = jugadores
+        self.balas = balas
+        self.ganador = ganador
+
+    @classmethod
+    def inicial(cls) -> "EstadoDuelo":
+        return cls(0, [[x, y, 0, 0] for x, y in POSICIONES_INICIALES], [None, None])
+
+    def copiar(self) -> "EstadoDuelo":
+        return EstadoDuelo(
+            self.frame,
+            [list(jugador) for jugador in self.jugadores],
+            [list(bala) if bala is not None else None for bala in self.balas],
+            self.ganador
+        )
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {"frame": self.frame, "jugadores": self.jugadores, "balas": self.balas, "ganador": self.ganador}
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any]) -> "EstadoDuelo":
+        return cls(datos["frame"], datos["jugadores"], datos["balas"], datos["ganador"]).copiar()
+
+    def suma(self) -> int:
+        """Suma de verificación del estado (igual en cualquier proceso o máquina)."""
+        return zlib.crc32(repr((self.frame, self.jugadores, self.balas, self.ganador)).encode("ascii"))
+
+
+def _choca_jugador(x: int, y: int) -> bool:
+    """Indica si el jugador centrado en (x, y) se superpone con un obstáculo (como Rect.colliderect)."""
+    mitad = TAMAÑO_JUGADOR // 2
+    izquierda, arriba = x - mitad, y - mitad
+    derecha, abajo = izquierda + TAMAÑO_JUGADOR, arriba + TAMAÑO_JUGADOR
+    return any(
+        izquierda < obs_der and derecha > obs_izq and arriba < obs_aba and abajo > obs_arr
+        for obs_izq, obs_arr, obs_der, obs_aba in RECTANGULOS
+    )
+
+
+def _mover_jugador(jugador: List[int], entrada: int):
+    """Mueve a un jugador como lo hace el cliente: primero en X y después en Y, sin atravesar obstáculos."""
+    mx = my = 0
+    if entrada & ARRIBA:
+        my = -VELOCIDAD_JUGADOR
+        jugador[2] = 0
+    if entrada & ABAJO:
+        my = VELOCIDAD_JUGADOR
+        jugador[2] = 1
+    if entrada & IZQUIERDA:
+        mx = -VELOCIDAD_JUGADOR
+        jugador[2] = 2
+    if entrada & DERECHA:
+        mx = VELOCIDAD_JUGADOR
+        jugador[2] = 3
+
+    mitad = TAMAÑO_JUGADOR // 2
+    if mx:
+        nuevo_x = max(mitad, min(ANCHO_MAPA - mitad, jugador[0] + mx))
+        if not _choca_jugador(nuevo_x, jugador[1]):
+            jugador[0] = nuevo_x
+    if my:
+        nuevo_y = max(mitad, min(ALTO_MAPA - mitad, jugador[1] + my))
+        if not _choca_jugador(jugador[0], nuevo_y):
+            jugador[1] = nuevo_y
+
+
+def avanzar(estado: EstadoDuelo, entradas: Tuple[int, int]):
+    """
+    Avanza el estado un frame con las entradas de los dos jugadores (modifica `estado`).
+    Orden: movimiento, disparos y después balas (obstáculos, bordes e impactos).
+    Una vez que hay ganador, solo avanza el número de frame.
+    """
+    estado.frame += 1
+    if estado.ganador is not None:
+        return
+
+    for jugador, entrada in zip(estado.jugadores, entradas):
+        _mover_jugador(jugador, entrada)
+
+    # Cada jugador puede tener una sola bala activa
+    for i, entrada in enumerate(entradas):
+        if entrada & DISPARO and estado.balas[i] is None:
+            x, y, direccion, _ = estado.jugadores[i]
+            vx, vy = _VECTORES[direccion]
+            estado.balas[i] = [x, y, vx * VELOCIDAD_BALA, vy * VELOCIDAD_BALA]
+
+    for i, bala in enumerate(estado.balas):
+        if bala is None:
+            continue
+        bala[0] += bala[2]
+        bala[1] += bala[3]
+        bx, by = bala[0], bala[1]
+        if bx < 0 or bx > ANCHO_MAPA or by < 0 or by > ALTO_MAPA:
+            estado.balas[i] = None
+            continue
+        if any(izq <= bx <= der and arr <= by <= aba for izq, arr, der, aba in RECTANGULOS):
+            estado.balas[i] = None
+            continue
+        rival = estado.jugadores[1 - i]
+        dx, dy = rival[0] - bx, rival[1] - by
+        if dx * dx + dy * dy <= RADIO_IMPACTO * RADIO_IMPACTO:
+            estado.balas[i] = None
+            estado.jugadores[i][3] += 1
+            if estado.jugadores[i][3] >= IMPACTOS_PARA_GANAR and estado.ganador is None:
+                estado.ganador = i
@@ -0,0 +1,75 @@
+"""
+Emparejamiento rápido del servidor de Cowboy Battle.
+Quien pide `quick_play` entra a una cola. Cada tanto el servidor recorre la
+cola una sola vez y arma grupos por orden de llegada: prefiere salas llenas,
+pero cuanto más espera el primero de la cola, más chico es el grupo que acepta
+(y, si espera demasiado, se completa con bots). Cada grupo es una sala nueva
+que empieza enseguida.
+"""
+
+from itertools import islice
+from typing import Any, Dict, List, Tuple
+
+# Tamaño mínimo de grupo que se acepta según cuánto lleva esperando el primero de la cola:
+# (segundos de espera, jugadores). Con 1 jugador el resto de la sala se completa con bots
+ESCALONES_TAMAÑO = (
+    (0.0, 4),
+    (3.0, 3),
+    (6.0, 2),
+    (20.0, 1),
+)
+
+# Jugador en la cola: (conexión, nombre, segundos de espera)
+Emparejado = Tuple[Any, str, float]
+
+
+def tamaño_aceptado(espera: float) -> int:
+    """Tamaño mínimo de grupo para alguien que lleva `espera` segundos en la cola."""
+    tamaño = ESCALONES_TAMAÑO[0][1]
+    for desde, jugadores in ESCALONES_TAMAÑO:
+        if espera >= desde:
+            tamaño = jugadores
+    return tamaño
+
+
+class ColaEmparejamiento:
+    """
+    Jugadores esperando partida, en orden de llegada.
+
+    - `esperando`: conexión -> (nombre, momento en que entró a la cola)
+    """
+
+    def __init__(self, tamaño_sala: int):
+        self.tamaño_sala = tamaño_sala
+        self.esperando: Dict[Any, Tuple[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.esperando)
+
+    def agregar(self, conexion: Any, nombre: str, ahora: float) -> int:
+        """Pone a un jugador al final de la cola (si ya estaba, conserva su lugar). Devuelve su posición."""
+        if conexion not in self.esperando:
+            self.esperando[conexion] = (nombre, ahora)
+        return list(self.esperando).index(conexion) + 1
+
+    def quitar(self, conexion: Any) -> bool:
+        return self.esperando.pop(conexion, None) is not None
+
+    def formar_grupos(self, ahora: float, max_grupos: int) -> List[List[Emparejado]]:
+        """
+        Saca de la cola los grupos que ya se pueden armar (hasta `max_grupos`):
+        mientras el primero de la cola acepte un grupo del tamaño de lo que hay,
+        se llevan hasta `tamaño_sala` jugadores por orden de llegada.
+        """
+        grupos = []
+        while self.esperando and len(grupos) < max_grupos:
+            primero = next(iter(self.esperando))
+            espera = ahora - self.esperando[primero][1]
+            if len(self.esperando) < min(tamaño_aceptado(espera), self.tamaño_sala):
+                break
+            grupo = []
+            for conexion in list(islice(self.esperando, self.tamaño_sala)):
+                nombre, desde = self.esperando.pop(conexion)
+                grupo.append((conexion, nombre, ahora - desde))
+            grupos.append(grupo)
+        return grupos
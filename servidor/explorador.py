@@ -0,0 +1,82 @@
+"""
+Explorador de salas públicas del servidor de Cowboy Battle.
+Las salas que el host marca como públicas y a las que todavía se puede entrar
+(en lobby y con lugar) forman un índice que se mantiene al día con cada cambio
+de sala. Quien explora recibe una página del índice y después solo los cambios
+(altas, bajas y actualizaciones), juntados por intervalo y codificados una sola
+vez para todos los suscriptores: explorar no recorre las salas.
+"""
+
+from itertools import islice
+from typing import Any, Dict, Set
+
+
+class IndiceSalas:
+    """
+    Salas públicas a las que se puede entrar, en orden de publicación (las que
+    esperan hace más tiempo primero), y los cambios pendientes de avisar.
+
+    - `salas`: código -> resumen (el que reciben los clientes)
+    - `pendientes`: código -> resumen que tenía en el último aviso (None = no estaba)
+    - `suscriptores`: conexiones que reciben los cambios
+    """
+
+    def __init__(self):
+        self.salas: Dict[str, Dict[str, Any]] = {}
+        self.pendientes: Dict[str, Dict[str, Any] | None] = {}
+        self.suscriptores: Set[Any] = set()
+        self.version = 0
+
+    def actualizar(self, codigo_sala: str, resumen: Dict[str, Any] | None):
+        """Anota el resumen actual de una sala (None si ya no es pública o no se puede entrar)."""
+        anterior = self.salas.get(codigo_sala)
+        if resumen == anterior:
+            return  # Un cambio que no se ve en el explorador (por ejemplo, un jugador listo)
+        if codigo_sala not in self.pendientes:
+            self.pendientes[codigo_sala] = anterior
+        if resumen is None:
+            del self.salas[codigo_sala]
+        else:
+            self.salas[codigo_sala] = resumen
+
+    def pagina(self, numero: int, por_pagina: int) -> Dict[str, Any]:
+        """Mensaje con una página del índice (el punto de partida para aplicar los cambios)."""
+        inicio = numero * por_pagina
+        return {
+            "tipo": "salas_publicas",
+            "version": self.version,
+            "pagina": numero,
+            "por_pagina": por_pagina,
+            "total": len(self.salas),
+            "salas": list(islice(self.salas.values(), inicio, inicio + por_pagina))
+        }
+
+    def tomar_cambios(self) -> Dict[str, Any] | None:
+        """
+        Junta los cambios desde el último aviso, uno por sala (una sala que se
+        publicó y se llenó en el mismo intervalo no aparece). None si no hay.
+        """
+        if not self.pendientes:
+            return None
+        agregadas, actualizadas, quitadas = [], [], []
+        for codigo_sala, anterior in self.pendientes.items():
+            actual = self.salas.get(codigo_sala)
+            if actual == anterior:
+                continue
+            if anterior is None:
+                agregadas.append(actual)
+            elif actual is None:
+                quitadas.append(codigo_sala)
+            else:
+                actualizadas.append(actual)
+        self.pendientes.clear()
+        if not (agregadas or actualizadas or quitadas):
+            return None
+        self.version += 1
+        return {
+            "tipo": "salas_publicas_cambios",
+            "version": self.version,
+            "agregadas": agregadas,
+            "actualizadas": actualizadas,
+            "quitadas": quitadas
+        }
@@ -0,0 +1,203 @@
+"""
+Historial de partidas y ranking del servidor de Cowboy Battle.
+Guarda el resultado, los impactos de cada jugador y la duración de cada partida
+en una base SQLite (modo WAL). Un hilo escritor inserta las partidas por lotes
+para que el event loop nunca espere al disco, y el ranking se mantiene en
+memoria, actualizado partida a partida.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+# Partidas que se insertan como máximo en una misma transacción
+LOTE_MAXIMO = 200
+
+# Tiempo (en segundos) que el escritor junta partidas antes de escribir el lote
+ESPERA_LOTE = 0.5
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS partidas (
+    id INTEGER PRIMARY KEY,
+    codigo_sala TEXT NOT NULL,
+    ganador_id INTEGER,
+    motivo TEXT,
+    inicio REAL NOT NULL,
+    fin REAL NOT NULL,
+    duracion REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jugadores_partida (
+    partida_id INTEGER NOT NULL REFERENCES partidas(id),
+    player_id INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    impactos INTEGER NOT NULL,
+    gano INTEGER NOT NULL,
+    es_bot INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jugadores_partida_nombre ON jugadores_partida(nombre);
+"""
+
+# Marca de fin para el hilo escritor
+_FIN = object()
+
+
+def abrir(ruta: str) -> sqlite3.Connection:
+    """Abre la base de historial en modo WAL y crea las tablas si no existen."""
+    conexion = sqlite3.connect(ruta)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    # Con WAL, NORMAL no pierde consistencia y evita un fsync por transacción
+    conexion.execute("PRAGMA synchronous=NORMAL")
+    conexion.executescript(ESQUEMA)
+    # Bases creadas antes de que existieran los bots
+    columnas = {fila[1] for fila in conexion.execute("PRAGMA table_info(jugadores_partida)")}
+    if "es_bot" not in columnas:
+        conexion.execute("ALTER TABLE jugadores_partida ADD COLUMN es_bot INTEGER NOT NULL DEFAULT 0")
+    return conexion
+
+
+def totales_por_jugador(ruta: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Totales históricos (nombre, victorias, partidas, impactos) de cada jugador real.
+    Recorre toda la tabla: solo se usa al arrancar para reconstruir el ranking.
+    """
+    conexion = abrir(ruta)
+    try:
+        return conexion.execute(
+            "SELECT nombre, SUM(gano), COUNT(*), SUM(impactos) "
+            "FROM jugadores_partida WHERE es_bot = 0 GROUP BY nombre"
+        ).fetchall()
+    finally:
+        conexion.close()
+
+
+class EscritorHistorial:
+    """
+    Hilo que escribe las partidas terminadas en la base por lotes. `registrar` solo
+    encola (no bloquea); el hilo junta lo que llega durante ESPERA_LOTE y lo inserta
+    en una sola transacción.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.cola: queue.SimpleQueue = queue.SimpleQueue()
+        self.partidas_guardadas = 0
+        self.lotes_escritos = 0
+        self.errores = 0
+        self.ultimo_lote_s = 0.0
+        self._hilo = threading.Thread(target=self._ejecutar, name="escritor-historial", daemon=True)
+        self._hilo.start()
+
+    def registrar(self, partida: Dict[str, Any]):
+        """Encola una partida terminada para escribirla en el próximo lote."""
+        self.cola.put(partida)
+
+    def pendientes(self) -> int:
+        """Partidas encoladas que todavía no se escribieron."""
+        return self.cola.qsize()
+
+    def cerrar(self, espera: float | None = None):
+        """Escribe lo pendiente y detiene el hilo (bloqueante)."""
+        self.cola.put(_FIN)
+        self._hilo.join(espera)
+
+    def _ejecutar(self):
+        conexion = abrir(self.ruta)
+        terminar = False
+        while not terminar:
+            lote = [self.cola.get()]
+            if lote[0] is _FIN:
+                break
+            # Juntar lo que llegue durante la espera, hasta LOTE_MAXIMO
+            limite = time.monotonic() + ESPERA_LOTE
+            while len(lote) < LOTE_MAXIMO:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    partida = self.cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if partida is _FIN:
+                    terminar = True
+                    break
+                lote.append(partida)
+            self._escribir_lote(conexion, lote)
+        conexion.close()
+
+    def _escribir_lote(self, conexion: sqlite3.Connection, lote: List[Dict[str, Any]]):
+        inicio = time.perf_counter()
+        try:
+            with conexion:
+                for partida in lote:
+                    cursor = conexion.execute(
+                        "INSERT INTO partidas (codigo_sala, ganador_id, motivo, inicio, fin, duracion) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (partida["codigo_sala"], partida["ganador"], partida["motivo"],
+                         partida["inicio"], partida["fin"], partida["fin"] - partida["inicio"])
+                    )
+                    conexion.executemany(
+                        "INSERT INTO jugadores_partida (partida_id, player_id, nombre, impactos, gano, es_bot) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (cursor.lastrowid, jugador["player_id"], jugador["nombre"], jugador["impactos"],
+                             int(jugador["player_id"] == partida["ganador"]), int(jugador.get("es_bot", False)))
+                            for jugador in partida["jugadores"]
+                        ]
+                    )
+        except sqlite3.Error as e:
+            self.errores += 1
+            print(f"Error al escribir {len(lote)} partidas en el historial: {e}")
+            return
+        self.partidas_guardadas += len(lote)
+        self.lotes_escritos += 1
+        self.ultimo_lote_s = time.perf_counter() - inicio
+
+
+class Ranking:
+    """
+    Top de jugadores (por victorias, luego impactos) mantenido en memoria. Los
+    totales solo crecen, así que al terminar una partida basta con reordenar a
+    los jugadores que ya estaban en el top y a los que la jugaron.
+    """
+
+    def __init__(self, tamaño: int):
+        self.tamaño = tamaño
+        self.totales: Dict[str, Dict[str, int]] = {}  # nombre -> {"victorias", "partidas", "impactos"}
+        self.top: List[str] = []
+
+    def _clave(self, nombre: str) -> Tuple[int, int]:
+        # Solo valores que crecen: así nadie de fuera del top puede pasar a uno de adentro sin jugar
+        total = self.totales[nombre]
+        return total["victorias"], total["impactos"]
+
+    def _reordenar(self, candidatos):
+        en_top = set(self.top)
+        nuevos = [nombre for nombre in candidatos if nombre not in en_top]
+        self.top = sorted(self.top + nuevos, key=self._clave, reverse=True)[:self.tamaño]
+
+    def cargar(self, filas: List[Tuple[str, int, int, int]]):
+        """Reconstruye el ranking con los totales de `totales_por_jugador`."""
+        for nombre, victorias, partidas, impactos in filas:
+            self.totales[nombre] = {"victorias": victorias, "partidas": partidas, "impactos": impactos}
+        self.top = []
+        self._reordenar(self.totales)
+
+    def registrar_partida(self, partida: Dict[str, Any]):
+        """Suma una partida terminada a los totales de sus jugadores (sin bots) y actualiza el top."""
+        jugadores = [jugador for jugador in partida["jugadores"] if not jugador.get("es_bot")]
+        for jugador in jugadores:
+            total = self.totales.setdefault(jugador["nombre"], {"victorias": 0, "partidas": 0, "impactos": 0})
+            total["partidas"] += 1
+            total["impactos"] += jugador["impactos"]
+            if jugador["player_id"] == partida["ganador"]:
+                total["victorias"] += 1
+        self._reordenar(jugador["nombre"] for jugador in jugadores)
+
+    def consultar(self, limite: int | None = None) -> List[Dict[str, Any]]:
+        """Los primeros `limite` jugadores del ranking, ya ordenados."""
+        return [
+            {"posicion": posicion, "nombre": nombre, **self.totales[nombre]}
+            for posicion, nombre in enumerate(self.top[:limite], start=1)
+        ]
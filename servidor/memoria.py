@@ -0,0 +1,166 @@
+"""
+Contabilidad de memoria del servidor de Cowboy Battle.
+Estima el tamaño de las estructuras del servidor (salas, conexiones) y compara
+snapshots de tracemalloc agrupando las asignaciones por la función del servidor
+que las hizo.
+"""
+
+import ast
+import os
+import sys
+import tracemalloc
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Tuple
+
+# Marcos de pila que guarda tracemalloc por asignación (para llegar a la función del servidor)
+MARCOS_RASTREO = 16
+
+# Contenedores que se recorren al medir; cualquier otro objeto se cuenta solo superficialmente
+_CONTENEDORES = (dict, list, tuple, set, frozenset, deque)
+
+# Directorio del servidor: solo sus funciones aparecen en el reporte
+DIRECTORIO_SERVIDOR = os.path.dirname(os.path.abspath(__file__))
+
+# Parte de la ruta que identifica a los archivos de la librería websockets
+_SEPARADOR_WEBSOCKETS = f"{os.sep}websockets{os.sep}"
+
+# Cache de funciones por archivo: ruta -> [(linea_inicio, linea_fin, nombre)]
+_funciones_por_archivo: Dict[str, List[Tuple[int, int, str]]] = {}
+
+
+def tamaño_profundo(obj: Any, vistos: set | None = None) -> int:
+    """
+    Tamaño aproximado en bytes de `obj` y de los contenedores que cuelgan de él.
+    Los objetos que no son contenedores (por ejemplo, conexiones) se cuentan sin
+    recorrerlos, y nada se cuenta dos veces dentro de `vistos`.
+    """
+    if vistos is None:
+        vistos = set()
+    pendientes = [obj]
+    total = 0
+    while pendientes:
+        actual = pendientes.pop()
+        if id(actual) in vistos:
+            continue
+        vistos.add(id(actual))
+        total += sys.getsizeof(actual)
+        if isinstance(actual, dict):
+            pendientes.extend(actual.keys())
+            pendientes.extend(actual.values())
+        elif isinstance(actual, _CONTENEDORES):
+            pendientes.extend(actual)
+    return total
+
+
+def memoria_zlib(window_bits: int, mem_level: int) -> Tuple[int, int]:
+    """
+    Memoria que reserva zlib (fuera de tracemalloc) para un compresor y un
+    descompresor, según las fórmulas de su documentación (zconf.h).
+    """
+    compresor = (1 << (window_bits + 2)) + (1 << (mem_level + 9))
+    descompresor = (1 << window_bits) + 7 * 1024
+    return compresor, descompresor
+
+
+def rss_bytes() -> int | None:
+    """Memoria residente del proceso (solo en Linux; None si no se puede leer)."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as archivo:
+            for linea in archivo:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def iniciar_rastreo() -> bool:
+    """Activa tracemalloc si no estaba activo. Devuelve True si se acaba de activar."""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(MARCOS_RASTREO)
+    return True
+
+
+def detener_rastreo():
+    """Desactiva tracemalloc y libera sus trazas (rastrear tiene un costo de CPU alto)."""
+    tracemalloc.stop()
+
+
+def tomar_snapshot() -> tracemalloc.Snapshot:
+    """Toma un snapshot de tracemalloc sin las asignaciones del propio tracemalloc."""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def _funciones_de(ruta: str) -> List[Tuple[int, int, str]]:
+    """Rangos de líneas de cada función definida en un archivo del servidor."""
+    if ruta not in _funciones_por_archivo:
+        funciones = []
+        try:
+            with open(ruta, encoding="utf-8") as archivo:
+                arbol = ast.parse(archivo.read())
+            for nodo in ast.walk(arbol):
+                if isinstance(nodo, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    funciones.append((nodo.lineno, nodo.end_lineno, nodo.name))
+        except (OSError, SyntaxError):
+            pass
+        # Las funciones anidadas van después para que ganen sobre la que las contiene
+        funciones.sort(key=lambda rango: (rango[0], -rango[1]))
+        _funciones_por_archivo[ruta] = funciones
+    return _funciones_por_archivo[ruta]
+
+
+def funcion_del_servidor(traceback: tracemalloc.Traceback) -> str:
+    """
+    Nombre ("modulo.funcion") de la función del servidor más cercana a la asignación.
+    Si ningún marco es del servidor, se usa el archivo donde se asignó.
+    """
+    # tracemalloc ordena los marcos del más antiguo al más reciente
+    for marco in reversed(traceback):
+        if not marco.filename.startswith(DIRECTORIO_SERVIDOR):
+            continue
+        nombre_funcion = "<modulo>"
+        for inicio, fin, nombre in _funciones_de(marco.filename):
+            if inicio <= marco.lineno <= fin:
+                nombre_funcion = nombre
+        modulo = os.path.splitext(os.path.basename(marco.filename))[0]
+        return f"{modulo}.{nombre_funcion}"
+    return f"<{os.path.basename(traceback[-1].filename)}>"
+
+
+def diferencia_por_funcion(anterior: tracemalloc.Snapshot, actual: tracemalloc.Snapshot,
+                           limite: int = 30) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Compara dos snapshots y agrupa la diferencia por función del servidor.
+    Devuelve las `limite` funciones con más crecimiento (en bytes) y, de paso, los
+    bytes vivos asignados por websockets (sin los contextos de zlib, que se estiman
+    con `memoria_zlib`).
+    """
+    grupos: Dict[str, Dict[str, int]] = defaultdict(
+        lambda: {"bytes": 0, "bytes_diferencia": 0, "bloques": 0, "bloques_diferencia": 0}
+    )
+    bytes_websockets = 0
+    for estadistica in actual.compare_to(anterior, "traceback"):
+        grupo = grupos[funcion_del_servidor(estadistica.traceback)]
+        grupo["bytes"] += estadistica.size
+        grupo["bytes_diferencia"] += estadistica.size_diff
+        grupo["bloques"] += estadistica.count
+        grupo["bloques_diferencia"] += estadistica.count_diff
+
+        if estadistica.size and _es_de_websockets(estadistica.traceback):
+            bytes_websockets += estadistica.size
+
+    ordenadas = sorted(grupos.items(), key=lambda par: par[1]["bytes_diferencia"], reverse=True)
+    return [{"funcion": funcion, **datos} for funcion, datos in ordenadas[:limite]], bytes_websockets
+
+
+def _es_de_websockets(traceback: tracemalloc.Traceback) -> bool:
+    """Indica si la asignación pasó por websockets (excepto la creación de contextos de zlib)."""
+    if traceback[-1].filename.endswith("permessage_deflate.py"):
+        return False
+    return any(_SEPARADOR_WEBSOCKETS in marco.filename for marco in traceback)
+
@@ -0,0 +1,68 @@
+"""
+Registro de métricas del servidor de Cowboy Battle.
+Guarda contadores, medidores y distribuciones (con percentiles) en memoria y
+los exporta periódicamente a un archivo JSON.
+"""
+
+import json
+import os
+from collections import defaultdict, deque
+from typing import Dict, Deque, Iterable
+
+# Cantidad de muestras recientes que se guardan por distribución
+MUESTRAS_POR_DISTRIBUCION = 2048
+
+# Contadores que solo crecen: nombre -> total
+contadores: Dict[str, float] = defaultdict(float)
+
+# Valores instantáneos: nombre -> último valor
+medidores: Dict[str, float] = {}
+
+# Muestras recientes para calcular percentiles: nombre -> deque de valores
+distribuciones: Dict[str, Deque[float]] = {}
+
+
+def incrementar(nombre: str, cantidad: float = 1):
+    """Suma `cantidad` a un contador."""
+    contadores[nombre] += cantidad
+
+
+def fijar(nombre: str, valor: float):
+    """Fija el valor actual de un medidor."""
+    medidores[nombre] = valor
+
+
+def observar(nombre: str, valor: float):
+    """Agrega una muestra a una distribución."""
+    muestras = distribuciones.get(nombre)
+    if muestras is None:
+        muestras = distribuciones[nombre] = deque(maxlen=MUESTRAS_POR_DISTRIBUCION)
+    muestras.append(valor)
+
+
+def percentiles(nombre: str, ps: Iterable[int] = (50, 90, 99)) -> Dict[str, float]:
+    """Calcula percentiles (y el máximo) de las muestras recientes de una distribución."""
+    muestras = sorted(distribuciones.get(nombre, ()))
+    if not muestras:
+        return {}
+    resultado = {f"p{p}": muestras[min(len(muestras) - 1, len(muestras) * p // 100)] for p in ps}
+    resultado["max"] = muestras[-1]
+    resultado["n"] = len(muestras)
+    return resultado
+
+
+def instantanea() -> Dict[str, Dict]:
+    """Devuelve una copia de todas las métricas actuales."""
+    return {
+        "contadores": dict(contadores),
+        "medidores": dict(medidores),
+        "distribuciones": {nombre: percentiles(nombre) for nombre in list(distribuciones)},
+    }
+
+
+def exportar(ruta: str, datos: Dict[str, Dict]):
+    """Escribe las métricas en `ruta` de forma atómica (archivo temporal + reemplazo)."""
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(datos, archivo, indent=2)
+    os.replace(temporal, ruta)
@@ -0,0 +1,151 @@
+"""
+Control del recolector de ciclos (gc) del servidor de Cowboy Battle.
+Cada tick crea diccionarios de mensajes, corrutinas de envío y posiciones
+nuevas; el recolector automático de CPython se dispara cuando se juntan
+suficientes objetos, en cualquier punto del tick, y su pausa se nota como
+jitter. Al terminar de arrancar, el servidor congela (gc.freeze) todo lo que
+ya existe para que el recolector no lo vuelva a recorrer y, según el modo,
+sube los umbrales o directamente recolecta solo en el hueco que queda entre
+el final de un tick y el comienzo del siguiente.
+"""
+
+import gc
+import time
+from typing import Dict
+
+# Modos:
+# - "normal": recolección automática de CPython (solo se mide)
+# - "ajustado": gc.freeze() al arrancar y umbrales más altos (menos pausas, algo más largas)
+# - "diferido": gc.freeze() al arrancar, sin recolección automática; se recolecta en los huecos entre ticks
+MODOS = ("normal", "ajustado", "diferido")
+
+# Umbrales del modo ajustado (los de CPython son 700, 10, 10)
+UMBRALES_AJUSTADOS = (10000, 20, 20)
+
+# Modo diferido: si se juntan más de LIMITE_FORZADO objetos sin recolectar (porque no hubo
+# huecos), se recolecta la generación 0 igual, para que la memoria no crezca sin límite
+LIMITE_FORZADO = 50000
+
+# Tiempo máximo (en segundos) que las generaciones 1 y 2 esperan un hueco donde quepan. Sin huecos
+# solo correrían las pasadas forzadas de la generación 0 y lo que sobrevive se juntaría en la 1 sin
+# que la 1 ni la 2 lleguen a recolectarse: pasado este tiempo se recolectan igual, aunque no quepan
+ESPERA_MAXIMA_GEN1 = 5.0
+ESPERA_MAXIMA_COMPLETA = 60.0
+
+# Suavizado del promedio móvil de la duración de cada generación (para saber si cabe en el hueco)
+SUAVIZADO_PAUSA = 0.2
+
+
+class ControlRecoleccion:
+    """
+    Aplica el modo elegido y mide cada pasada del recolector (con gc.callbacks).
+
+    - `pausas`: duraciones medidas por pasada desde la última exportación
+    - `pausa_estimada`: promedio móvil de la duración por generación
+    - `colecciones`: pasadas por generación desde que arrancó el servidor
+    """
+
+    def __init__(self, modo: str):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de recolección desconocido: {modo}")
+        self.modo = modo
+        self.umbrales = gc.get_threshold()
+        self.pausa_estimada = [0.0, 0.0, 0.0]
+        self.pausas: list = []          # (generación, segundos, en_hueco) desde la última exportación
+        self.colecciones = [0, 0, 0]
+        self.forzadas = 0
+        self.en_hueco = False
+        self.ultima_gen1 = time.monotonic()
+        self.ultima_completa = self.ultima_gen1
+        self.congelados = 0
+        self._inicio_pasada = 0.0
+        self._conteo_anterior = 0
+
+    def iniciar(self):
+        """Se llama una vez, cuando el servidor terminó de arrancar (salas restauradas, ranking cargado)."""
+        if self.modo != "normal":
+            # Lo que existe al arrancar (módulos, ranking, salas restauradas) vive hasta el final:
+            # congelarlo lo saca de todas las recolecciones siguientes
+            gc.collect()
+            gc.freeze()
+            self.congelados = gc.get_freeze_count()
+            if self.modo == "ajustado":
+                gc.set_threshold(*UMBRALES_AJUSTADOS)
+            else:
+                gc.disable()
+        gc.callbacks.append(self._medir)
+        self._conteo_anterior = gc.get_count()[0]
+
+    def detener(self):
+        """Vuelve a la recolección automática de CPython."""
+        if self._medir in gc.callbacks:
+            gc.callbacks.remove(self._medir)
+        gc.set_threshold(*self.umbrales)
+        gc.enable()
+
+    def _medir(self, fase: str, info: Dict[str, int]):
+        if fase == "start":
+            self._inicio_pasada = time.perf_counter()
+            return
+        duracion = time.perf_counter() - self._inicio_pasada
+        generacion = info["generation"]
+        self.colecciones[generacion] += 1
+        self.pausa_estimada[generacion] += SUAVIZADO_PAUSA * (duracion - self.pausa_estimada[generacion])
+        self.pausas.append((generacion, duracion, self.en_hueco))
+
+    def contar_objetos(self) -> int:
+        """
+        Objetos nuevos (contenedores que sigue el recolector, menos los liberados)
+        desde la llamada anterior. Se llama una vez por tick.
+        """
+        conteo = gc.get_count()[0]
+        # Si hubo una recolección en el medio el contador volvió a cero
+        nuevos = conteo - self._conteo_anterior if conteo >= self._conteo_anterior else conteo
+        self._conteo_anterior = conteo
+        return nuevos
+
+    def recolectar_en_hueco(self, libre: float, ahora: float):
+        """
+        Modo diferido: usa hasta `libre` segundos (lo que falta para el próximo
+        tick) en recolectar las generaciones que ya pasaron su umbral, de la más
+        vieja a la más joven, si su duración estimada cabe. Si no cabe ninguna,
+        fuerza la que lleva demasiado sin recolectarse (ESPERA_MAXIMA_COMPLETA,
+        ESPERA_MAXIMA_GEN1, LIMITE_FORZADO), así la memoria no crece cuando el
+        servidor está sobrecargado y nunca quedan huecos.
+        """
+        if self.modo != "diferido":
+            return
+        conteo = gc.get_count()
+        generacion = None
+        if conteo[2] >= self.umbrales[2] and self.pausa_estimada[2] <= libre:
+            generacion = 2
+        elif conteo[1] >= self.umbrales[1] and self.pausa_estimada[1] <= libre:
+            generacion = 1
+        elif conteo[0] >= self.umbrales[0] and self.pausa_estimada[0] <= libre:
+            generacion = 0
+        elif conteo[2] >= self.umbrales[2] and ahora - self.ultima_completa >= ESPERA_MAXIMA_COMPLETA:
+            generacion = 2
+        elif conteo[1] > 0 and ahora - self.ultima_gen1 >= ESPERA_MAXIMA_GEN1:
+            generacion = 1
+        elif conteo[0] >= LIMITE_FORZADO:
+            generacion = 0
+        if generacion is None:
+            return
+        if self.pausa_estimada[generacion] > libre:
+            self.forzadas += 1
+        self.en_hueco = True
+        try:
+            gc.collect(generacion)
+        finally:
+            self.en_hueco = False
+        # Recolectar una generación también recolecta las más jóvenes
+        if generacion >= 1:
+            self.ultima_gen1 = ahora
+        if generacion == 2:
+            self.ultima_completa = ahora
+        self._conteo_anterior = gc.get_count()[0]
+
+    def tomar_pausas(self) -> list:
+        """Devuelve las pausas medidas desde la llamada anterior."""
+        pausas, self.pausas = self.pausas, []
+        return pausas
@@ -8,10 +8,32 @@ import json
 import websockets
 import math
 import random
+import secrets
+import signal
 import string
 import time
-from typing import Dict, Any
-from collections import defaultdict
+from typing import Dict, Any, Callable
+from collections import defaultdict, deque
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+
+import analitica
+import bots
+import calidad
+import checkpoint
+import compresion
+import datagramas
+import duelo
+import emparejamiento
+import explorador
+import historial
+import memoria
+import metricas
+import recoleccion
+import snapshots
+import telemetria
+import trazas
+from temporizadores import RuedaTemporizadores
 
 
 # Radio de impacto para detectar colisiones bala-jugador
@@ -38,6 +60,21 @@ OBSTACULOS = [
     {"tipo": "cactus", "x": 400, "y": 100},
 ]
 
+# Dimensiones del mapa (deben coincidir con el cliente)
+ANCHO_MAPA = 800
+ALTO_MAPA = 600
+
+# Rectángulos (izquierda, arriba, derecha, abajo) de los obstáculos, para la navegación de los bots
+RECTANGULOS_OBSTACULOS = [
+    (
+        obs["x"] - (CACTUS_ANCHO if obs["tipo"] == "cactus" else BARRIL_ANCHO) // 2,
+        obs["y"] - (CACTUS_ALTO if obs["tipo"] == "cactus" else BARRIL_ALTO) // 2,
+        obs["x"] + (CACTUS_ANCHO if obs["tipo"] == "cactus" else BARRIL_ANCHO) // 2,
+        obs["y"] + (CACTUS_ALTO if obs["tipo"] == "cactus" else BARRIL_ALTO) // 2,
+    )
+    for obs in OBSTACULOS
+]
+
 # Tamaño de la estrella (debe coincidir con el cliente)
 ESTRELLA_TAMAÑO = 40
 
@@ -47,27 +84,325 @@ TIEMPO_ENTRE_ESTRELLAS = 10.0  # 10 segundos
 # Duración de la invencibilidad (en segundos)
 DURACION_INVENCIBILIDAD = 5.0  # 5 segundos
 
+# Tiempo máximo (en segundos) que una sala puede permanecer en cada estado
+# antes de que el recolector la elimine
+TTL_SALA_POR_ESTADO = {
+    "lobby": 15 * 60.0,      # 15 minutos esperando jugadores
+    "jugando": 30 * 60.0,    # 30 minutos de partida
+    "game_over": 2 * 60.0,   # 2 minutos mostrando resultados
+}
+
+# Máximo de salas simultáneas en el servidor
+MAX_SALAS = 1000
+
+# Cada cuánto revisa el recolector las salas (en segundos)
+INTERVALO_LIMPIEZA = 5.0
+
+# Keepalive de WebSocket: si un cliente no responde al ping en este tiempo se cierra la conexión
+PING_INTERVALO = 10.0
+PING_TIMEOUT = 10.0
+
+# Límites de admisión del servidor
+MAX_CONEXIONES = 2000
+MAX_JUGADORES_POR_SALA = 4
+
+# Duración objetivo de un tick del loop principal (~60 FPS)
+INTERVALO_TICK = 0.016
+
+# Umbrales de salud: por encima de ellos el servidor rechaza salas y jugadores nuevos
+# (antes de eso, el control de calidad ya empieza a degradar por niveles: ver calidad.py)
+UMBRAL_USO_TICK = 0.8    # Fracción del tick usada en trabajo (promedio móvil)
+UMBRAL_LAG_LOOP = 0.05   # Retraso del event loop en segundos (promedio móvil)
+
+# Cada cuánto se mide el retraso del event loop (en segundos)
+INTERVALO_MEDICION_LAG = 0.1
+
+# Peso de la muestra nueva en los promedios móviles de salud
+SUAVIZADO_SALUD = 0.1
+
+# Archivo donde se exportan las métricas y cada cuánto (en segundos)
+ARCHIVO_METRICAS = "metricas_servidor.json"
+INTERVALO_EXPORTAR_METRICAS = 5.0
+
+# Política de compresión por tipo de mensaje: tipo -> tamaño mínimo (bytes) para comprimir.
+# None = nunca se comprime. Los snapshots frecuentes y pequeños van sin comprimir
+# para no gastar CPU; los mensajes grandes y poco frecuentes sí se comprimen.
+UMBRALES_COMPRESION = {
+    "estado": None,
+    # Un lote junta el estado del tick con los eventos de la sala: sale casi en cada tick, como "estado"
+    "lote": None,
+    "start_game": None,
+    "error": None,
+    # Respuestas cortas y únicas: comprimirlas no ahorra bytes
+    "pong": None,
+    "asignacion_id": None,
+    "asignacion_espectador": None,
+    "config_snapshots": None,
+    "en_cola": None,
+    "fuera_de_cola": None,
+    "udp_disponible": None,
+    "udp_cerrado": None,
+    # Duelos: las entradas viajan en cada frame y el arranque es corto
+    "inicio_duelo": None,
+    "entrada": None,
+    "control_duelo": None,
+    "estado_sala": 256,
+    "game_over": 128,
+    # Listas de salas públicas (completa al pedirla y con cambios cada tanto) y el ranking
+    "salas_publicas": 256,
+    "salas_publicas_cambios": 256,
+    "ranking": 512,
+    # La compresión es por conexión: comprimir la transmisión haría crecer el costo con cada espectador
+    "transmision": None,
+}
+UMBRAL_COMPRESION_POR_DEFECTO = 512
+
+# Transmisión para espectadores: cada cuánto se codifica un snapshot por sala,
+# con cuánto retraso se entrega (en segundos) y cuántos espectadores admite cada sala
+INTERVALO_TRANSMISION = 0.1
+RETRASO_TRANSMISION = 1.0
+MAX_ESPECTADORES_POR_SALA = 500
+
+# Mensajes que puede enviar un espectador (el resto se ignora)
+MENSAJES_ESPECTADOR = {"ping", "ranking"}
+
+# Tiempo (en segundos) que se reserva el lugar de un jugador desconectado en plena
+# partida para que pueda reanudar la sesión con su token
+VENTANA_REANUDACION = 15.0
+
+# Checkpoints de las salas en curso para recuperarse de caídas y reinicios:
+# archivo, cada cuánto se escribe y antigüedad máxima para restaurarlo (pasada la
+# ventana de reanudación los clientes ya dejaron de reintentar)
+ARCHIVO_CHECKPOINT = "checkpoint_salas.json"
+INTERVALO_CHECKPOINT = 2.0
+ANTIGUEDAD_MAXIMA_CHECKPOINT = VENTANA_REANUDACION
+
+# Reporte de memoria (se pide con SIGUSR1): archivo de salida y presupuesto de RAM
+# con el que se calcula cuántas salas caben
+ARCHIVO_MEMORIA = "memoria_servidor.json"
+PRESUPUESTO_MEMORIA = 512 * 1024 * 1024
+
+# Historial de partidas (SQLite en modo WAL) y tamaño del ranking que se mantiene en memoria
+ARCHIVO_HISTORIAL = "historial_partidas.db"
+TAMAÑO_RANKING = 10
+
+# Bots: CPU que puede usar cada bot por tick para decidir (en segundos), semilla de sus
+# decisiones (misma semilla y mismo orden de creación = mismo comportamiento), salas
+# solo de bots que se crean al arrancar como carga para pruebas y cuántos bots tiene
+# cada una, y espera antes de que una sala solo de bots vuelva a empezar
+PRESUPUESTO_BOT_S = 0.0002
+SEMILLA_BOTS = "cowboy"
+SALAS_DE_BOTS = 0
+BOTS_POR_SALA_DE_BOTS = 2
+ESPERA_REVANCHA_BOTS = 3.0
+
+# Canal UDP opcional para snapshots y posiciones: puerto, segundos sin datagramas del
+# cliente para volver al WebSocket (el cliente envía un latido cada 0.5s) y cada cuánto se revisa
+PUERTO_UDP = 9001
+TIMEOUT_UDP = 3.0
+INTERVALO_REVISION_UDP = 1.0
+
+# Modo duelo (rollback, solo salas de 2 jugadores sin bots): segundos entre el aviso y el
+# primer frame, frames que las entradas de un jugador pueden adelantarse al reloj del
+# servidor, máximo de entradas por mensaje, cada cuántos frames se envía la suma de
+# control del estado (debe coincidir con el cliente) y espera mínima entre resincronizaciones
+RETRASO_INICIO_DUELO = 0.5
+MARGEN_FRAMES_DUELO = 30
+MAX_ENTRADAS_POR_MENSAJE = 60
+FRAMES_ENTRE_CONTROLES_DUELO = 60
+ESPERA_RESINCRONIZACION_DUELO = 1.0
+
+# Los límites de tasa y presupuesto de snapshots por cliente, las prioridades de cada
+# entidad y la adaptación a la congestión están en snapshots.py
+
+# Telemetría en memoria compartida para procesos externos (ver telemetria.py)
+PUBLICAR_TELEMETRIA = True
+
+# Trazas muestreadas (ver trazas.py): fracción de mensajes y de ticks que se siguen
+# de punta a punta (0 desactiva; por ejemplo 0.01 para depurar), archivo en formato
+# Trace Event de Chrome, máximo de eventos pendientes entre dos escrituras y cada cuánto
+# se escriben (en segundos). El archivo rota al pasar MAX_BYTES_ARCHIVO_TRAZAS y se
+# conservan ARCHIVOS_TRAZAS_VIEJOS anteriores (trazas_servidor.1.json, ...)
+ARCHIVO_TRAZAS = "trazas_servidor.json"
+TASA_TRAZAS_MENSAJES = 0.0
+TASA_TRAZAS_TICKS = 0.0
+MAX_EVENTOS_TRAZAS = 200000
+INTERVALO_ESCRITURA_TRAZAS = 1.0
+MAX_BYTES_ARCHIVO_TRAZAS = 64 * 1024 * 1024
+ARCHIVOS_TRAZAS_VIEJOS = 3
+
+# Trazas pedidas por el cliente con el campo "traza": solo para depurar, así que están
+# desactivadas; habilitadas, cada conexión puede pedir hasta TRAZAS_CLIENTE_POR_MINUTO
+PERMITIR_TRAZAS_CLIENTE = False
+TRAZAS_CLIENTE_POR_MINUTO = 10
+
+# Estadísticas y mapas de calor por partida (ver analitica.py): se guardan al terminar
+# cada partida en DIRECTORIO_ANALITICA (False las desactiva)
+GUARDAR_ANALITICA = True
+DIRECTORIO_ANALITICA = "analitica_partidas"
+
+# Explorador de salas públicas: cada cuánto se avisan los cambios a quienes exploran
+# (en segundos) y tamaño por defecto y máximo de una página del listado
+INTERVALO_EXPLORADOR = 0.25
+TAMAÑO_PAGINA_EXPLORADOR = 20
+MAX_TAMAÑO_PAGINA_EXPLORADOR = 100
+
+# Emparejamiento rápido (quick_play): cada cuánto se arman grupos con la cola (en segundos).
+# La política de tamaño según la espera está en emparejamiento.py
+INTERVALO_EMPAREJAMIENTO = 0.5
+
+# Recolector de ciclos (ver recoleccion.py): "normal" (el de CPython), "ajustado" (congela
+# lo que existe al arrancar y sube los umbrales) o "diferido" (congela y solo recolecta en
+# el hueco entre ticks). MARGEN_GC es lo que se deja libre del hueco antes del próximo tick
+MODO_GC = "diferido"
+MARGEN_GC = 0.002
+
+# Resolución de la rueda de temporizadores (en segundos)
+RESOLUCION_TEMPORIZADORES = 0.01
+
+# Conexiones abiertas: websocket -> {
+#   "conectado_en": timestamp,
+#   "red": {"rtt": s, "jitter": s, "desfase": s, "latencia_keepalive": s},  # Medido con ping/pong
+#   "udp": {  # Solo si el cliente pidió el canal UDP
+#       "token": str, "direccion": (host, puerto) | None, "activo": bool,
+#       "ultimo_recibido": monotonic, "ultima_seq": int
+#   },
+#   "snapshots": snapshots.FlujoSnapshots,  # Tasa y presupuesto de snapshots de la conexión
+#   "trazas_cliente"?: {"ventana": monotonic, "cantidad": int}  # Trazas pedidas en el último minuto
+# }
+conexiones: Dict[Any, Dict[str, Any]] = {}
+
 # Mapeo de websocket a código de sala (para encontrar rápidamente la sala de un jugador)
 websocket_a_sala: Dict[Any, str] = {}
 
+# Canal UDP: token del canal -> websocket de su jugador
+canales_udp: Dict[str, Any] = {}
+
+# Socket UDP del servidor (None si no se pudo abrir: todo sigue por WebSocket)
+protocolo_udp: datagramas.ProtocoloDatagramas | None = None
+
+# Buffer de telemetría en memoria compartida (None si está desactivado o no se pudo crear)
+publicador_telemetria: telemetria.PublicadorTelemetria | None = None
+
+# Trazas muestreadas (None si están desactivadas)
+trazador: trazas.Trazador | None = None
+
+# Control del recolector de ciclos (se aplica cuando el servidor terminó de arrancar)
+control_gc = recoleccion.ControlRecoleccion(MODO_GC)
+
+# Mapeo de websocket de espectador a código de sala
+espectador_a_sala: Dict[Any, str] = {}
+
+# Salas públicas a las que se puede entrar y conexiones que las exploran
+indice_salas = explorador.IndiceSalas()
+
+# Jugadores esperando una partida rápida
+cola_emparejamiento = emparejamiento.ColaEmparejamiento(MAX_JUGADORES_POR_SALA)
+
 # Sistema de salas: código_sala -> {
 #   "host_id": int,
 #   "jugadores": [websocket, ...],  # Lista de websockets
-#   "jugadores_info": Dict[websocket, {"id": player_id, "nombre": nombre, "es_host": bool}],
+#   "jugadores_info": Dict[websocket, {"id": player_id, "nombre": nombre, "es_host": bool, "token": str}],
 #   "estado": Dict[player_id, {"x": x, "y": y}],  # Posiciones de jugadores
-#   "balas": Dict[bala_id, {"x": x, "y": y, "vx": vx, "vy": vy, "player_id": player_id}],
+#   "balas": Dict[bala_id, {"x": x, "y": y, "vx": vx, "vy": vy, "player_id": player_id, "traza"?: int}],
 #   "puntuacion": Dict[player_id, int],
 #   "estado_partida": str,  # "lobby", "jugando", "game_over"
 #   "jugadores_listos": Dict[player_id, bool],
 #   "estrella_actual": Dict[str, Any] | None,
 #   "jugadores_invencibles": Dict[player_id, float],
-#   "siguiente_bala_id": int
+#   "siguiente_bala_id": int,
+#   "creada_en": float,  # Timestamp de creación
+#   "estado_desde": float,  # Timestamp del último cambio de estado_partida
+#   "codigo_sala": str,
+#   "temporizadores": Dict[str, Temporizador],  # Eventos programados de la sala por nombre
+#   "salida": [str, ...],  # Eventos codificados que se envían al final del tick
+#   "estado_pendiente": str | None,  # Último estado codificado pendiente de enviar
+#   "suspendidos": Dict[player_id, websocket],  # Jugadores desconectados con el lugar reservado
+#   "espectadores": Set[websocket],
+#   "eventos_transmision": list,  # Eventos codificados desde el último frame de la transmisión
+#   "transmision": deque[(timestamp, str)],  # Frames codificados esperando su retraso
+#   "version_sala": int,  # Sube con cada cambio del lobby (jugadores, listos, estado_partida)
+#   "estado_sala_codificado": str | None  # estado_sala ya codificado para la versión actual
+#   "trazas": Set[int],  # Trazas muestreadas que esperan el próximo envío del estado de la sala
+#   "analitica": analitica.EstadisticasPartida | None,  # Acumuladores de la partida en curso (no en duelos)
+#   "publica": bool,  # Elegido por el host: la sala aparece en el explorador mientras se pueda entrar
+#   "resultado": {"ganador": player_id, "motivo": str | None} | None,  # Al terminar la partida
+#   "participantes": Dict[player_id, nombre],  # Quienes empezaron la partida (para el historial)
+#   "bots": Dict[player_id, bots.Bot],  # Bots de la sala (su conexión falsa está en jugadores)
+#   "sala_de_bots": bool,  # Carga de prueba creada por crear_sala_de_bots: vuelve a empezar sola
+#   "modo": str,  # "normal" o "duelo" (elegido por el host en el lobby)
+#   "duelo": {  # Solo durante una partida en modo duelo
+#       "ids": [player_id, player_id],  # El índice de cada jugador en la simulación
+#       "sesion": int,  # Sube con cada resincronización; las entradas de otra sesión se ignoran
+#       "estado": duelo.EstadoDuelo,  # Último estado confirmado (con las entradas de los dos)
+#       "entradas": ({frame: bits}, {frame: bits}),  # Entradas recibidas aún no simuladas
+#       "siguiente": [frame, frame],  # Próximo frame que se espera de cada jugador
+#       "frame_inicio": int, "t_inicio": monotonic,  # Momento que corresponde a frame_inicio
+#       "ultima_resincronizacion": monotonic
+#   } | None
 # }
 salas: Dict[str, Dict[str, Any]] = {}
 
+# Sesiones reanudables: token_reanudacion -> {"codigo_sala": str, "player_id": int}
+sesiones: Dict[str, Dict[str, Any]] = {}
+
 # Contador global para asignar player_id únicos (único en todo el servidor)
 siguiente_player_id = 1
 
+# Contador de bots creados (da nombre y semilla a cada bot)
+siguiente_numero_bot = 1
+
+# Grilla de navegación y campos de flujo del mapa (se calculan una sola vez)
+grilla_navegacion = bots.GrillaNavegacion(ANCHO_MAPA, ALTO_MAPA, RECTANGULOS_OBSTACULOS)
+
+# Número de tick del loop principal (los snapshots llevan este sello)
+numero_tick = 0
+
+# Totales acumulados de lo que ha liberado el recolector de salas
+estadisticas_limpieza: Dict[str, int] = defaultdict(int)
+
+# Temporizadores de todas las salas (estrellas, invencibilidad, expiración)
+rueda_temporizadores = RuedaTemporizadores(RESOLUCION_TEMPORIZADORES, time.monotonic())
+
+# Señal de salud del servidor (promedios móviles)
+salud: Dict[str, float] = {
+    "uso_tick": 0.0,   # Fracción del intervalo de tick usada en trabajo
+    "lag_loop": 0.0    # Retraso del event loop en segundos
+}
+
+# Tareas de cierre de conexiones en curso (se guardan para que no las recolecte el GC)
+tareas_cierre: set = set()
+
+# Escrituras de estadísticas de partidas en curso (para que no las recolecte el GC)
+tareas_analitica: set = set()
+
+# Modo drenaje: no se aceptan salas ni jugadores nuevos y los checkpoints periódicos se detienen
+drenando = False
+
+# Evita que dos checkpoints se escriban a la vez
+bloqueo_checkpoint = asyncio.Lock()
+
+# Pedido de reporte de memoria (SIGUSR1) y snapshot de tracemalloc del reporte anterior
+solicitud_reporte_memoria = asyncio.Event()
+snapshot_memoria_anterior = None
+
+# Escritor del historial de partidas (se crea en main) y ranking en memoria
+escritor_historial: historial.EscritorHistorial | None = None
+ranking = historial.Ranking(TAMAÑO_RANKING)
+
+# Nivel de calidad de servicio (baja por escalones cuando el tick no alcanza)
+control_calidad = calidad.ControlCalidad(time.monotonic())
+
+
+class ConexionRestaurada:
+    """Ocupa el lugar de la conexión de un jugador restaurado de un checkpoint hasta que reanude."""
+    
+    def __init__(self, player_id: int):
+        self.player_id = player_id
+    
+    def __repr__(self) -> str:
+        return f"ConexionRestaurada({self.player_id})"
+
 
 def generar_codigo_sala() -> str:
     """Genera un código único de 6 caracteres para una sala."""
@@ -82,13 +417,25 @@ def obtener_sala_de_websocket(websocket: Any) -> str | None:
     return websocket_a_sala.get(websocket)
 
 
+def posicion_valida(x: Any, y: Any) -> tuple | None:
+    """
+    Valida una posición enviada por un cliente: tienen que ser números finitos
+    y se limitan al mapa. Devuelve (x, y) o None si no es una posición.
+    """
+    for valor in (x, y):
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor):
+            return None
+    return min(max(float(x), 0.0), float(ANCHO_MAPA)), min(max(float(y), 0.0), float(ALTO_MAPA))
+
+
 def obtener_info_sala(codigo_sala: str) -> Dict[str, Any] | None:
     """Obtiene la información de una sala."""
     return salas.get(codigo_sala)
 
 
-def crear_estructura_sala(host_id: int) -> Dict[str, Any]:
+def crear_estructura_sala(codigo_sala: str, host_id: int) -> Dict[str, Any]:
     """Crea una nueva estructura de sala con estado inicial."""
+    ahora = time.time()
     return {
         "host_id": host_id,
         "jugadores": [],
@@ -101,10 +448,163 @@ def crear_estructura_sala(host_id: int) -> Dict[str, Any]:
         "estrella_actual": None,
         "jugadores_invencibles": {},
         "siguiente_bala_id": 1,
-        "ultima_estrella_tiempo": 0.0
+        "ultima_estrella_tiempo": 0.0,
+        "creada_en": ahora,
+        "estado_desde": ahora,
+        "codigo_sala": codigo_sala,
+        "temporizadores": {},
+        "salida": [],               # Eventos codificados pendientes de enviar en este tick
+        "estado_pendiente": None,   # Último estado codificado pendiente de enviar
+        "suspendidos": {},          # player_id -> websocket cerrado, mientras dura la reanudación
+        "resultado": None,
+        "participantes": {},
+        "bots": {},
+        "modo": "normal",
+        "duelo": None,
+        "espectadores": set(),
+        "eventos_transmision": [],  # Eventos codificados desde el último frame de la transmisión
+        "transmision": deque(),     # (momento, frame) esperando RETRASO_TRANSMISION
+        "version_sala": 1,
+        "estado_sala_codificado": None,  # Caché de estado_sala, se descarta al cambiar el lobby
+        "trazas": set(),            # Trazas muestreadas que esperan el envío del estado
+        "analitica": None,          # Estadísticas de la partida en curso
+        "publica": False,           # Listada en el explorador de salas
+        "sala_de_bots": False       # Carga de prueba (crear_sala_de_bots), se reinicia al terminar
     }
 
 
+def programar_temporizador_sala(sala: Dict[str, Any], nombre: str, retraso: float,
+                                callback: Callable[..., Any], *args: Any):
+    """
+    Programa un evento de la sala dentro de `retraso` segundos.
+    Si ya había uno con el mismo nombre, se reemplaza.
+    """
+    anterior = sala["temporizadores"].get(nombre)
+    if anterior is not None:
+        anterior.cancelar()
+    sala["temporizadores"][nombre] = rueda_temporizadores.programar(
+        retraso, time.monotonic(), callback, *args
+    )
+
+
+def cancelar_temporizador_sala(sala: Dict[str, Any], nombre: str):
+    """Cancela un evento programado de la sala, si existe."""
+    temporizador = sala["temporizadores"].pop(nombre, None)
+    if temporizador is not None:
+        temporizador.cancelar()
+
+
+def programar_expiracion_sala(sala: Dict[str, Any]):
+    """Programa la expiración de la sala según el TTL de su estado actual."""
+    ttl = TTL_SALA_POR_ESTADO.get(sala["estado_partida"])
+    if ttl is None:
+        cancelar_temporizador_sala(sala, "expiracion")
+    else:
+        programar_temporizador_sala(sala, "expiracion", ttl, expirar_sala_por_ttl, sala["codigo_sala"])
+
+
+def cambiar_estado_partida(sala: Dict[str, Any], nuevo_estado: str):
+    """Cambia el estado de la partida y reinicia su TTL."""
+    sala["estado_partida"] = nuevo_estado
+    sala["estado_desde"] = time.time()
+    programar_expiracion_sala(sala)
+    invalidar_estado_sala(sala)
+
+
+def actualizar_salud(clave: str, muestra: float):
+    """Incorpora una muestra al promedio móvil de salud `clave`."""
+    salud[clave] += SUAVIZADO_SALUD * (muestra - salud[clave])
+    metricas.fijar(clave, salud[clave])
+
+
+def registrar_transicion_calidad(transicion: Dict[str, Any]):
+    """Deja constancia de un cambio de nivel de calidad (log y métricas)."""
+    print(
+        f"Calidad de servicio: {transicion['desde']} -> {transicion['hasta']} ({transicion['motivo']}, "
+        f"uso de tick {transicion['uso_tick']:.0%}, lag {transicion['lag_loop'] * 1000:.0f}ms)"
+    )
+    metricas.incrementar("transiciones_calidad")
+    metricas.fijar("nivel_calidad", transicion["nivel"])
+
+
+def toca_estado(codigo_sala: str, cada: int, pasos: int) -> bool:
+    """
+    Indica si en esta vuelta del loop corresponde enviar el estado de una sala
+    que lo recibe cada `cada` ticks. Cada sala tiene su propio desfase para que
+    no todas codifiquen en la misma vuelta.
+    """
+    if cada <= pasos:
+        return True
+    return (numero_tick + hash(codigo_sala)) % cada < pasos
+
+
+def motivo_sobrecarga() -> str | None:
+    """
+    Indica si el servidor está por encima de su presupuesto y no debe aceptar
+    salas ni jugadores nuevos. Devuelve el motivo o None si hay capacidad.
+    """
+    if drenando:
+        return "servidor en drenaje"
+    if salud["uso_tick"] > UMBRAL_USO_TICK:
+        return f"uso de tick {salud['uso_tick']:.0%}"
+    if salud["lag_loop"] > UMBRAL_LAG_LOOP:
+        return f"lag del event loop {salud['lag_loop'] * 1000:.0f}ms"
+    return None
+
+
+async def rechazar_por_sobrecarga(websocket: Any, motivo: str):
+    """Responde a un cliente que el servidor está ocupado."""
+    print(f"Solicitud rechazada, servidor ocupado ({motivo})")
+    metricas.incrementar("rechazos_servidor_ocupado")
+    await websocket.send(json.dumps({
+        "tipo": "error",
+        "codigo": "servidor_ocupado",
+        "mensaje": "Servidor ocupado, intenta más tarde"
+    }))
+
+
+def conexion_cerrada(websocket: Any) -> bool:
+    """Indica si la conexión WebSocket ya terminó de cerrarse."""
+    estado = getattr(websocket, "state", None)
+    return estado is not None and estado.name == "CLOSED"
+
+
+def cerrar_en_segundo_plano(websocket: Any, codigo: int, motivo: str):
+    """Cierra una conexión sin esperar el handshake de cierre del cliente."""
+    tarea = asyncio.create_task(websocket.close(codigo, motivo))
+    tareas_cierre.add(tarea)
+    tarea.add_done_callback(tareas_cierre.discard)
+
+
+def eliminar_sala(codigo_sala: str) -> Dict[str, int]:
+    """
+    Elimina una sala y los mapeos websocket -> sala de sus jugadores.
+    Devuelve cuántos jugadores y balas se liberaron.
+    """
+    sala = salas.pop(codigo_sala, None)
+    if sala is None:
+        return {"jugadores": 0, "balas": 0}
+    indice_salas.actualizar(codigo_sala, None)
+    
+    for temporizador in sala["temporizadores"].values():
+        temporizador.cancelar()
+    sala["temporizadores"].clear()
+    
+    sockets_sala = set(sala["jugadores"]) | set(sala["jugadores_info"])
+    for ws in sockets_sala:
+        if websocket_a_sala.get(ws) == codigo_sala:
+            del websocket_a_sala[ws]
+    for info in sala["jugadores_info"].values():
+        sesiones.pop(info.get("token"), None)
+    # Sin sala no hay transmisión: cerrar las conexiones de los espectadores
+    for ws in sala["espectadores"]:
+        if espectador_a_sala.get(ws) == codigo_sala:
+            del espectador_a_sala[ws]
+        cerrar_en_segundo_plano(ws, 1001, "La sala se cerró")
+    
+    return {"jugadores": len(sockets_sala), "balas": len(sala["balas"])}
+
+
 def colisiona_con_obstaculo(x: float, y: float, radio: float) -> bool:
     """Verifica si una posición colisiona con algún obstáculo."""
     for obs in OBSTACULOS:
@@ -153,12 +653,23 @@ def generar_posicion_estrella() -> tuple[float, float] | None:
     return None  # No se pudo encontrar una posición válida
 
 
-async def enviar_estado_a_sala(codigo_sala: str):
-    """Envía el estado completo del juego a todos los jugadores de una sala específica."""
-    sala = obtener_info_sala(codigo_sala)
-    if not sala or not sala["jugadores"]:
-        return
-    
+def crear_sesion(codigo_sala: str, player_id: int) -> str:
+    """Crea el token con el que un jugador puede reanudar su sesión tras un corte."""
+    token = secrets.token_urlsafe(16)
+    sesiones[token] = {"codigo_sala": codigo_sala, "player_id": player_id}
+    return token
+
+
+def buscar_websocket_de_jugador(sala: Dict[str, Any], player_id: int) -> Any:
+    """Devuelve el websocket registrado para un player_id en la sala, o None."""
+    for ws, info in sala["jugadores_info"].items():
+        if info["id"] == player_id:
+            return ws
+    return None
+
+
+def codificar_estado(sala: Dict[str, Any]) -> str:
+    """Construye y codifica el estado completo del juego de una sala."""
     # Preparar estado de balas simplificado
     balas_estado = {}
     for bala_id, bala_info in sala["balas"].items():
@@ -176,74 +687,797 @@ async def enviar_estado_a_sala(codigo_sala: str):
             "y": sala["estrella_actual"]["y"]
         }
     
-    # Preparar estado de invencibilidad
-    invencibles_estado = {}
-    tiempo_actual = time.time()
-    for pid, tiempo_fin in list(sala["jugadores_invencibles"].items()):
-        if tiempo_actual < tiempo_fin:
-            invencibles_estado[pid] = tiempo_fin - tiempo_actual
-        else:
-            del sala["jugadores_invencibles"][pid]
-    
     mensaje_estado = {
         "tipo": "estado",
+        "tick": numero_tick,
+        "t_servidor": time.monotonic(),
         "jugadores": sala["estado"],
         "balas": balas_estado,
         "puntuacion": sala["puntuacion"],
         "estrella": estrella_estado,
-        "jugadores_invencibles": invencibles_estado
+        "jugadores_invencibles": estado_invencibles(sala)
+    }
+    return json.dumps(mensaje_estado)
+
+
+def estado_invencibles(sala: Dict[str, Any]) -> Dict[int, float]:
+    """Segundos de invencibilidad que le quedan a cada jugador (los temporizadores retiran a los que ya expiraron)."""
+    tiempo_actual = time.time()
+    return {
+        pid: max(0.0, tiempo_fin - tiempo_actual)
+        for pid, tiempo_fin in sala["jugadores_invencibles"].items()
     }
-    mensaje_json = json.dumps(mensaje_estado)
-    tareas = [
-        ws.send(mensaje_json)
-        for ws in sala["jugadores"]
+
+
+def partes_estado(sala: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Prepara el estado de una sala para los snapshots parciales: cada entidad
+    (jugador, bala, estrella) ya codificada por separado, más lo que viaja en
+    todos los parciales (puntuación, invencibles y la lista de entidades
+    presentes, para que el cliente sepa cuáles desaparecieron). Se arma una vez
+    por tick y la comparten todos los jugadores con presupuesto.
+    """
+    entidades = []
+    for pid, pos in sala["estado"].items():
+        entidades.append((f"j{pid}", f'"{pid}": ' + json.dumps(pos), "jugador", pos["x"], pos["y"], pid))
+    for bala_id, bala in sala["balas"].items():
+        # Con la velocidad, el cliente mueve por su cuenta las balas que no vinieron en el snapshot
+        fragmento = f'"{bala_id}": ' + json.dumps({
+            "x": bala["x"], "y": bala["y"], "player_id": bala["player_id"],
+            "vx": bala["vx"], "vy": bala["vy"]
+        })
+        entidades.append((f"b{bala_id}", fragmento, "bala", bala["x"], bala["y"], bala["player_id"]))
+    estrella = sala["estrella_actual"]
+    if estrella is not None:
+        fragmento = '"estrella": ' + json.dumps({"x": estrella["x"], "y": estrella["y"]})
+        entidades.append(("estrella", fragmento, "estrella", estrella["x"], estrella["y"], None))
+    
+    cabecera = json.dumps({
+        "tipo": "estado",
+        "tick": numero_tick,
+        "t_servidor": time.monotonic(),
+        "parcial": True
+    })[:-1]
+    comun = json.dumps({
+        "puntuacion": sala["puntuacion"],
+        "jugadores_invencibles": estado_invencibles(sala),
+        "presentes": {
+            "jugadores": list(sala["estado"]),
+            "balas": list(sala["balas"]),
+            "estrella": estrella is not None
+        }
+    })[1:]
+    partes = {"entidades": entidades, "cabecera": cabecera, "comun": comun}
+    partes["base"] = len(codificar_estado_parcial(partes, []))
+    return partes
+
+
+def codificar_estado_parcial(partes: Dict[str, Any], elegidas: list) -> str:
+    """Junta en un snapshot parcial las entidades elegidas (ya codificadas) y las partes comunes."""
+    jugadores = [entidad[1] for entidad in elegidas if entidad[2] == "jugador"]
+    balas = [entidad[1] for entidad in elegidas if entidad[2] == "bala"]
+    campos = [
+        partes["cabecera"],
+        '"jugadores": {' + ", ".join(jugadores) + "}",
+        '"balas": {' + ", ".join(balas) + "}"
     ]
-    await asyncio.gather(*tareas, return_exceptions=True)
+    campos.extend(entidad[1] for entidad in elegidas if entidad[2] == "estrella")
+    return ", ".join(campos) + ", " + partes["comun"]
 
 
-async def enviar_evento_a_sala(codigo_sala: str, evento: dict):
-    """Envía un evento (mensaje corto) a todos los jugadores de una sala específica."""
+def estado_para_flujo(flujo: snapshots.FlujoSnapshots, estado: str, obtener_partes: Callable[[], Dict[str, Any]],
+                      player_id: int | None, ahora: float) -> str | None:
+    """
+    Snapshot para una conexión con tasa o presupuesto limitados: None si en
+    este tick no le toca (o no le alcanza el crédito), el estado completo si
+    cabe, o un parcial con las entidades más importantes para ese jugador.
+    """
+    if not flujo.toca_enviar(ahora):
+        metricas.incrementar("snapshots_salteados")
+        return None
+    if flujo.presupuesto is None or len(estado) <= flujo.credito:
+        flujo.registrar_completo(len(estado), ahora)
+        return estado
+    partes = obtener_partes()
+    disponible = int(flujo.credito) - partes["base"]
+    if disponible < 0 and not flujo.credito_lleno():
+        metricas.incrementar("snapshots_sin_presupuesto")
+        return None
+    # Si ni lo común cabe en el crédito máximo, se envía igual (el crédito queda en negativo)
+    elegidas = flujo.elegir(partes["entidades"], player_id, max(0, disponible), ahora)
+    parcial = codificar_estado_parcial(partes, elegidas)
+    flujo.credito -= len(parcial)
+    metricas.incrementar("snapshots_parciales")
+    metricas.incrementar("entidades_postergadas", len(partes["entidades"]) - len(elegidas))
+    return parcial
+
+
+def tamaño_buffer_salida(websocket: Any) -> int:
+    """Bytes que la conexión todavía no pudo enviar (0 si no es un socket real, como los bots)."""
+    transporte = getattr(websocket, "transport", None)
+    if transporte is None:
+        return 0
+    return transporte.get_write_buffer_size()
+
+
+async def enviar_estado_a_sala(codigo_sala: str):
+    """
+    Prepara el estado completo del juego para los jugadores de una sala.
+    Se envía al final del tick junto con los eventos (solo viaja el más reciente).
+    """
     sala = obtener_info_sala(codigo_sala)
     if not sala or not sala["jugadores"]:
         return
     
-    mensaje = json.dumps(evento)
-    tareas = [ws.send(mensaje) for ws in sala["jugadores"]]
-    await asyncio.gather(*tareas, return_exceptions=True)
+    if not sala["trazas"]:
+        sala["estado_pendiente"] = codificar_estado(sala)
+        return
+    inicio = time.perf_counter()
+    sala["estado_pendiente"] = codificar_estado(sala)
+    trazador.tramos(sala["trazas"], "codificar", inicio, time.perf_counter(), bytes=len(sala["estado_pendiente"]))
 
 
-async def enviar_estado_sala_a_sala(codigo_sala: str):
-    """Envía el estado de la sala (lobby) a todos los jugadores de una sala específica."""
+async def enviar_evento_a_sala(codigo_sala: str, evento: dict):
+    """
+    Encola un evento (mensaje corto) para todos los jugadores de una sala.
+    Se envía al final del tick, en el mismo frame que el resto de la salida de la sala.
+    """
     sala = obtener_info_sala(codigo_sala)
     if not sala or not sala["jugadores"]:
         return
     
-    jugadores_info = {}
+    sala["salida"].append(json.dumps(evento))
+
+
+def armar_frame(mensajes: list) -> str:
+    """Junta mensajes ya codificados en un frame (un "lote" si hay más de uno)."""
+    if len(mensajes) == 1:
+        return mensajes[0]
+    # Los mensajes ya están codificados: se concatenan sin volver a serializarlos
+    return '{"tipo": "lote", "mensajes": [' + ", ".join(mensajes) + ']}'
+
+
+def vaciar_salida_sala(sala: Dict[str, Any]) -> list:
+    """
+    Junta los eventos encolados y el último estado de una sala en un único frame
+    y devuelve los envíos pendientes (uno por jugador). A los jugadores con el
+    canal UDP activo el estado les llega por datagrama y por el WebSocket solo
+    los eventos. Los jugadores con tasa o presupuesto de snapshots limitados
+    reciben el estado solo cuando les toca, y recortado si no les alcanza.
+    """
+    eventos = sala["salida"]
+    if sala["espectadores"]:
+        # Los eventos también viajan (una sola vez) en la transmisión de espectadores
+        sala["eventos_transmision"].extend(eventos)
+    estado = sala["estado_pendiente"]
+    sala["estado_pendiente"] = None
+    if not eventos and estado is None:
+        return []
+    sala["salida"] = []
+    
+    frame = None
+    frame_eventos = None
+    datagrama = None
+    partes = None
+    ahora = time.monotonic()
+    mensajes_enviados = 0
+    bytes_estado = 0
+    envios = []
+    
+    def obtener_partes() -> Dict[str, Any]:
+        nonlocal partes
+        if partes is None:
+            partes = partes_estado(sala)
+        return partes
+    
     for ws in sala["jugadores"]:
-        if ws in sala["jugadores_info"]:
-            info = sala["jugadores_info"][ws]
-            pid = info["id"]
-            jugadores_info[str(pid)] = {
-                "nombre": info["nombre"],
-                "listo": sala["jugadores_listos"].get(pid, False),
-                "es_host": info.get("es_host", False),
-                "sprite_index": info.get("sprite_index", ((pid - 1) % 3) + 1)  # Fallback si no existe
-            }
+        conexion = conexiones.get(ws, {})
+        canal = conexion.get("udp")
+        por_udp = canal is not None and canal["activo"]
+        flujo = conexion.get("snapshots")
+        estado_ws = estado
+        if estado is not None and flujo is not None:
+            # La congestión se mide en el WebSocket (los datagramas no se acumulan)
+            if not por_udp and flujo.adaptar(tamaño_buffer_salida(ws), ahora):
+                metricas.incrementar("reducciones_tasa_snapshots")
+            if not flujo.sin_limites():
+                info = sala["jugadores_info"].get(ws)
+                estado_ws = estado_para_flujo(flujo, estado, obtener_partes, info and info["id"], ahora)
+        
+        if estado_ws is None:
+            # Sin snapshot para este jugador en este tick: solo los eventos
+            if eventos:
+                if frame_eventos is None:
+                    frame_eventos = armar_frame(eventos)
+                envios.append(ws.send(frame_eventos))
+                mensajes_enviados += len(eventos)
+            continue
+        bytes_estado += len(estado_ws)
+        
+        if por_udp:
+            if estado_ws is estado:
+                if datagrama is None:
+                    datagrama = estado.encode("utf-8")
+                datos = datagrama
+            else:
+                datos = estado_ws.encode("utf-8")
+            if len(datos) <= datagramas.MAX_DATAGRAMA:
+                protocolo_udp.enviar(datos, canal["direccion"])
+                metricas.incrementar("datagramas_salida")
+                if eventos:
+                    if frame_eventos is None:
+                        frame_eventos = armar_frame(eventos)
+                    envios.append(ws.send(frame_eventos))
+                    mensajes_enviados += len(eventos)
+                continue
+            # Un estado que no cabe en un datagrama va por el WebSocket en este tick
+            metricas.incrementar("estados_grandes_por_websocket")
+        
+        if estado_ws is estado:
+            if frame is None:
+                frame = armar_frame(eventos + [estado])
+            envios.append(ws.send(frame))
+        else:
+            envios.append(ws.send(armar_frame(eventos + [estado_ws])))
+        mensajes_enviados += len(eventos) + 1
     
-    evento = {
+    metricas.incrementar("mensajes_salida", mensajes_enviados)
+    metricas.incrementar("frames_salida", len(envios))
+    metricas.incrementar("bytes_estado_salida", bytes_estado)
+    return envios
+
+
+def procesar_datagrama(datos: Dict[str, Any], direccion: tuple):
+    """
+    Atiende un datagrama de un cliente. El token identifica el canal (y al jugador);
+    los datagramas con un número de secuencia ya visto llegaron tarde o
+    desordenados y se descartan.
+    """
+    websocket = canales_udp.get(datos.get("token"))
+    if websocket is None or websocket not in conexiones:
+        metricas.incrementar("datagramas_rechazados")
+        return
+    canal = conexiones[websocket]["udp"]
+    secuencia = datos.get("seq")
+    if not isinstance(secuencia, int) or secuencia <= canal["ultima_seq"]:
+        metricas.incrementar("datagramas_viejos")
+        return
+    canal["ultima_seq"] = secuencia
+    canal["direccion"] = direccion  # La dirección puede cambiar (por ejemplo, al pasar por un NAT)
+    canal["ultimo_recibido"] = time.monotonic()
+    metricas.incrementar("datagramas_entrada")
+    
+    tipo = datos.get("tipo")
+    if tipo == "hola":
+        protocolo_udp.enviar(datagramas.HOLA_OK, direccion)
+    elif tipo == "update_pos":
+        # Igual que update_pos por WebSocket, pero el jugador sale del token
+        codigo_sala = obtener_sala_de_websocket(websocket)
+        sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+        if (not sala or sala["estado_partida"] != "jugando" or sala["duelo"] is not None
+                or websocket not in sala["jugadores_info"]):
+            return
+        posicion = posicion_valida(datos.get("x"), datos.get("y"))
+        if posicion is None:
+            metricas.incrementar("posiciones_invalidas")
+        else:
+            x, y = posicion
+            player_id = sala["jugadores_info"][websocket]["id"]
+            sala["estado"][player_id] = {"x": x, "y": y}
+            if sala["analitica"] is not None:
+                sala["analitica"].posicion(player_id, x, y, time.monotonic())
+    # "latido": solo mantiene el canal vivo
+
+
+def desactivar_udp(websocket: Any, motivo: str):
+    """Vuelve a enviar los snapshots de una conexión por el WebSocket."""
+    canal = conexiones.get(websocket, {}).get("udp")
+    if canal is None or not canal["activo"]:
+        return
+    canal["activo"] = False
+    metricas.incrementar("canales_udp_caidos")
+    print(f"Canal UDP desactivado ({motivo}), snapshots por WebSocket")
+
+
+def cerrar_canal_udp(websocket: Any):
+    """Olvida el canal UDP de una conexión que se cerró."""
+    canal = conexiones.get(websocket, {}).get("udp")
+    if canal is not None:
+        canales_udp.pop(canal["token"], None)
+
+
+def publicar_telemetria():
+    """Copia el estado compacto de cada sala y los contadores del servidor a la memoria compartida."""
+    ahora = time.monotonic()
+    jugando = 0
+    for sala in salas.values():
+        publicador_telemetria.publicar_sala(sala, numero_tick, ahora)
+        if sala["estado_partida"] == "jugando":
+            jugando += len(sala["jugadores"])
+    publicador_telemetria.publicar_servidor(
+        numero_tick, ahora, len(conexiones), len(salas), jugando,
+        salud["uso_tick"], salud["lag_loop"], control_calidad.nivel
+    )
+    publicador_telemetria.confirmar()
+
+
+async def vaciar_salidas():
+    """Envía la salida acumulada en el tick de todas las salas, un frame por jugador."""
+    envios = []
+    trazas_envio = []
+    for sala in list(salas.values()):
+        if sala["trazas"] and sala["estado_pendiente"] is not None:
+            # Las trazas terminan con el envío del primer estado que las incluye
+            trazas_envio.extend(sala["trazas"])
+            sala["trazas"].clear()
+        envios.extend(vaciar_salida_sala(sala))
+    if envios:
+        inicio = time.perf_counter()
+        await asyncio.gather(*envios, return_exceptions=True)
+        if trazas_envio:
+            trazador.tramos(trazas_envio, "enviar", inicio, time.perf_counter(), envios=len(envios))
+
+
+def transmitir_sala(sala: Dict[str, Any], ahora: float):
+    """
+    Codifica un frame de la transmisión de espectadores (eventos recientes + estado)
+    y entrega a todos los espectadores, de una vez, los frames que ya cumplieron su retraso.
+    El costo de codificar no depende de cuántos espectadores haya.
+    """
+    mensajes = sala["eventos_transmision"]
+    sala["eventos_transmision"] = []
+    mensajes.append(codificar_estado(sala))
+    sala["transmision"].append(
+        (ahora, '{"tipo": "transmision", "mensajes": [' + ", ".join(mensajes) + ']}')
+    )
+    
+    while sala["transmision"] and sala["transmision"][0][0] <= ahora - RETRASO_TRANSMISION:
+        _, frame = sala["transmision"].popleft()
+        # broadcast no espera a cada conexión: un espectador lento no frena a los demás
+        websockets.broadcast(sala["espectadores"], frame)
+        metricas.incrementar("frames_transmision")
+        metricas.incrementar("bytes_transmision", len(frame) * len(sala["espectadores"]))
+
+
+def construir_estado_sala(sala: Dict[str, Any]) -> Dict[str, Any]:
+    """Construye el mensaje estado_sala (lobby) de una sala."""
+    jugadores_info = {}
+    for info in sala["jugadores_info"].values():
+        pid = info["id"]
+        jugadores_info[str(pid)] = {
+            "nombre": info["nombre"],
+            "listo": sala["jugadores_listos"].get(pid, False),
+            "es_host": info.get("es_host", False),
+            "sprite_index": info.get("sprite_index", ((pid - 1) % 3) + 1),  # Fallback si no existe
+            "conectado": pid not in sala["suspendidos"],
+            "es_bot": pid in sala["bots"]
+        }
+    
+    return {
         "tipo": "estado_sala",
+        "version": sala["version_sala"],
         "estado_partida": sala["estado_partida"],
+        "modo": sala["modo"],
         "host_id": sala["host_id"],
-        "codigo_sala": codigo_sala,
+        "codigo_sala": sala["codigo_sala"],
+        "publica": sala["publica"],
         "jugadores": jugadores_info
     }
+
+
+def resumen_sala_publica(sala: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Resumen de una sala para el explorador, o None si no se lista (privada, en partida o llena)."""
+    if (not sala["publica"] or sala["estado_partida"] != "lobby"
+            or len(sala["jugadores"]) >= MAX_JUGADORES_POR_SALA):
+        return None
+    host = next(
+        (info["nombre"] for info in sala["jugadores_info"].values() if info["id"] == sala["host_id"]),
+        None
+    )
+    return {
+        "codigo_sala": sala["codigo_sala"],
+        "host": host,
+        "jugadores": len(sala["jugadores"]),
+        "max_jugadores": MAX_JUGADORES_POR_SALA,
+        "modo": sala["modo"]
+    }
+
+
+def invalidar_estado_sala(sala: Dict[str, Any]):
+    """
+    Registra un cambio del lobby: sube la versión, descarta el estado_sala
+    codificado y actualiza la sala en el índice del explorador.
+    """
+    sala["version_sala"] += 1
+    sala["estado_sala_codificado"] = None
+    indice_salas.actualizar(sala["codigo_sala"], resumen_sala_publica(sala))
+
+
+def codificar_estado_sala(sala: Dict[str, Any]) -> str:
+    """Devuelve el estado_sala codificado; solo se reconstruye si el lobby cambió desde la última vez."""
+    if sala["estado_sala_codificado"] is None:
+        sala["estado_sala_codificado"] = json.dumps(construir_estado_sala(sala))
+        metricas.incrementar("estado_sala_codificados")
+    else:
+        metricas.incrementar("estado_sala_cache")
+    return sala["estado_sala_codificado"]
+
+
+async def enviar_estado_sala_a_sala(codigo_sala: str):
+    """Envía el estado de la sala (lobby) a todos los jugadores de una sala específica."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala or not sala["jugadores"]:
+        return
+    
+    sala["salida"].append(codificar_estado_sala(sala))
+
+
+def registrar_partida(sala: Dict[str, Any], ganador: int, motivo: str | None):
+    """
+    Suma la partida que termina al ranking y la encola para el historial. No
+    espera al disco: el escritor del historial la guarda en su próximo lote.
+    """
+    partida = {
+        "codigo_sala": sala["codigo_sala"],
+        "ganador": ganador,
+        "motivo": motivo,
+        "inicio": sala["estado_desde"],  # Momento en que la sala pasó a "jugando"
+        "fin": time.time(),
+        "jugadores": [
+            {
+                "player_id": pid,
+                "nombre": nombre,
+                "impactos": sala["puntuacion"].get(pid, 0),
+                "es_bot": pid in sala["bots"]
+            }
+            for pid, nombre in sala["participantes"].items()
+        ]
+    }
+    ranking.registrar_partida(partida)
+    if escritor_historial is not None:
+        escritor_historial.registrar(partida)
+    metricas.incrementar("partidas_terminadas")
+
+
+def guardar_analitica(sala: Dict[str, Any], ganador: int):
+    """
+    Cierra las estadísticas de la partida de una sala y las escribe en
+    DIRECTORIO_ANALITICA en segundo plano (el tick no espera al disco).
+    """
+    estadisticas = sala["analitica"]
+    if estadisticas is None:
+        return
+    sala["analitica"] = None
+    
+    resumen, mapas = estadisticas.cerrar(time.monotonic(), estado_invencibles(sala))
+    resumen["codigo_sala"] = sala["codigo_sala"]
+    resumen["ganador"] = ganador
+    resumen["fin"] = time.time()
+    nombre = f"{sala['codigo_sala']}_{int(resumen['fin'] * 1000)}"
+    
+    async def escribir():
+        try:
+            await asyncio.to_thread(analitica.guardar_partida, DIRECTORIO_ANALITICA, nombre, resumen, mapas)
+            metricas.incrementar("analiticas_guardadas")
+        except OSError as e:
+            print(f"Error al guardar las estadísticas de la partida: {e}")
+    
+    tarea = asyncio.create_task(escribir())
+    tareas_analitica.add(tarea)
+    tarea.add_done_callback(tareas_analitica.discard)
+
+
+async def terminar_partida(codigo_sala: str, ganador: int, motivo: str | None = None):
+    """Marca la partida de una sala como terminada y envía game_over a sus jugadores."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala:
+        return
+    
+    if sala["estado_partida"] == "jugando":
+        registrar_partida(sala, ganador, motivo)
+        guardar_analitica(sala, ganador)
+    cambiar_estado_partida(sala, "game_over")
+    sala["duelo"] = None
+    sala["resultado"] = {"ganador": ganador, "motivo": motivo}
+    
+    # Una sala de carga de prueba vuelve a empezar sola, mientras tenga al menos 2 bots
+    # (si un humano se va de una partida con bots, la sala no se reinicia: expira con su TTL)
+    if (sala["sala_de_bots"] and len(sala["bots"]) >= 2
+            and len(sala["bots"]) == len(sala["jugadores_info"])):
+        programar_temporizador_sala(sala, "revancha", ESPERA_REVANCHA_BOTS, comenzar_partida, codigo_sala)
+    
+    evento = {
+        "tipo": "game_over",
+        "ganador": ganador,
+        "puntuacion": sala["puntuacion"]
+    }
+    if motivo is not None:
+        evento["motivo"] = motivo
     await enviar_evento_a_sala(codigo_sala, evento)
 
 
-async def actualizar_balas_sala(codigo_sala: str):
+async def comenzar_partida(codigo_sala: str):
+    """
+    Empieza (o vuelve a empezar) la partida de una sala: reparte las posiciones
+    iniciales, limpia balas, estrella e invencibilidad y avisa a los jugadores.
+    Quien llama ya validó que la sala puede empezar.
+    """
+    sala = obtener_info_sala(codigo_sala)
+    if not sala:
+        return
+    
+    ids_actuales = [info["id"] for info in sala["jugadores_info"].values()]
+    
+    # Resetear puntuación y posiciones en esta sala
+    # Distribuir posiciones iniciales de manera equilibrada
+    num_jugadores = len(ids_actuales)
+    for idx, pid in enumerate(ids_actuales):
+        sala["puntuacion"][pid] = 0
+        # Distribuir jugadores en diferentes posiciones según el número total
+        if num_jugadores == 2:
+            if idx == 0:
+                sala["estado"][pid] = {"x": 200, "y": 300}
+            else:
+                sala["estado"][pid] = {"x": 600, "y": 300}
+        elif num_jugadores == 3:
+            if idx == 0:
+                sala["estado"][pid] = {"x": 200, "y": 300}
+            elif idx == 1:
+                sala["estado"][pid] = {"x": 600, "y": 300}
+            else:
+                # Tercer jugador: esquina inferior, lejos de obstáculos
+                sala["estado"][pid] = {"x": 400, "y": 450}
+        else:  # 4 o más jugadores
+            if idx == 0:
+                sala["estado"][pid] = {"x": 200, "y": 300}
+            elif idx == 1:
+                sala["estado"][pid] = {"x": 600, "y": 300}
+            elif idx == 2:
+                # Evitar cactus en (150, 150) - poner más abajo
+                sala["estado"][pid] = {"x": 200, "y": 450}
+            else:
+                # Evitar cactus en (650, 450) - poner más arriba
+                sala["estado"][pid] = {"x": 600, "y": 150}
+    
+    # Limpiar balas y estrellas de esta sala
+    sala["balas"].clear()
+    sala["estrella_actual"] = None
+    for pid in sala["jugadores_invencibles"]:
+        cancelar_temporizador_sala(sala, f"invencible_{pid}")
+    sala["jugadores_invencibles"].clear()
+    sala["ultima_estrella_tiempo"] = 0.0
+    
+    # Anotar quiénes juegan (para el historial, aunque alguno abandone)
+    sala["participantes"] = {
+        info["id"]: info["nombre"] for info in sala["jugadores_info"].values()
+    }
+    
+    sala["resultado"] = None
+    es_duelo = sala["modo"] == "duelo" and duelo_posible(sala)
+    
+    # Estadísticas de la partida (el duelo simula por su cuenta y no las alimenta)
+    sala["analitica"] = None
+    if GUARDAR_ANALITICA and not es_duelo:
+        sala["analitica"] = analitica.EstadisticasPartida(
+            sala["participantes"], sala["estado"], ANCHO_MAPA, ALTO_MAPA, time.monotonic()
+        )
+    
+    # Cambiar estado de partida de esta sala
+    cambiar_estado_partida(sala, "jugando")
+    
+    # La primera estrella aparece al empezar la partida (en el duelo no hay estrellas)
+    if not es_duelo:
+        programar_temporizador_sala(sala, "estrella", 0.0, generar_estrella_sala, codigo_sala)
+    
+    print(f"Partida iniciada por el host (ID: {sala['host_id']}) en sala {codigo_sala}")
+    
+    # Avisar a todos los jugadores de esta sala que empieza la partida
+    await enviar_evento_a_sala(codigo_sala, {
+        "tipo": "start_game",
+        "estado_partida": sala["estado_partida"],
+        "puntuacion": sala["puntuacion"],
+        "modo": "duelo" if es_duelo else "normal"
+    })
+    if es_duelo:
+        # Las posiciones iniciales del duelo son las mismas que las de 2 jugadores
+        await iniciar_duelo(sala, ids_actuales, duelo.EstadoDuelo.inicial())
+    # Y mandar un estado inicial
+    await enviar_estado_a_sala(codigo_sala)
+
+
+def duelo_posible(sala: Dict[str, Any]) -> bool:
+    """El modo duelo solo se juega entre 2 jugadores, sin bots (no tienen entradas que enviar)."""
+    return len(sala["jugadores_info"]) == 2 and not sala["bots"]
+
+
+def frame_reloj_duelo(partida: Dict[str, Any]) -> int:
+    """Frame que corresponde a este momento según el reloj del servidor (antes del inicio, el primero)."""
+    transcurrido = max(0.0, time.monotonic() - partida["t_inicio"])
+    return partida["frame_inicio"] + int(transcurrido * duelo.FRAMES_POR_SEGUNDO)
+
+
+def crear_duelo(ids: list, estado: duelo.EstadoDuelo, t_inicio: float, sesion: int) -> Dict[str, Any]:
+    """Estructura del duelo de una sala, esperando las entradas desde el frame de `estado`."""
+    return {
+        "ids": list(ids),
+        "sesion": sesion,
+        "estado": estado,
+        "entradas": ({}, {}),
+        "siguiente": [estado.frame, estado.frame],
+        "frame_inicio": estado.frame,
+        "t_inicio": t_inicio,
+        "ultima_resincronizacion": time.monotonic()
+    }
+
+
+async def iniciar_duelo(sala: Dict[str, Any], ids: list, estado: duelo.EstadoDuelo):
+    """
+    Empieza (o resincroniza) el duelo de una sala desde `estado`: descarta las
+    entradas pendientes y avisa a los jugadores con el estado y la hora del servidor
+    en la que empieza su frame. Los clientes reemplazan su simulación por esta.
+    """
+    ahora = time.monotonic()
+    sesion = sala["duelo"]["sesion"] + 1 if sala["duelo"] is not None else 1
+    sala["duelo"] = crear_duelo(ids, estado, ahora + RETRASO_INICIO_DUELO, sesion)
+    reflejar_duelo(sala)
+    await enviar_evento_a_sala(sala["codigo_sala"], {
+        "tipo": "inicio_duelo",
+        "sesion": sesion,
+        "ids": sala["duelo"]["ids"],
+        "estado": estado.a_dict(),
+        "t_inicio": ahora + RETRASO_INICIO_DUELO,
+        "t_servidor": ahora
+    })
+
+
+async def resincronizar_duelo(sala: Dict[str, Any], motivo: str):
+    """Vuelve a empezar el duelo desde el último estado confirmado (como mucho una vez por ESPERA_RESINCRONIZACION_DUELO)."""
+    partida = sala["duelo"]
+    if time.monotonic() - partida["ultima_resincronizacion"] < ESPERA_RESINCRONIZACION_DUELO:
+        return
+    print(f"Resincronizando el duelo de la sala {sala['codigo_sala']} ({motivo})")
+    metricas.incrementar("duelo_resincronizaciones")
+    await iniciar_duelo(sala, partida["ids"], partida["estado"])
+
+
+def reflejar_duelo(sala: Dict[str, Any]):
+    """
+    Copia el estado confirmado del duelo a las estructuras de siempre (posiciones,
+    balas y puntuación) para espectadores, checkpoints y game_over.
+    """
+    partida = sala["duelo"]
+    estado = partida["estado"]
+    for pid, (x, y, _, impactos) in zip(partida["ids"], estado.jugadores):
+        sala["estado"][pid] = {"x": x, "y": y}
+        sala["puntuacion"][pid] = impactos
+    sala["balas"] = {
+        indice + 1: {"x": bala[0], "y": bala[1], "vx": bala[2], "vy": bala[3], "player_id": partida["ids"][indice]}
+        for indice, bala in enumerate(estado.balas) if bala is not None
+    }
+
+
+async def procesar_entrada_duelo(sala: Dict[str, Any], websocket: Any, datos: Dict[str, Any]):
+    """
+    Recibe las entradas de un jugador en un duelo: las reenvía enseguida a su rival
+    y avanza la simulación del servidor mientras tenga las entradas de los dos.
+    El servidor no predice: su estado es el confirmado y decide el ganador.
+    """
+    partida = sala["duelo"]
+    player_id = sala["jugadores_info"][websocket]["id"]
+    if player_id not in partida["ids"]:
+        return
+    indice = partida["ids"].index(player_id)
+    if datos.get("s") != partida["sesion"]:
+        # Enviadas antes de la última resincronización: ya no sirven
+        return
+    frame = datos.get("f")
+    entradas = datos.get("e")
+    
+    # Las entradas llegan en orden (TCP): cualquier hueco, valor raro o adelanto
+    # excesivo sobre el reloj del servidor rompe la secuencia y obliga a resincronizar
+    if (not isinstance(frame, int) or frame != partida["siguiente"][indice]
+            or not isinstance(entradas, list) or not 0 < len(entradas) <= MAX_ENTRADAS_POR_MENSAJE
+            or not all(isinstance(e, int) and 0 <= e <= duelo.ENTRADA_MAXIMA for e in entradas)
+            or frame + len(entradas) > frame_reloj_duelo(partida) + MARGEN_FRAMES_DUELO):
+        metricas.incrementar("duelo_entradas_rechazadas")
+        await resincronizar_duelo(sala, f"entradas inválidas del jugador {player_id}")
+        return
+    
+    for desplazamiento, entrada in enumerate(entradas):
+        partida["entradas"][indice][frame + desplazamiento] = entrada
+    partida["siguiente"][indice] += len(entradas)
+    
+    # Reenviar al rival sin esperar al final del tick (si está conectado)
+    rival = buscar_websocket_de_jugador(sala, partida["ids"][1 - indice])
+    if rival is not None and rival in sala["jugadores"]:
+        mensaje = json.dumps({"tipo": "entrada", "s": partida["sesion"], "f": frame, "e": entradas})
+        try:
+            await rival.send(mensaje)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        metricas.incrementar("duelo_entradas_reenviadas", len(entradas))
+        metricas.incrementar("duelo_bytes_reenviados", len(mensaje))
+    
+    # Avanzar el estado confirmado
+    estado = partida["estado"]
+    entradas_0, entradas_1 = partida["entradas"]
+    while estado.frame in entradas_0 and estado.frame in entradas_1 and estado.ganador is None:
+        frame_actual = estado.frame
+        duelo.avanzar(estado, (entradas_0.pop(frame_actual), entradas_1.pop(frame_actual)))
+        if estado.frame % FRAMES_ENTRE_CONTROLES_DUELO == 0:
+            await enviar_evento_a_sala(sala["codigo_sala"], {
+                "tipo": "control_duelo",
+                "s": partida["sesion"],
+                "f": estado.frame,
+                "suma": estado.suma()
+            })
+    reflejar_duelo(sala)
+    
+    if estado.ganador is not None and sala["estado_partida"] == "jugando":
+        await terminar_partida(sala["codigo_sala"], partida["ids"][estado.ganador])
+
+
+def crear_bala(sala: Dict[str, Any], player_id: int, direccion: str) -> bool:
+    """
+    Crea la bala de un disparo desde la posición del jugador. Cada jugador puede
+    tener una sola bala activa. Devuelve True si se creó.
+    """
+    # Verificar si el jugador ya tiene una bala activa en esta sala
+    tiene_bala_activa = any(
+        bala_info["player_id"] == player_id
+        for bala_info in sala["balas"].values()
+    )
+    if tiene_bala_activa:
+        print(f"Disparo ignorado - Jugador {player_id} ya tiene una bala activa")
+        return False
+    if player_id not in sala["estado"]:
+        return False
+    
+    # Obtener posición actual del jugador
+    jugador_pos = sala["estado"][player_id]
+    bala_x = jugador_pos["x"]
+    bala_y = jugador_pos["y"]
+    
+    # Velocidad de la bala
+    velocidad_bala = 10
+    
+    # Calcular velocidad según dirección
+    if direccion == "up":
+        vx, vy = 0, -velocidad_bala
+    elif direccion == "down":
+        vx, vy = 0, velocidad_bala
+    elif direccion == "left":
+        vx, vy = -velocidad_bala, 0
+    elif direccion == "right":
+        vx, vy = velocidad_bala, 0
+    else:
+        vx, vy = 0, -velocidad_bala  # Por defecto hacia arriba
+    
+    # Crear nueva bala en esta sala
+    bala_id = sala["siguiente_bala_id"]
+    sala["siguiente_bala_id"] += 1
+    
+    sala["balas"][bala_id] = {
+        "x": bala_x,
+        "y": bala_y,
+        "vx": vx,
+        "vy": vy,
+        "player_id": player_id
+    }
+    
+    if sala["analitica"] is not None:
+        sala["analitica"].disparo(player_id, bala_x, bala_y)
+    
+    print(f"Bala creada - Jugador {player_id} disparó hacia {direccion} en sala {sala['codigo_sala']}")
+    return True
+
+
+async def actualizar_balas_sala(codigo_sala: str, pasos: int = 1):
     """
     Actualiza la posición de todas las balas de una sala, detecta impactos y
-    elimina las que salen de la pantalla o golpean a un jugador.
+    elimina las que salen de la pantalla o golpean a un jugador. Con `pasos`
+    mayor que 1 (simulación degradada) cada bala avanza esa cantidad de ticks en
+    el mismo llamado, revisando colisiones después de cada uno.
     """
     sala = obtener_info_sala(codigo_sala)
     if not sala or sala["estado_partida"] != "jugando":
@@ -253,109 +1487,677 @@ async def actualizar_balas_sala(codigo_sala: str):
     ANCHO_PANTALLA = 800
     ALTO_PANTALLA = 600
     
+    inicio = time.perf_counter()
     balas_a_eliminar = []
     
     for bala_id, bala_info in list(sala["balas"].items()):
-        # Actualizar posición
-        bala_info["x"] += bala_info["vx"]
-        bala_info["y"] += bala_info["vy"]
-        
-        bx, by = bala_info["x"], bala_info["y"]
         owner_id = bala_info["player_id"]
-        
-        # 1) Si sale de la pantalla, marcar para eliminar
-        if bx < 0 or bx > ANCHO_PANTALLA or by < 0 or by > ALTO_PANTALLA:
-            balas_a_eliminar.append(bala_id)
-            continue
-        
-        # 2) Revisar colisión con obstáculos (barriles y cactus)
-        for obs in OBSTACULOS:
-            obs_x = obs["x"]
-            obs_y = obs["y"]
-            tipo_obs = obs["tipo"]
+        # Con `pasos` > 1 la bala avanza tick a tick y se revisa en cada uno: de un
+        # solo salto (20-30 px) atravesaría a un jugador que está dentro de RADIO_IMPACTO
+        for _ in range(pasos):
+            # Actualizar posición
+            bala_info["x"] += bala_info["vx"]
+            bala_info["y"] += bala_info["vy"]
             
-            # Determinar tamaño según el tipo de obstáculo
-            if tipo_obs == "cactus":
-                obs_ancho = CACTUS_ANCHO
-                obs_alto = CACTUS_ALTO
-                nombre_obs = "cactus"
-            else:
-                # Es un barril
-                obs_ancho = BARRIL_ANCHO
-                obs_alto = BARRIL_ALTO
-                nombre_obs = "barril"
+            bx, by = bala_info["x"], bala_info["y"]
             
-            # Crear rectángulo del obstáculo (centrado en obs_x, obs_y)
-            obs_rect_left = obs_x - obs_ancho // 2
-            obs_rect_top = obs_y - obs_alto // 2
-            obs_rect_right = obs_x + obs_ancho // 2
-            obs_rect_bottom = obs_y + obs_alto // 2
-            
-            # Verificar si la bala está dentro del rectángulo del obstáculo
-            if (obs_rect_left <= bx <= obs_rect_right and 
-                obs_rect_top <= by <= obs_rect_bottom):
-                # La bala chocó con un obstáculo, eliminarla
-                print(f"Bala {bala_id} chocó con {nombre_obs} en ({obs_x}, {obs_y})")
+            # 1) Si sale de la pantalla, marcar para eliminar
+            if bx < 0 or bx > ANCHO_PANTALLA or by < 0 or by > ALTO_PANTALLA:
                 balas_a_eliminar.append(bala_id)
-                break  # Ya no seguimos revisando esta bala
-        
-        # Si la bala ya fue marcada para eliminar (por chocar con obstáculo), continuar
-        if bala_id in balas_a_eliminar:
-            continue
-        
-        # 3) Revisar impacto contra todos los jugadores de esta sala
-        for pid, pos in sala["estado"].items():
-            if pid == owner_id:
-                continue  # No se auto-pega
+                break
+            
+            # 2) Revisar colisión con obstáculos (barriles y cactus)
+            for obs in OBSTACULOS:
+                obs_x = obs["x"]
+                obs_y = obs["y"]
+                tipo_obs = obs["tipo"]
+                
+                # Determinar tamaño según el tipo de obstáculo
+                if tipo_obs == "cactus":
+                    obs_ancho = CACTUS_ANCHO
+                    obs_alto = CACTUS_ALTO
+                    nombre_obs = "cactus"
+                else:
+                    # Es un barril
+                    obs_ancho = BARRIL_ANCHO
+                    obs_alto = BARRIL_ALTO
+                    nombre_obs = "barril"
+                
+                # Crear rectángulo del obstáculo (centrado en obs_x, obs_y)
+                obs_rect_left = obs_x - obs_ancho // 2
+                obs_rect_top = obs_y - obs_alto // 2
+                obs_rect_right = obs_x + obs_ancho // 2
+                obs_rect_bottom = obs_y + obs_alto // 2
+                
+                # Verificar si la bala está dentro del rectángulo del obstáculo
+                if (obs_rect_left <= bx <= obs_rect_right and 
+                    obs_rect_top <= by <= obs_rect_bottom):
+                    # La bala chocó con un obstáculo, eliminarla
+                    print(f"Bala {bala_id} chocó con {nombre_obs} en ({obs_x}, {obs_y})")
+                    balas_a_eliminar.append(bala_id)
+                    break  # Ya no seguimos revisando esta bala
             
-            # Verificar si el jugador objetivo es invencible
-            tiempo_actual = time.time()
-            if pid in sala["jugadores_invencibles"] and tiempo_actual < sala["jugadores_invencibles"][pid]:
-                continue  # El jugador es invencible, no puede ser golpeado
+            # Si la bala ya fue marcada para eliminar (por chocar con obstáculo), continuar
+            if bala_id in balas_a_eliminar:
+                break
             
-            dist = math.hypot(pos["x"] - bx, pos["y"] - by)
-            if dist <= RADIO_IMPACTO:
-                print(f"Impacto! Jugador {owner_id} golpea a {pid} en sala {codigo_sala}")
-                sala["puntuacion"][owner_id] = sala["puntuacion"].get(owner_id, 0) + 1
-                balas_a_eliminar.append(bala_id)
+            # 3) Revisar impacto contra todos los jugadores de esta sala
+            for pid, pos in sala["estado"].items():
+                if pid == owner_id:
+                    continue  # No se auto-pega
+                
+                # Verificar si el jugador objetivo es invencible
+                if pid in sala["jugadores_invencibles"]:
+                    continue  # El jugador es invencible, no puede ser golpeado
                 
-                # Verificar si owner_id ya ganó (3 impactos)
-                if sala["puntuacion"][owner_id] >= 3 and sala["estado_partida"] == "jugando":
-                    sala["estado_partida"] = "game_over"
-                    
-                    await enviar_evento_a_sala(codigo_sala, {
-                        "tipo": "game_over",
-                        "ganador": owner_id,
-                        "puntuacion": sala["puntuacion"]
-                    })
+                dist = math.hypot(pos["x"] - bx, pos["y"] - by)
+                if dist <= RADIO_IMPACTO:
+                    print(f"Impacto! Jugador {owner_id} golpea a {pid} en sala {codigo_sala}")
+                    sala["puntuacion"][owner_id] = sala["puntuacion"].get(owner_id, 0) + 1
+                    balas_a_eliminar.append(bala_id)
+                    if "traza" in bala_info and trazador is not None:
+                        trazador.instante(bala_info["traza"], "impacto", time.perf_counter(), objetivo=pid)
+                    if sala["analitica"] is not None:
+                        sala["analitica"].impacto(owner_id, pid, bx, by)
+                    
+                    # Verificar si owner_id ya ganó (3 impactos)
+                    if sala["puntuacion"][owner_id] >= 3 and sala["estado_partida"] == "jugando":
+                        await terminar_partida(codigo_sala, owner_id)
+                    
+                    break  # Ya no seguimos revisando esta bala
+            
+            if bala_id in balas_a_eliminar:
+                break
+    
+    # Registrar el paso en las trazas de las balas muestreadas
+    if trazador is not None:
+        fin = time.perf_counter()
+        for bala_id, bala_info in sala["balas"].items():
+            if "traza" in bala_info:
+                trazador.tramo(bala_info["traza"], "simular", inicio, fin, tick=numero_tick,
+                               x=bala_info["x"], y=bala_info["y"], eliminada=bala_id in balas_a_eliminar)
+                sala["trazas"].add(bala_info["traza"])
+    
+    # Eliminar balas marcadas de esta sala
+    for bala_id in balas_a_eliminar:
+        sala["balas"].pop(bala_id, None)
+
+
+async def actualizar_estrellas_sala(codigo_sala: str):
+    """Actualiza el sistema de estrellas de una sala: detecta recogida."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala or sala["estado_partida"] != "jugando":
+        return
+    
+    tiempo_actual = time.time()
+    
+    if sala["estrella_actual"] is not None:
+        # Verificar si algún jugador de esta sala recogió la estrella
+        for pid, pos in sala["estado"].items():
+            dist = math.hypot(pos["x"] - sala["estrella_actual"]["x"], pos["y"] - sala["estrella_actual"]["y"])
+            radio_recogida = (TAMAÑO_JUGADOR + ESTRELLA_TAMAÑO) // 2
+            
+            if dist <= radio_recogida:
+                # El jugador recogió la estrella
+                print(f"Jugador {pid} recogió la estrella en sala {codigo_sala}! Invencible por {DURACION_INVENCIBILIDAD}s")
+                if sala["analitica"] is not None:
+                    # Si ya era invencible, solo se suma lo que se extiende
+                    fin_anterior = max(sala["jugadores_invencibles"].get(pid, 0.0), tiempo_actual)
+                    sala["analitica"].estrella(pid, tiempo_actual + DURACION_INVENCIBILIDAD - fin_anterior)
+                sala["jugadores_invencibles"][pid] = tiempo_actual + DURACION_INVENCIBILIDAD
+                programar_temporizador_sala(
+                    sala, f"invencible_{pid}", DURACION_INVENCIBILIDAD,
+                    terminar_invencibilidad, codigo_sala, pid
+                )
+                sala["estrella_actual"] = None  # La estrella desaparece
                 
-                break  # Ya no seguimos revisando esta bala
+                # La siguiente estrella aparece TIEMPO_ENTRE_ESTRELLAS después de la anterior
+                espera = sala["ultima_estrella_tiempo"] + TIEMPO_ENTRE_ESTRELLAS - tiempo_actual
+                programar_temporizador_sala(sala, "estrella", espera, generar_estrella_sala, codigo_sala)
+                break
+
+
+def generar_estrella_sala(codigo_sala: str):
+    """Temporizador: hace aparecer una estrella en la sala si no hay una activa."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala or sala["estado_partida"] != "jugando" or sala["estrella_actual"] is not None:
+        return
+    
+    pos = generar_posicion_estrella()
+    tiempo_actual = time.time()
+    if pos is None:
+        # No se encontró posición válida, reintentar en breve
+        programar_temporizador_sala(sala, "estrella", 0.1, generar_estrella_sala, codigo_sala)
+        return
+    
+    sala["estrella_actual"] = {
+        "x": pos[0],
+        "y": pos[1],
+        "tiempo_creacion": tiempo_actual
+    }
+    sala["ultima_estrella_tiempo"] = tiempo_actual
+    print(f"Nueva estrella generada en sala {codigo_sala} en ({pos[0]:.1f}, {pos[1]:.1f})")
+
+
+def terminar_invencibilidad(codigo_sala: str, player_id: int):
+    """Temporizador: retira la invencibilidad de un jugador al expirar."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala:
+        return
+    sala["jugadores_invencibles"].pop(player_id, None)
+    sala["temporizadores"].pop(f"invencible_{player_id}", None)
+
+
+def registrar_bot(sala: Dict[str, Any], es_host: bool = False) -> bots.Bot:
+    """
+    Agrega un bot a la sala como un jugador más (ya listo). Su conexión falsa
+    recibe todo lo que se envía a la sala, igual que la de un jugador real.
+    """
+    global siguiente_player_id, siguiente_numero_bot
+    
+    player_id = siguiente_player_id
+    siguiente_player_id += 1
+    numero = siguiente_numero_bot
+    siguiente_numero_bot += 1
+    
+    bot = bots.Bot(player_id, f"{SEMILLA_BOTS}-{numero}")
+    sprite_index = (len(sala["jugadores"]) % 3) + 1
+    sala["jugadores"].append(bot.conexion)
+    sala["jugadores_info"][bot.conexion] = {
+        "id": player_id,
+        "nombre": f"Bot {numero}",
+        "es_host": es_host,
+        "sprite_index": sprite_index,
+        "token": None,  # Un bot no reanuda sesiones
+        "es_bot": True
+    }
+    sala["jugadores_listos"][player_id] = True
+    sala["bots"][player_id] = bot
+    websocket_a_sala[bot.conexion] = sala["codigo_sala"]
+    invalidar_estado_sala(sala)
+    
+    # Misma posición de espera que un jugador que se une
+    if len(sala["jugadores"]) == 2:
+        sala["estado"][player_id] = {"x": 600, "y": 300}
+    else:
+        sala["estado"][player_id] = {"x": 400, "y": 450}
+    return bot
+
+
+async def crear_sala_emparejada(grupo: list):
+    """
+    Crea una sala para un grupo de la cola de partida rápida (el primero en
+    llegar es el host) y la empieza enseguida, igual que iniciar_partida.
+    Un jugador solo juega contra un bot.
+    """
+    global siguiente_player_id
+    
+    # Quien ya está en una sala (o mirando una) no puede quedar también en esta
+    grupo = [
+        emparejado for emparejado in grupo
+        if emparejado[0] not in websocket_a_sala and emparejado[0] not in espectador_a_sala
+    ]
+    if not grupo:
+        return
+    
+    codigo_sala = generar_codigo_sala()
+    sala = None
+    asignaciones = []
+    for i, (websocket, nombre, espera) in enumerate(grupo):
+        player_id = siguiente_player_id
+        siguiente_player_id += 1
+        if sala is None:
+            sala = crear_estructura_sala(codigo_sala, player_id)
+            salas[codigo_sala] = sala
+        
+        sprite_index = (i % 3) + 1
+        token = crear_sesion(codigo_sala, player_id)
+        sala["jugadores"].append(websocket)
+        sala["jugadores_info"][websocket] = {
+            "id": player_id,
+            "nombre": nombre,
+            "es_host": i == 0,
+            "sprite_index": sprite_index,
+            "token": token
+        }
+        sala["jugadores_listos"][player_id] = True
+        sala["estado"][player_id] = {"x": 200, "y": 300}  # comenzar_partida reparte las posiciones
+        websocket_a_sala[websocket] = codigo_sala
+        metricas.observar("espera_emparejamiento", espera)
+        asignaciones.append(websocket.send(json.dumps({
+            "tipo": "asignacion_id",
+            "player_id": player_id,
+            "x": 200,
+            "y": 300,
+            "es_host": i == 0,
+            "codigo_sala": codigo_sala,
+            "sprite_index": sprite_index,
+            "token_reanudacion": token,
+            "emparejado": True
+        })))
+    
+    if len(sala["jugadores"]) < 2:
+        registrar_bot(sala)
+    invalidar_estado_sala(sala)
+    programar_expiracion_sala(sala)
+    metricas.incrementar("salas_emparejadas")
+    print(f"Sala {codigo_sala} emparejada con {len(grupo)} jugadores")
+    
+    # La sala ya está completa antes de esperar a la red: si alguien se desconecta,
+    # su manejar_cliente lo retira como de cualquier otra sala
+    await asyncio.gather(*asignaciones, return_exceptions=True)
+    await enviar_estado_sala_a_sala(codigo_sala)
+    await comenzar_partida(codigo_sala)
+
+
+async def loop_emparejamiento():
+    """
+    Loop que arma grupos con la cola de partida rápida cada INTERVALO_EMPAREJAMIENTO
+    segundos (una pasada por la cola para todos los que esperan).
+    """
+    while True:
+        await asyncio.sleep(INTERVALO_EMPAREJAMIENTO)
+        if cola_emparejamiento.esperando and motivo_sobrecarga() is None and await liberar_cupo_salas():
+            for grupo in cola_emparejamiento.formar_grupos(time.monotonic(), MAX_SALAS - len(salas)):
+                await crear_sala_emparejada(grupo)
+        metricas.fijar("cola_emparejamiento", len(cola_emparejamiento))
+        metricas.observar("profundidad_cola_emparejamiento", len(cola_emparejamiento))
+
+
+def crear_sala_de_bots(cantidad: int) -> str:
+    """Crea una sala con `cantidad` bots y ningún jugador real (carga para pruebas)."""
+    codigo_sala = generar_codigo_sala()
+    sala = crear_estructura_sala(codigo_sala, 0)
+    sala["sala_de_bots"] = True
+    salas[codigo_sala] = sala
+    for i in range(cantidad):
+        bot = registrar_bot(sala, es_host=(i == 0))
+        if i == 0:
+            sala["host_id"] = bot.player_id
+    programar_expiracion_sala(sala)
+    return codigo_sala
+
+
+def actualizar_bots(pasos: int = 1):
+    """
+    Mueve a los bots de las salas en juego (`pasos` ticks de movimiento con la
+    simulación degradada). Todos avanzan en cada tick, pero decidir
+    (objetivo, disparo, esquive) está limitado a PRESUPUESTO_BOT_S de CPU por bot:
+    si el presupuesto del tick se agota, los que faltan deciden en el siguiente
+    (cada tick se empieza por un bot distinto para que nadie quede siempre último).
+    """
+    activos = [
+        (sala, bot)
+        for sala in salas.values() if sala["estado_partida"] == "jugando"
+        for bot in sala["bots"].values()
+    ]
+    if not activos:
+        return
+    
+    inicio = time.perf_counter()
+    ahora = time.monotonic()
+    limite = inicio + PRESUPUESTO_BOT_S * len(activos)
+    desplazamiento = numero_tick % len(activos)
+    postergados = 0
+    for sala, bot in activos[desplazamiento:] + activos[:desplazamiento]:
+        posicion = sala["estado"].get(bot.player_id)
+        if posicion is None or sala["estado_partida"] != "jugando":
+            continue
+        if numero_tick >= bot.proxima_decision:
+            if time.perf_counter() < limite:
+                direccion = bot.pensar(sala, grilla_navegacion, numero_tick)
+                if direccion is not None:
+                    crear_bala(sala, bot.player_id, direccion)
+            else:
+                postergados += 1
+        for _ in range(pasos):
+            posicion["x"], posicion["y"] = bot.mover(grilla_navegacion, posicion["x"], posicion["y"])
+        if sala["analitica"] is not None:
+            sala["analitica"].posicion(bot.player_id, posicion["x"], posicion["y"], ahora)
+    
+    metricas.observar("bots_tick_s", time.perf_counter() - inicio)
+    if postergados:
+        metricas.incrementar("bots_decisiones_postergadas", postergados)
+
+
+async def retirar_jugador_de_sala(codigo_sala: str, websocket: Any):
+    """
+    Retira a un jugador de su sala (por desconexión o por limpieza) y aplica las
+    reglas de abandono. Si el jugador ya no está en la sala no hace nada.
+    """
+    sala = obtener_info_sala(codigo_sala)
+    if not sala or websocket not in sala["jugadores_info"]:
+        websocket_a_sala.pop(websocket, None)
+        return
+    
+    jugador_info = sala["jugadores_info"][websocket]
+    player_id = jugador_info["id"]
+    nombre = jugador_info.get("nombre", "Desconocido")
+    print(f"Jugador desconectado: {nombre} (ID: {player_id}) de sala {codigo_sala}")
+    
+    # Ya no puede reanudar la sesión
+    sesiones.pop(jugador_info.get("token"), None)
+    sala["suspendidos"].pop(player_id, None)
+    cancelar_temporizador_sala(sala, f"reanudacion_{player_id}")
+    
+    # Si es el host y no hay partida en curso, eliminar toda la sala
+    if player_id == sala["host_id"] and sala["estado_partida"] != "jugando":
+        print(f"El host se desconectó, eliminando sala {codigo_sala}")
+        eliminar_sala(codigo_sala)
+        return
+    
+    # Remover el jugador de la sala (ya sea host o no)
+    if websocket in sala["jugadores"]:
+        sala["jugadores"].remove(websocket)
+    del sala["jugadores_info"][websocket]
+    invalidar_estado_sala(sala)
+    sala["estado"].pop(player_id, None)
+    sala["jugadores_listos"].pop(player_id, None)
+    sala["puntuacion"].pop(player_id, None)
+    sala["jugadores_invencibles"].pop(player_id, None)
+    sala["bots"].pop(player_id, None)
+    cancelar_temporizador_sala(sala, f"invencible_{player_id}")
+    
+    # Remover mapeo de websocket a sala
+    websocket_a_sala.pop(websocket, None)
+    
+    if sala["estado_partida"] == "jugando":
+        if len(sala["jugadores_info"]) == 1:
+            # El jugador restante (conectado o con el lugar reservado) gana por abandono
+            jugador_restante_info = next(iter(sala["jugadores_info"].values()))
+            if jugador_restante_info:
+                jugador_restante_id = jugador_restante_info["id"]
+                jugador_restante_nombre = jugador_restante_info.get("nombre", "Desconocido")
+                print(f"Jugador {jugador_restante_nombre} (ID: {jugador_restante_id}) gana por abandono en sala {codigo_sala}")
+                await terminar_partida(codigo_sala, jugador_restante_id, "abandono")
+        elif player_id == sala["host_id"]:
+            # Si el host se va y quedan varios jugadores, eliminar la sala
+            print(f"El host se desconectó durante partida con múltiples jugadores, eliminando sala {codigo_sala}")
+            eliminar_sala(codigo_sala)
+            return
+    
+    # Notificar a los demás jugadores de la sala del cambio de estado
+    if sala["jugadores"]:
+        await enviar_estado_sala_a_sala(codigo_sala)
+        await enviar_estado_a_sala(codigo_sala)
+
+
+async def agregar_espectador(websocket: Any, codigo_sala: str):
+    """Suscribe una conexión a la transmisión de espectadores de una sala."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala:
+        await websocket.send(json.dumps({
+            "tipo": "error",
+            "mensaje": f"La sala {codigo_sala} no existe"
+        }))
+        return
+    if len(sala["espectadores"]) >= MAX_ESPECTADORES_POR_SALA:
+        await rechazar_por_sobrecarga(websocket, f"la sala tiene {MAX_ESPECTADORES_POR_SALA} espectadores")
+        return
+    
+    sala["espectadores"].add(websocket)
+    espectador_a_sala[websocket] = codigo_sala
+    metricas.fijar("espectadores", len(espectador_a_sala))
+    print(f"Espectador conectado a sala {codigo_sala} ({len(sala['espectadores'])} en total)")
+    
+    # La transmisión empieza con retraso: mientras tanto, mostrar la sala
+    await websocket.send(json.dumps({
+        "tipo": "asignacion_espectador",
+        "codigo_sala": codigo_sala,
+        "estado_partida": sala["estado_partida"],
+        "retraso": RETRASO_TRANSMISION
+    }))
+    await websocket.send(codificar_estado_sala(sala))
+
+
+def retirar_espectador(websocket: Any):
+    """Quita una conexión de la transmisión de espectadores."""
+    codigo_sala = espectador_a_sala.pop(websocket, None)
+    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+    if sala:
+        sala["espectadores"].discard(websocket)
+        if not sala["espectadores"]:
+            sala["eventos_transmision"].clear()
+            sala["transmision"].clear()
+    metricas.fijar("espectadores", len(espectador_a_sala))
+
+
+async def suspender_jugador(codigo_sala: str, websocket: Any):
+    """
+    Reserva el lugar de un jugador que perdió la conexión en plena partida.
+    Si no reanuda la sesión dentro de VENTANA_REANUDACION, se retira de la sala.
+    """
+    sala = obtener_info_sala(codigo_sala)
+    if not sala or websocket not in sala["jugadores_info"]:
+        websocket_a_sala.pop(websocket, None)
+        return
+    
+    player_id = sala["jugadores_info"][websocket]["id"]
+    print(f"Jugador {player_id} perdió la conexión en sala {codigo_sala}, reservando su lugar {VENTANA_REANUDACION}s")
+    
+    # Deja de recibir mensajes, pero conserva su estado en la sala
+    if websocket in sala["jugadores"]:
+        sala["jugadores"].remove(websocket)
+    websocket_a_sala.pop(websocket, None)
+    sala["suspendidos"][player_id] = websocket
+    invalidar_estado_sala(sala)
+    programar_temporizador_sala(
+        sala, f"reanudacion_{player_id}", VENTANA_REANUDACION,
+        expirar_reanudacion, codigo_sala, player_id
+    )
+    metricas.incrementar("sesiones_suspendidas")
+    
+    if sala["jugadores"]:
+        await enviar_estado_sala_a_sala(codigo_sala)
+
+
+async def expirar_reanudacion(codigo_sala: str, player_id: int):
+    """Temporizador: el jugador no volvió a tiempo, se retira de la sala."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala or player_id not in sala["suspendidos"]:
+        return
+    
+    websocket = sala["suspendidos"].pop(player_id)
+    sala["temporizadores"].pop(f"reanudacion_{player_id}", None)
+    print(f"Jugador {player_id} no reanudó su sesión a tiempo en sala {codigo_sala}")
+    metricas.incrementar("sesiones_expiradas")
+    await retirar_jugador_de_sala(codigo_sala, websocket)
+
+
+async def reanudar_sesion(websocket: Any, token: str) -> bool:
+    """
+    Reengancha una conexión nueva al lugar reservado de un jugador y le envía
+    una instantánea completa de la sala. Devuelve False si el token no es válido.
+    """
+    sesion = sesiones.get(token)
+    if sesion is None:
+        return False
+    codigo_sala = sesion["codigo_sala"]
+    player_id = sesion["player_id"]
+    sala = obtener_info_sala(codigo_sala)
+    if not sala:
+        sesiones.pop(token, None)
+        return False
+    
+    websocket_anterior = sala["suspendidos"].pop(player_id, None)
+    if websocket_anterior is None:
+        # El servidor aún no detectó el corte: la conexión nueva reemplaza a la vieja
+        websocket_anterior = buscar_websocket_de_jugador(sala, player_id)
+        if websocket_anterior is None or websocket_anterior is websocket:
+            return False
+        if websocket_anterior in sala["jugadores"]:
+            sala["jugadores"].remove(websocket_anterior)
+        websocket_a_sala.pop(websocket_anterior, None)
+        cerrar_en_segundo_plano(websocket_anterior, 4000, "Sesión reanudada en otra conexión")
+    cancelar_temporizador_sala(sala, f"reanudacion_{player_id}")
+    
+    # Mover la información del jugador a la conexión nueva
+    info = sala["jugadores_info"].pop(websocket_anterior)
+    sala["jugadores_info"][websocket] = info
+    invalidar_estado_sala(sala)
+    sala["jugadores"].append(websocket)
+    websocket_a_sala[websocket] = codigo_sala
+    print(f"Jugador {info['nombre']} (ID: {player_id}) reanudó su sesión en sala {codigo_sala}")
+    metricas.incrementar("sesiones_reanudadas")
+    
+    posicion = sala["estado"].get(player_id, {"x": 0, "y": 0})
+    await websocket.send(json.dumps({
+        "tipo": "asignacion_id",
+        "player_id": player_id,
+        "x": posicion["x"],
+        "y": posicion["y"],
+        "es_host": info["es_host"],
+        "codigo_sala": codigo_sala,
+        "sprite_index": info["sprite_index"],
+        "token_reanudacion": token,
+        "reanudado": True,
+        "estado_partida": sala["estado_partida"]
+    }))
+    
+    # Una instantánea completa en un solo frame: sala, resultado (si terminó) y estado
+    mensajes = [codificar_estado_sala(sala)]
+    if sala["estado_partida"] == "game_over" and sala["resultado"] is not None:
+        evento_fin = {
+            "tipo": "game_over",
+            "ganador": sala["resultado"]["ganador"],
+            "puntuacion": sala["puntuacion"]
+        }
+        if sala["resultado"]["motivo"] is not None:
+            evento_fin["motivo"] = sala["resultado"]["motivo"]
+        mensajes.append(json.dumps(evento_fin))
+    mensajes.append(codificar_estado(sala))
+    await websocket.send('{"tipo": "lote", "mensajes": [' + ", ".join(mensajes) + ']}')
+    
+    # Avisar a los demás que volvió
+    await enviar_estado_sala_a_sala(codigo_sala)
+    
+    # En un duelo los dos clientes vuelven a empezar desde el estado confirmado del servidor
+    if sala["duelo"] is not None:
+        await iniciar_duelo(sala, sala["duelo"]["ids"], sala["duelo"]["estado"])
+    return True
+
+
+def _acumular_limpieza(liberado: Dict[str, int]):
+    """Suma lo liberado en una pasada del recolector a los totales del servidor."""
+    for clave, cantidad in liberado.items():
+        estadisticas_limpieza[clave] += cantidad
+        metricas.incrementar(f"limpieza_{clave}", cantidad)
+
+
+async def expirar_sala(codigo_sala: str, liberado: Dict[str, int]):
+    """Elimina una sala expirada y cierra las conexiones que seguían en ella."""
+    sala = obtener_info_sala(codigo_sala)
+    if not sala:
+        return
+    
+    sockets_sala = list(sala["jugadores"])
+    resultado = eliminar_sala(codigo_sala)
+    liberado["salas"] += 1
+    liberado["jugadores"] += resultado["jugadores"]
+    liberado["balas"] += resultado["balas"]
+    liberado["conexiones"] += len(sockets_sala)
+    print(f"Sala {codigo_sala} expirada en estado '{sala['estado_partida']}', eliminada")
+    
+    # El cierre espera el handshake de cada cliente; no bloquear al recolector
+    for ws in sockets_sala:
+        cerrar_en_segundo_plano(ws, 1001, "Sala expirada")
+
+
+async def expirar_sala_por_ttl(codigo_sala: str):
+    """Temporizador: elimina una sala que superó el TTL de su estado."""
+    liberado: Dict[str, int] = defaultdict(int)
+    await expirar_sala(codigo_sala, liberado)
+    _acumular_limpieza(liberado)
+
+
+async def recolectar_salas() -> Dict[str, int]:
+    """
+    Una pasada del recolector: retira jugadores con conexiones ya cerradas y
+    borra mapeos huérfanos. Devuelve cuánto se liberó.
+    (Las salas que superan su TTL las elimina su temporizador de expiración.)
+    """
+    liberado: Dict[str, int] = defaultdict(int)
+    
+    # 1) Jugadores cuya conexión ya se cerró pero siguen registrados en la sala
+    for codigo_sala, sala in list(salas.items()):
+        for ws in list(sala["jugadores"]):
+            if conexion_cerrada(ws) and ws in sala["jugadores_info"]:
+                await retirar_jugador_de_sala(codigo_sala, ws)
+                liberado["jugadores"] += 1
     
-    # Eliminar balas marcadas de esta sala
-    for bala_id in balas_a_eliminar:
-        sala["balas"].pop(bala_id, None)
+    # 2) Mapeos websocket -> sala que apuntan a salas o jugadores que ya no existen
+    for ws, codigo_sala in list(websocket_a_sala.items()):
+        sala = salas.get(codigo_sala)
+        if sala is None or ws not in sala["jugadores_info"]:
+            del websocket_a_sala[ws]
+            liberado["mapeos"] += 1
+    for ws, codigo_sala in list(espectador_a_sala.items()):
+        sala = salas.get(codigo_sala)
+        if sala is None or ws not in sala["espectadores"] or conexion_cerrada(ws):
+            retirar_espectador(ws)
+            liberado["mapeos"] += 1
+    
+    _acumular_limpieza(liberado)
+    return liberado
 
 
-async def actualizar_estrellas_sala(codigo_sala: str):
-    """Actualiza el sistema de estrellas de una sala: detecta recogida."""
-    sala = obtener_info_sala(codigo_sala)
-    if not sala or sala["estado_partida"] != "jugando":
-        return
+async def liberar_cupo_salas() -> bool:
+    """
+    Si se alcanzó MAX_SALAS, elimina las salas terminadas más antiguas.
+    Devuelve True si hay espacio para crear una sala nueva.
+    """
+    if len(salas) < MAX_SALAS:
+        return True
     
-    tiempo_actual = time.time()
+    terminadas = sorted(
+        (sala["estado_desde"], codigo_sala)
+        for codigo_sala, sala in salas.items()
+        if sala["estado_partida"] == "game_over"
+    )
+    liberado: Dict[str, int] = defaultdict(int)
+    for _, codigo_sala in terminadas[:len(salas) - MAX_SALAS + 1]:
+        await expirar_sala(codigo_sala, liberado)
+    _acumular_limpieza(liberado)
     
-    if sala["estrella_actual"] is not None:
-        # Verificar si algún jugador de esta sala recogió la estrella
-        for pid, pos in sala["estado"].items():
-            dist = math.hypot(pos["x"] - sala["estrella_actual"]["x"], pos["y"] - sala["estrella_actual"]["y"])
-            radio_recogida = (TAMAÑO_JUGADOR + ESTRELLA_TAMAÑO) // 2
-            
-            if dist <= radio_recogida:
-                # El jugador recogió la estrella
-                print(f"Jugador {pid} recogió la estrella en sala {codigo_sala}! Invencible por {DURACION_INVENCIBILIDAD}s")
-                sala["jugadores_invencibles"][pid] = tiempo_actual + DURACION_INVENCIBILIDAD
-                sala["estrella_actual"] = None  # La estrella desaparece
-                break
+    return len(salas) < MAX_SALAS
+
+
+def traza_cliente_permitida(websocket: Any) -> bool:
+    """Cuenta una traza pedida por el cliente; False si están desactivadas o pasó su límite por minuto."""
+    conexion = conexiones.get(websocket)
+    if not PERMITIR_TRAZAS_CLIENTE or conexion is None:
+        return False
+    ahora = time.monotonic()
+    pedidas = conexion.setdefault("trazas_cliente", {"ventana": ahora, "cantidad": 0})
+    if ahora - pedidas["ventana"] >= 60.0:
+        pedidas["ventana"] = ahora
+        pedidas["cantidad"] = 0
+    if pedidas["cantidad"] >= TRAZAS_CLIENTE_POR_MINUTO:
+        metricas.incrementar("trazas_cliente_rechazadas")
+        return False
+    pedidas["cantidad"] += 1
+    return True
+
+
+def iniciar_traza_mensaje(websocket: Any, datos: Dict[str, Any], mensaje: str,
+                          recibido: float, decodificado: float) -> int | None:
+    """
+    Decide si el mensaje se traza (con PERMITIR_TRAZAS_CLIENTE el cliente puede
+    pedirlo con un campo "traza" entero; si no, se muestrea) y registra su
+    recepción y decodificación. Devuelve el id de la traza o None.
+    """
+    traza = datos.get("traza")
+    if isinstance(traza, int) and not isinstance(traza, bool) and traza > 0 and traza_cliente_permitida(websocket):
+        # Los ids pedidos por el cliente se corren para no chocar con los muestreados
+        traza = 1_000_000_000 + traza
+    else:
+        traza = trazador.muestrear_mensaje()
+        if traza is None:
+            return None
+    trazador.nombrar(traza, f"{datos.get('tipo')} #{traza}")
+    trazador.instante(traza, "recibir", recibido, bytes=len(mensaje))
+    trazador.tramo(traza, "decodificar", recibido, decodificado)
+    return traza
 
 
 async def manejar_cliente(websocket: Any):
@@ -367,6 +2169,17 @@ async def manejar_cliente(websocket: Any):
     """
     global siguiente_player_id
     
+    # Rechazar conexiones por encima del límite (1013 = "intenta más tarde")
+    if len(conexiones) >= MAX_CONEXIONES:
+        metricas.incrementar("conexiones_rechazadas")
+        await websocket.close(1013, "Servidor ocupado, intenta más tarde")
+        return
+    
+    conexiones[websocket] = {
+        "conectado_en": time.time(),
+        "red": {},
+        "snapshots": snapshots.FlujoSnapshots(time.monotonic())
+    }
     print("Cliente conectado (esperando mensaje)")
     
     codigo_sala_actual = None  # Código de la sala a la que pertenece este cliente
@@ -374,15 +2187,34 @@ async def manejar_cliente(websocket: Any):
     try:
         # Escuchar mensajes del cliente en un loop
         async for mensaje in websocket:
+            traza = None
             try:
                 # Intentar interpretar el mensaje como JSON
+                recibido = time.perf_counter()
                 datos = json.loads(mensaje)
+                if trazador is not None:
+                    traza = iniciar_traza_mensaje(websocket, datos, mensaje, recibido, time.perf_counter())
                 print(f"Mensaje recibido: {datos}")
                 
+                # Los espectadores nunca envían mensajes de juego
+                if websocket in espectador_a_sala and datos.get("tipo") not in MENSAJES_ESPECTADOR:
+                    metricas.incrementar("mensajes_espectador_ignorados")
+                    continue
+                
                 # Procesar mensaje de tipo "crear_partida"
                 if datos.get("tipo") == "crear_partida":
+                    # Quien entra a una sala deja de esperar la partida rápida
+                    cola_emparejamiento.quitar(websocket)
                     nombre = datos.get("nombre", "Jugador")
                     
+                    # Respetar el presupuesto y el límite de salas del servidor
+                    motivo = motivo_sobrecarga()
+                    if motivo is None and not await liberar_cupo_salas():
+                        motivo = f"límite de {MAX_SALAS} salas"
+                    if motivo is not None:
+                        await rechazar_por_sobrecarga(websocket, motivo)
+                        continue
+                    
                     # Generar código único para la sala
                     codigo_sala = generar_codigo_sala()
                     codigo_sala_actual = codigo_sala
@@ -392,16 +2224,19 @@ async def manejar_cliente(websocket: Any):
                     siguiente_player_id += 1
                     
                     # Crear la estructura de la sala
-                    nueva_sala = crear_estructura_sala(player_id)
+                    nueva_sala = crear_estructura_sala(codigo_sala, player_id)
                     nueva_sala["jugadores"] = [websocket]
+                    nueva_sala["publica"] = datos.get("publica") is True
                     # Calcular índice de sprite basado en el orden dentro de la sala (1er jugador = 1, 2do = 2, etc.)
                     sprite_index = 1  # El primer jugador (host) usa sprite 1
                     
+                    token = crear_sesion(codigo_sala, player_id)
                     nueva_sala["jugadores_info"][websocket] = {
                         "id": player_id,
                         "nombre": nombre,
                         "es_host": True,
-                        "sprite_index": sprite_index
+                        "sprite_index": sprite_index,
+                        "token": token
                     }
                     nueva_sala["jugadores_listos"][player_id] = False
                     
@@ -409,11 +2244,14 @@ async def manejar_cliente(websocket: Any):
                     spawn_x, spawn_y = 200, 300
                     nueva_sala["estado"][player_id] = {"x": spawn_x, "y": spawn_y}
                     
-                    # Guardar la sala
+                    # Guardar la sala y programar su expiración en lobby
                     salas[codigo_sala] = nueva_sala
+                    programar_expiracion_sala(nueva_sala)
+                    indice_salas.actualizar(codigo_sala, resumen_sala_publica(nueva_sala))
                     
-                    # Mapear websocket a sala
+                    # Mapear websocket a sala (y dejar de explorar, si estaba explorando)
                     websocket_a_sala[websocket] = codigo_sala
+                    indice_salas.suscriptores.discard(websocket)
                     
                     print(f"Partida creada - Código: {codigo_sala} por: {nombre} (ID: {player_id}, HOST, Sprite: {sprite_index})")
                     
@@ -425,7 +2263,8 @@ async def manejar_cliente(websocket: Any):
                         "y": spawn_y,
                         "es_host": True,
                         "codigo_sala": codigo_sala,
-                        "sprite_index": sprite_index
+                        "sprite_index": sprite_index,
+                        "token_reanudacion": token
                     }
                     await websocket.send(json.dumps(mensaje_respuesta))
                     
@@ -437,6 +2276,7 @@ async def manejar_cliente(websocket: Any):
                 
                 # Procesar mensaje de tipo "unirse_partida"
                 elif datos.get("tipo") == "unirse_partida":
+                    cola_emparejamiento.quitar(websocket)
                     nombre = datos.get("nombre", "Jugador")
                     codigo_ingresado = datos.get("codigo_sala", "").upper().strip()
                     
@@ -459,6 +2299,21 @@ async def manejar_cliente(websocket: Any):
                         }))
                         continue
                     
+                    # Si la sala está llena, rechazar
+                    if len(sala["jugadores"]) >= MAX_JUGADORES_POR_SALA:
+                        metricas.incrementar("rechazos_sala_llena")
+                        await websocket.send(json.dumps({
+                            "tipo": "error",
+                            "mensaje": "La sala está llena"
+                        }))
+                        continue
+                    
+                    # Si el servidor está sobrecargado, no aceptar más jugadores
+                    motivo = motivo_sobrecarga()
+                    if motivo is not None:
+                        await rechazar_por_sobrecarga(websocket, motivo)
+                        continue
+                    
                     # Asignar un player_id único
                     player_id = siguiente_player_id
                     siguiente_player_id += 1
@@ -471,16 +2326,20 @@ async def manejar_cliente(websocket: Any):
                     # Agregar jugador a la sala
                     sala["jugadores"].append(websocket)
                     
+                    token = crear_sesion(codigo_ingresado, player_id)
                     sala["jugadores_info"][websocket] = {
                         "id": player_id,
                         "nombre": nombre,
                         "es_host": False,
-                        "sprite_index": sprite_index
+                        "sprite_index": sprite_index,
+                        "token": token
                     }
                     sala["jugadores_listos"][player_id] = False
+                    invalidar_estado_sala(sala)
                     
-                    # Mapear websocket a sala
+                    # Mapear websocket a sala (y dejar de explorar, si estaba explorando)
                     websocket_a_sala[websocket] = codigo_ingresado
+                    indice_salas.suscriptores.discard(websocket)
                     
                     print(f"Jugador se unió - Código: {codigo_ingresado}, Nombre: {nombre} (ID: {player_id}, Sprite: {sprite_index})")
                     
@@ -504,7 +2363,8 @@ async def manejar_cliente(websocket: Any):
                         "y": spawn_y,
                         "es_host": False,
                         "codigo_sala": codigo_ingresado,
-                        "sprite_index": sprite_index
+                        "sprite_index": sprite_index,
+                        "token_reanudacion": token
                     }
                     await websocket.send(json.dumps(mensaje_respuesta))
                     
@@ -529,7 +2389,9 @@ async def manejar_cliente(websocket: Any):
                     
                     info_jugador = sala["jugadores_info"][websocket]
                     if info_jugador["id"] == player_id_ready:
-                        sala["jugadores_listos"][player_id_ready] = bool(listo)
+                        if sala["jugadores_listos"].get(player_id_ready) != bool(listo):
+                            sala["jugadores_listos"][player_id_ready] = bool(listo)
+                            invalidar_estado_sala(sala)
                         print(f"Jugador {player_id_ready} cambió estado listo a {listo}")
                         
                         # Avisar a todos los jugadores de esta sala cómo está
@@ -597,56 +2459,141 @@ async def manejar_cliente(websocket: Any):
                             }))
                             continue
                         
-                        # Resetear puntuación y posiciones en esta sala
-                        # Distribuir posiciones iniciales de manera equilibrada
-                        num_jugadores = len(ids_actuales)
-                        for idx, pid in enumerate(ids_actuales):
-                            sala["puntuacion"][pid] = 0
-                            # Distribuir jugadores en diferentes posiciones según el número total
-                            if num_jugadores == 2:
-                                if idx == 0:
-                                    sala["estado"][pid] = {"x": 200, "y": 300}
-                                else:
-                                    sala["estado"][pid] = {"x": 600, "y": 300}
-                            elif num_jugadores == 3:
-                                if idx == 0:
-                                    sala["estado"][pid] = {"x": 200, "y": 300}
-                                elif idx == 1:
-                                    sala["estado"][pid] = {"x": 600, "y": 300}
-                                else:
-                                    # Tercer jugador: esquina inferior, lejos de obstáculos
-                                    sala["estado"][pid] = {"x": 400, "y": 450}
-                            else:  # 4 o más jugadores
-                                if idx == 0:
-                                    sala["estado"][pid] = {"x": 200, "y": 300}
-                                elif idx == 1:
-                                    sala["estado"][pid] = {"x": 600, "y": 300}
-                                elif idx == 2:
-                                    # Evitar cactus en (150, 150) - poner más abajo
-                                    sala["estado"][pid] = {"x": 200, "y": 450}
-                                else:
-                                    # Evitar cactus en (650, 450) - poner más arriba
-                                    sala["estado"][pid] = {"x": 600, "y": 150}
-                        
-                        # Limpiar balas y estrellas de esta sala
-                        sala["balas"].clear()
-                        sala["estrella_actual"] = None
-                        sala["jugadores_invencibles"].clear()
-                        sala["ultima_estrella_tiempo"] = 0.0
-                        
-                        # Cambiar estado de partida de esta sala
-                        sala["estado_partida"] = "jugando"
-                        
-                        print(f"Partida iniciada por el host (ID: {sala['host_id']}) en sala {codigo_sala}")
-                        
-                        # Avisar a todos los jugadores de esta sala que empieza la partida
-                        await enviar_evento_a_sala(codigo_sala, {
-                            "tipo": "start_game",
-                            "estado_partida": sala["estado_partida"],
-                            "puntuacion": sala["puntuacion"]
-                        })
-                        # Y mandar un estado inicial
-                        await enviar_estado_a_sala(codigo_sala)
+                        # Todo en orden: empezar la partida
+                        await comenzar_partida(codigo_sala)
+                
+                # Procesar mensaje de "agregar_bot" (solo el host, en el lobby)
+                elif datos.get("tipo") == "agregar_bot":
+                    codigo_sala = obtener_sala_de_websocket(websocket)
+                    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+                    if not sala or websocket not in sala["jugadores_info"]:
+                        continue
+                    
+                    if sala["jugadores_info"][websocket]["id"] != sala["host_id"]:
+                        await websocket.send(json.dumps({
+                            "tipo": "error",
+                            "mensaje": "Solo el host puede agregar bots"
+                        }))
+                        continue
+                    if sala["estado_partida"] != "lobby":
+                        continue
+                    if len(sala["jugadores"]) >= MAX_JUGADORES_POR_SALA:
+                        await websocket.send(json.dumps({
+                            "tipo": "error",
+                            "mensaje": "La sala está llena"
+                        }))
+                        continue
+                    
+                    # Los bots también cuestan CPU: respetar el control de admisión
+                    motivo = motivo_sobrecarga()
+                    if motivo is not None:
+                        await rechazar_por_sobrecarga(websocket, motivo)
+                        continue
+                    
+                    bot = registrar_bot(sala)
+                    print(f"Bot agregado a sala {codigo_sala} (ID: {bot.player_id})")
+                    await enviar_estado_sala_a_sala(codigo_sala)
+                    await enviar_estado_a_sala(codigo_sala)
+                
+                # Procesar mensaje de "quitar_bot" (solo el host, en el lobby)
+                elif datos.get("tipo") == "quitar_bot":
+                    codigo_sala = obtener_sala_de_websocket(websocket)
+                    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+                    if not sala or websocket not in sala["jugadores_info"]:
+                        continue
+                    
+                    bot = sala["bots"].get(datos.get("bot_id"))
+                    es_host = sala["jugadores_info"][websocket]["id"] == sala["host_id"]
+                    if bot is None or not es_host or sala["estado_partida"] != "lobby":
+                        continue
+                    await retirar_jugador_de_sala(codigo_sala, bot.conexion)
+                
+                # Elegir el modo de la partida (solo el host, en el lobby)
+                elif datos.get("tipo") == "modo_duelo":
+                    codigo_sala = obtener_sala_de_websocket(websocket)
+                    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+                    if not sala or websocket not in sala["jugadores_info"]:
+                        continue
+                    
+                    es_host = sala["jugadores_info"][websocket]["id"] == sala["host_id"]
+                    if not es_host or sala["estado_partida"] != "lobby":
+                        continue
+                    sala["modo"] = "duelo" if datos.get("activo") else "normal"
+                    invalidar_estado_sala(sala)
+                    await enviar_estado_sala_a_sala(codigo_sala)
+                
+                # El host publica la sala en el explorador (o la vuelve privada)
+                elif datos.get("tipo") == "sala_publica":
+                    codigo_sala = obtener_sala_de_websocket(websocket)
+                    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+                    if not sala or websocket not in sala["jugadores_info"]:
+                        continue
+                    
+                    es_host = sala["jugadores_info"][websocket]["id"] == sala["host_id"]
+                    if not es_host or sala["estado_partida"] != "lobby":
+                        continue
+                    sala["publica"] = datos.get("publica") is True
+                    invalidar_estado_sala(sala)
+                    await enviar_estado_sala_a_sala(codigo_sala)
+                
+                # Explorar las salas públicas: una página ahora y después solo los cambios
+                elif datos.get("tipo") == "explorar_salas":
+                    if obtener_sala_de_websocket(websocket):
+                        continue  # Quien ya está en una sala no explora
+                    
+                    pagina = datos.get("pagina", 0)
+                    por_pagina = datos.get("por_pagina", TAMAÑO_PAGINA_EXPLORADOR)
+                    if not isinstance(pagina, int) or pagina < 0:
+                        pagina = 0
+                    if not isinstance(por_pagina, int) or por_pagina < 1:
+                        por_pagina = TAMAÑO_PAGINA_EXPLORADOR
+                    por_pagina = min(por_pagina, MAX_TAMAÑO_PAGINA_EXPLORADOR)
+                    
+                    indice_salas.suscriptores.add(websocket)
+                    await websocket.send(json.dumps(indice_salas.pagina(pagina, por_pagina)))
+                
+                elif datos.get("tipo") == "dejar_explorar":
+                    indice_salas.suscriptores.discard(websocket)
+                
+                # Partida rápida: esperar en la cola hasta que el emparejador arme una sala
+                elif datos.get("tipo") == "quick_play":
+                    if obtener_sala_de_websocket(websocket):
+                        continue  # Ya está en una sala
+                    
+                    motivo = motivo_sobrecarga()
+                    if motivo is not None:
+                        await rechazar_por_sobrecarga(websocket, motivo)
+                        continue
+                    
+                    indice_salas.suscriptores.discard(websocket)
+                    posicion = cola_emparejamiento.agregar(
+                        websocket, datos.get("nombre", "Jugador"), time.monotonic()
+                    )
+                    await websocket.send(json.dumps({
+                        "tipo": "en_cola",
+                        "posicion": posicion,
+                        "en_cola": len(cola_emparejamiento)
+                    }))
+                
+                elif datos.get("tipo") == "cancelar_quick_play":
+                    if cola_emparejamiento.quitar(websocket):
+                        await websocket.send(json.dumps({"tipo": "fuera_de_cola"}))
+                
+                # Entradas de un jugador en un duelo (un mensaje puede traer varios frames)
+                elif datos.get("tipo") == "entrada":
+                    codigo_sala = obtener_sala_de_websocket(websocket)
+                    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+                    if not sala or sala["duelo"] is None or websocket not in sala["jugadores_info"]:
+                        continue
+                    await procesar_entrada_duelo(sala, websocket, datos)
+                
+                # El cliente detectó que su simulación no coincide con la del servidor
+                elif datos.get("tipo") == "resincronizar_duelo":
+                    codigo_sala = obtener_sala_de_websocket(websocket)
+                    sala = obtener_info_sala(codigo_sala) if codigo_sala else None
+                    if not sala or sala["duelo"] is None or websocket not in sala["jugadores_info"]:
+                        continue
+                    await resincronizar_duelo(sala, "pedido por un cliente")
                 
                 # Procesar mensaje de disparo (solo en estado "jugando")
                 elif datos.get("tipo") == "shoot":
@@ -658,8 +2605,8 @@ async def manejar_cliente(websocket: Any):
                     if not sala or websocket not in sala["jugadores_info"]:
                         continue
                     
-                    # Solo permitir disparos si la sala está jugando
-                    if sala["estado_partida"] != "jugando":
+                    # Solo permitir disparos si la sala está jugando (en un duelo se disparan con las entradas)
+                    if sala["estado_partida"] != "jugando" or sala["duelo"] is not None:
                         continue
                     
                     player_id_shoot = datos.get("player_id")
@@ -668,49 +2615,11 @@ async def manejar_cliente(websocket: Any):
                     
                     # Verificar si el jugador está registrado
                     if info_jugador["id"] == player_id_shoot:
-                        # Verificar si el jugador ya tiene una bala activa en esta sala
-                        tiene_bala_activa = any(
-                            bala_info["player_id"] == player_id_shoot
-                            for bala_info in sala["balas"].values()
-                        )
-                        
-                        if tiene_bala_activa:
-                            print(f"Disparo ignorado - Jugador {player_id_shoot} ya tiene una bala activa")
-                        elif player_id_shoot in sala["estado"]:
-                            # Obtener posición actual del jugador
-                            jugador_pos = sala["estado"][player_id_shoot]
-                            bala_x = jugador_pos["x"]
-                            bala_y = jugador_pos["y"]
-                            
-                            # Velocidad de la bala
-                            velocidad_bala = 10
-                            
-                            # Calcular velocidad según dirección
-                            if direccion == "up":
-                                vx, vy = 0, -velocidad_bala
-                            elif direccion == "down":
-                                vx, vy = 0, velocidad_bala
-                            elif direccion == "left":
-                                vx, vy = -velocidad_bala, 0
-                            elif direccion == "right":
-                                vx, vy = velocidad_bala, 0
-                            else:
-                                vx, vy = 0, -velocidad_bala  # Por defecto hacia arriba
-                            
-                            # Crear nueva bala en esta sala
-                            bala_id = sala["siguiente_bala_id"]
-                            sala["siguiente_bala_id"] += 1
-                            
-                            sala["balas"][bala_id] = {
-                                "x": bala_x,
-                                "y": bala_y,
-                                "vx": vx,
-                                "vy": vy,
-                                "player_id": player_id_shoot
-                            }
-                            
-                            print(f"Bala creada - Jugador {info_jugador['nombre']} (ID: {player_id_shoot}) disparó hacia {direccion} en sala {codigo_sala}")
-                            
+                        if crear_bala(sala, player_id_shoot, direccion):
+                            if traza is not None:
+                                # La bala lleva la traza del disparo hasta que desaparece
+                                sala["balas"][sala["siguiente_bala_id"] - 1]["traza"] = traza
+                                sala["trazas"].add(traza)
                             # Actualizar estado de balas de esta sala
                             await actualizar_balas_sala(codigo_sala)
                             # Enviar estado inmediatamente para disparos
@@ -728,13 +2637,18 @@ async def manejar_cliente(websocket: Any):
                     if not sala:
                         continue
                     
-                    # Solo permitir actualizaciones de posición si la sala está jugando
-                    if sala["estado_partida"] != "jugando":
+                    # Solo permitir actualizaciones de posición si la sala está jugando (y no es un duelo)
+                    if sala["estado_partida"] != "jugando" or sala["duelo"] is not None:
                         continue
                     
                     player_id = datos.get("player_id")
                     x = datos.get("x")
                     y = datos.get("y")
+                    posicion = posicion_valida(x, y)
+                    if posicion is None:
+                        metricas.incrementar("posiciones_invalidas")
+                        continue
+                    x, y = posicion
                     
                     # Verificar si el jugador está registrado en esta sala
                     if websocket in sala["jugadores_info"]:
@@ -742,12 +2656,112 @@ async def manejar_cliente(websocket: Any):
                         if info_jugador["id"] == player_id:
                             # Actualizar el estado del jugador en esta sala
                             sala["estado"][player_id] = {"x": x, "y": y}
+                            if sala["analitica"] is not None:
+                                sala["analitica"].posicion(player_id, x, y, time.monotonic())
                         else:
                             print(f"⚠️ Posición recibida con ID incorrecto. WebSocket tiene ID {info_jugador['id']}, pero mensaje dice {player_id}")
                     else:
                         print(f"⚠️ Posición recibida de websocket no registrado en sala {codigo_sala} (ID: {player_id}): ({x}, {y})")
                         print(f"   Jugadores registrados: {list(sala['jugadores_info'].keys())}")
                     
+                # Procesar reanudación de sesión tras un corte
+                elif datos.get("tipo") == "reanudar":
+                    cola_emparejamiento.quitar(websocket)
+                    if obtener_sala_de_websocket(websocket):
+                        continue  # Esta conexión ya está en una sala
+                    
+                    if not await reanudar_sesion(websocket, str(datos.get("token", ""))):
+                        await websocket.send(json.dumps({
+                            "tipo": "error",
+                            "codigo": "reanudacion_invalida",
+                            "mensaje": "No se pudo reanudar la sesión"
+                        }))
+                
+                # Procesar suscripción como espectador
+                elif datos.get("tipo") == "espectar":
+                    cola_emparejamiento.quitar(websocket)
+                    if obtener_sala_de_websocket(websocket):
+                        continue  # Un jugador no puede ser espectador a la vez
+                    
+                    codigo_ingresado = str(datos.get("codigo_sala", "")).upper()
+                    await agregar_espectador(websocket, codigo_ingresado)
+                
+                # Negociación del canal UDP: se entrega el puerto y un token propio del canal
+                elif datos.get("tipo") == "solicitar_udp":
+                    if protocolo_udp is None or not obtener_sala_de_websocket(websocket):
+                        continue
+                    canal = conexiones[websocket].get("udp")
+                    if canal is None:
+                        canal = conexiones[websocket]["udp"] = {
+                            "token": secrets.token_urlsafe(16),
+                            "direccion": None,
+                            "activo": False,
+                            "ultimo_recibido": time.monotonic(),
+                            "ultima_seq": -1
+                        }
+                        canales_udp[canal["token"]] = websocket
+                    await websocket.send(json.dumps({
+                        "tipo": "udp_disponible",
+                        "puerto": PUERTO_UDP,
+                        "token": canal["token"]
+                    }))
+                
+                # El cliente confirma que recibe datagramas (o avisa que dejó de recibirlos)
+                elif datos.get("tipo") == "usar_udp":
+                    canal = conexiones[websocket].get("udp")
+                    if canal is None:
+                        continue
+                    if datos.get("activo") and canal["direccion"] is not None:
+                        canal["activo"] = True
+                        canal["ultimo_recibido"] = time.monotonic()
+                        metricas.incrementar("canales_udp_activados")
+                        print(f"Canal UDP activo hacia {canal['direccion']}")
+                    else:
+                        desactivar_udp(websocket, "pedido por el cliente")
+
+                # El cliente declara cuántos snapshots por segundo quiere y cuántos bytes por segundo le caben
+                elif datos.get("tipo") == "config_snapshots":
+                    tasa, presupuesto = conexiones[websocket]["snapshots"].configurar(
+                        datos.get("tasa"), datos.get("presupuesto")
+                    )
+                    metricas.incrementar("config_snapshots")
+                    await websocket.send(json.dumps({
+                        "tipo": "config_snapshots",
+                        "tasa": tasa,
+                        "presupuesto": presupuesto
+                    }))
+
+                # Consulta del ranking: se responde de inmediato desde memoria
+                elif datos.get("tipo") == "ranking":
+                    limite = datos.get("limite")
+                    if not isinstance(limite, int) or limite <= 0:
+                        limite = None
+                    await websocket.send(json.dumps({
+                        "tipo": "ranking",
+                        "jugadores": ranking.consultar(limite)
+                    }))
+                
+                # Procesar ping de sincronización de reloj (se responde de inmediato, fuera del lote)
+                elif datos.get("tipo") == "ping":
+                    await websocket.send(json.dumps({
+                        "tipo": "pong",
+                        "id": datos.get("id"),
+                        "t_cliente": datos.get("t_cliente"),
+                        "t_servidor": time.monotonic(),
+                        "tick": numero_tick
+                    }))
+                    
+                    # Guardar lo que el cliente ha medido de su conexión
+                    red = conexiones[websocket]["red"]
+                    for clave in ("rtt", "jitter", "desfase"):
+                        if isinstance(datos.get(clave), (int, float)):
+                            red[clave] = datos[clave]
+                    if "rtt" in red:
+                        metricas.observar("rtt_clientes", red["rtt"])
+                    latencia = getattr(websocket, "latency", None)
+                    if latencia:
+                        red["latencia_keepalive"] = latencia
+                
                 else:
                     # Para otros tipos de mensajes, reenviar a todos los jugadores de la misma sala
                     codigo_sala = obtener_sala_de_websocket(websocket)
@@ -767,6 +2781,9 @@ async def manejar_cliente(websocket: Any):
                 print(f"Error: Mensaje no es JSON válido: {mensaje}")
             except Exception as e:
                 print(f"Error al procesar mensaje: {e}")
+            finally:
+                if traza is not None:
+                    trazador.tramo(traza, "manejar", recibido, time.perf_counter(), tipo=datos.get("tipo"))
                 
     except websockets.exceptions.ConnectionClosed:
         # El cliente se desconectó normalmente
@@ -774,185 +2791,689 @@ async def manejar_cliente(websocket: Any):
     except Exception as e:
         print(f"Error en la conexión: {e}")
     finally:
+        cerrar_canal_udp(websocket)
+        conexiones.pop(websocket, None)
+        indice_salas.suscriptores.discard(websocket)
+        cola_emparejamiento.quitar(websocket)
+        
         # Remover el jugador de la sala cuando se desconecta
         codigo_sala_desconexion = obtener_sala_de_websocket(websocket)
         
-        if codigo_sala_desconexion:
-            sala = obtener_info_sala(codigo_sala_desconexion)
-            if sala and websocket in sala["jugadores_info"]:
-                jugador_info = sala["jugadores_info"][websocket]
-                player_id = jugador_info["id"]
-                nombre = jugador_info.get("nombre", "Desconocido")
-                print(f"Jugador desconectado: {nombre} (ID: {player_id}) de sala {codigo_sala_desconexion}")
-                
-                # Remover el jugador de la sala (ya sea host o no)
-                if player_id == sala["host_id"]:
-                    # Si es el host, verificar si hay partida en curso
-                    if sala["estado_partida"] == "jugando":
-                        # Si está en partida, remover al host como a cualquier jugador
-                        if websocket in sala["jugadores"]:
-                            sala["jugadores"].remove(websocket)
-                        if websocket in sala["jugadores_info"]:
-                            del sala["jugadores_info"][websocket]
-                        if player_id in sala["estado"]:
-                            del sala["estado"][player_id]
-                        if player_id in sala["jugadores_listos"]:
-                            del sala["jugadores_listos"][player_id]
-                        if player_id in sala["puntuacion"]:
-                            del sala["puntuacion"][player_id]
-                        if player_id in sala["jugadores_invencibles"]:
-                            del sala["jugadores_invencibles"][player_id]
-                        
-                        # Remover mapeo de websocket a sala
-                        if websocket in websocket_a_sala:
-                            del websocket_a_sala[websocket]
-                        
-                        # Verificar si solo queda un jugador
-                        if len(sala["jugadores"]) == 1:
-                            # El jugador restante gana por abandono
-                            jugador_restante_ws = sala["jugadores"][0]
-                            jugador_restante_info = sala["jugadores_info"].get(jugador_restante_ws)
-                            if jugador_restante_info:
-                                jugador_restante_id = jugador_restante_info["id"]
-                                jugador_restante_nombre = jugador_restante_info.get("nombre", "Desconocido")
-                                print(f"Host desconectado. Jugador {jugador_restante_nombre} (ID: {jugador_restante_id}) gana por abandono en sala {codigo_sala_desconexion}")
-                                
-                                sala["estado_partida"] = "game_over"
-                                
-                                await enviar_evento_a_sala(codigo_sala_desconexion, {
-                                    "tipo": "game_over",
-                                    "ganador": jugador_restante_id,
-                                    "puntuacion": sala["puntuacion"],
-                                    "motivo": "abandono"
-                                })
-                                # Enviar estado final
-                                await enviar_estado_a_sala(codigo_sala_desconexion)
-                        else:
-                            # Si quedan más jugadores, eliminar la sala
-                            print(f"El host se desconectó durante partida con múltiples jugadores, eliminando sala {codigo_sala_desconexion}")
-                            del salas[codigo_sala_desconexion]
-                            # Limpiar mapeo de websockets de esta sala
-                            for ws in sala["jugadores"]:
-                                if ws in websocket_a_sala:
-                                    del websocket_a_sala[ws]
-                    else:
-                        # Si está en lobby, eliminar toda la sala
-                        print(f"El host se desconectó, eliminando sala {codigo_sala_desconexion}")
-                        del salas[codigo_sala_desconexion]
-                        # Limpiar mapeo de websockets de esta sala
-                        for ws in sala["jugadores"]:
-                            if ws in websocket_a_sala:
-                                del websocket_a_sala[ws]
-                else:
-                    # Remover el jugador de la sala
-                    if websocket in sala["jugadores"]:
-                        sala["jugadores"].remove(websocket)
-                    if websocket in sala["jugadores_info"]:
-                        del sala["jugadores_info"][websocket]
-                    if player_id in sala["estado"]:
-                        del sala["estado"][player_id]
-                    if player_id in sala["jugadores_listos"]:
-                        del sala["jugadores_listos"][player_id]
-                    if player_id in sala["puntuacion"]:
-                        del sala["puntuacion"][player_id]
-                    if player_id in sala["jugadores_invencibles"]:
-                        del sala["jugadores_invencibles"][player_id]
-                    
-                    # Remover mapeo de websocket a sala
-                    if websocket in websocket_a_sala:
-                        del websocket_a_sala[websocket]
-                    
-                    # Verificar si solo queda un jugador en una partida en curso
-                    if sala["estado_partida"] == "jugando" and len(sala["jugadores"]) == 1:
-                        # El jugador restante gana por abandono
-                        jugador_restante_ws = sala["jugadores"][0]
-                        jugador_restante_info = sala["jugadores_info"].get(jugador_restante_ws)
-                        if jugador_restante_info:
-                            jugador_restante_id = jugador_restante_info["id"]
-                            jugador_restante_nombre = jugador_restante_info.get("nombre", "Desconocido")
-                            print(f"Jugador {jugador_restante_nombre} (ID: {jugador_restante_id}) gana por abandono en sala {codigo_sala_desconexion}")
-                            
-                            sala["estado_partida"] = "game_over"
-                            
-                            await enviar_evento_a_sala(codigo_sala_desconexion, {
-                                "tipo": "game_over",
-                                "ganador": jugador_restante_id,
-                                "puntuacion": sala["puntuacion"],
-                                "motivo": "abandono"
-                            })
-                    
-                    # Notificar a los demás jugadores de la sala del cambio de estado
-                    if sala["jugadores"]:
-                        await enviar_estado_sala_a_sala(codigo_sala_desconexion)
-                        await enviar_estado_a_sala(codigo_sala_desconexion)
+        sala_desconexion = obtener_info_sala(codigo_sala_desconexion) if codigo_sala_desconexion else None
+        if websocket in espectador_a_sala:
+            retirar_espectador(websocket)
+            print("Espectador desconectado")
+        elif sala_desconexion and sala_desconexion["estado_partida"] == "jugando":
+            # En plena partida se reserva el lugar para que pueda reanudar
+            await suspender_jugador(codigo_sala_desconexion, websocket)
+        elif codigo_sala_desconexion:
+            await retirar_jugador_de_sala(codigo_sala_desconexion, websocket)
         else:
             print("Cliente desconectado (no estaba en ninguna sala)")
 
 
-async def loop_generar_estrellas():
-    """Loop que genera estrellas periódicamente para todas las salas."""
+async def loop_temporizadores():
+    """
+    Loop que avanza la rueda de temporizadores y ejecuta solo los eventos vencidos
+    (estrellas, fin de invencibilidad, expiración de salas).
+    """
     while True:
-        tiempo_actual = time.time()
-        
-        # Iterar sobre todas las salas activas
-        for codigo_sala, sala in list(salas.items()):
-            if sala["estado_partida"] == "jugando":
-                # Si no hay estrella y ha pasado suficiente tiempo desde la última
-                if sala["estrella_actual"] is None and (tiempo_actual - sala["ultima_estrella_tiempo"]) >= TIEMPO_ENTRE_ESTRELLAS:
-                    pos = generar_posicion_estrella()
-                    if pos is not None:
-                        sala["estrella_actual"] = {
-                            "x": pos[0],
-                            "y": pos[1],
-                            "tiempo_creacion": tiempo_actual
-                        }
-                        sala["ultima_estrella_tiempo"] = tiempo_actual
-                        print(f"Nueva estrella generada en sala {codigo_sala} en ({pos[0]:.1f}, {pos[1]:.1f})")
-                elif sala["estrella_actual"] is not None:
-                    # Actualizar detección de recogida para esta sala
-                    await actualizar_estrellas_sala(codigo_sala)
+        for temporizador in rueda_temporizadores.avanzar(time.monotonic()):
+            try:
+                resultado = temporizador.callback(*temporizador.args)
+                if asyncio.iscoroutine(resultado):
+                    await resultado
+            except Exception as e:
+                print(f"Error en temporizador {temporizador.callback.__name__}: {e}")
         
-        await asyncio.sleep(0.1)  # Revisar cada 100ms
+        await asyncio.sleep(RESOLUCION_TEMPORIZADORES)
 
 
 async def loop_actualizacion_balas():
     """
     Loop que actualiza las balas periódicamente para todas las salas activas.
-    Durante la partida: ~60 FPS para movimiento fluido.
+    Durante la partida: ~60 FPS para movimiento fluido. Con el servidor
+    sobrecargado, el nivel de calidad decide cada cuánto se envía el estado y
+    si la simulación avanza varios ticks por vuelta.
     """
+    global numero_tick
+    
     while True:
+        inicio_tick = time.perf_counter()
+        nivel = control_calidad.config
+        pasos = nivel["pasos"]
+        # El número de tick sigue contando ticks de 1/60s aunque se simulen varios por vuelta
+        numero_tick += pasos
+        trazar_tick = trazador is not None and trazador.muestrear_tick()
+        
+        # Los bots deciden y se mueven antes de avanzar las balas
+        actualizar_bots(pasos)
+        fin_bots = time.perf_counter()
+        
         # Iterar sobre todas las salas activas
         for codigo_sala, sala in list(salas.items()):
             if sala["estado_partida"] == "jugando":
+                if sala["duelo"] is not None:
+                    # Un duelo avanza con las entradas de los jugadores, no con el tick
+                    continue
                 # Actualizar balas de esta sala si existen
                 if sala["balas"]:
-                    await actualizar_balas_sala(codigo_sala)
+                    await actualizar_balas_sala(codigo_sala, pasos)
+                # Detectar recogida de la estrella si hay una activa
+                if sala["estrella_actual"] is not None:
+                    await actualizar_estrellas_sala(codigo_sala)
             # Enviar estado frecuentemente durante partida
-                await enviar_estado_a_sala(codigo_sala)
+                if toca_estado(codigo_sala, nivel["partida"], pasos):
+                    await enviar_estado_a_sala(codigo_sala)
             elif sala["estado_partida"] in ["lobby", "game_over"]:
                 # En lobby/game_over, enviar estado periódicamente
-                await enviar_estado_a_sala(codigo_sala)
+                if toca_estado(codigo_sala, nivel["lobby"], pasos):
+                    await enviar_estado_a_sala(codigo_sala)
+        fin_salas = time.perf_counter()
+        
+        # Enviar todo lo que produjo el tick: un frame por jugador
+        await vaciar_salidas()
+        fin_envio = time.perf_counter()
+        
+        # Publicar el tick para los lectores de telemetría (solo copia memoria)
+        if publicador_telemetria is not None:
+            try:
+                publicar_telemetria()
+            except Exception as e:
+                # La telemetría es para procesos externos: un error no puede frenar el tick
+                metricas.incrementar("errores_telemetria")
+                print(f"Error al publicar telemetría: {e}")
+        
+        # Medir cuánto del tick se usó en trabajo (señal de salud)
+        intervalo = INTERVALO_TICK * pasos
+        fin_tick = time.perf_counter()
+        duracion_tick = fin_tick - inicio_tick
+        if trazar_tick:
+            fila = trazas.FILA_TICKS
+            trazador.tramo(fila, "tick", inicio_tick, fin_tick, tick=numero_tick, nivel=nivel["nombre"])
+            trazador.tramo(fila, "bots", inicio_tick, fin_bots)
+            trazador.tramo(fila, "salas", fin_bots, fin_salas, salas=len(salas))
+            trazador.tramo(fila, "enviar", fin_salas, fin_envio)
+            trazador.tramo(fila, "telemetria", fin_envio, fin_tick)
+        if duracion_tick > intervalo:
+            metricas.incrementar("ticks_excedidos")
+        actualizar_salud("uso_tick", duracion_tick / intervalo)
+        metricas.observar("duracion_tick", duracion_tick)
+        # Objetos nuevos desde el tick anterior (incluye lo que crearon los mensajes en el medio)
+        metricas.observar("objetos_por_tick", control_gc.contar_objetos())
+        
+        # Ajustar el nivel de calidad para las próximas vueltas
+        transicion = control_calidad.actualizar(salud["uso_tick"], salud["lag_loop"], time.monotonic())
+        if transicion is not None:
+            registrar_transicion_calidad(transicion)
+        
+        # Recolectar en el hueco que queda hasta el próximo tick (modo diferido), no en medio de uno
+        control_gc.recolectar_en_hueco(intervalo - duracion_tick - MARGEN_GC, time.monotonic())
+        
+        espera = intervalo - (time.perf_counter() - inicio_tick)
+        await asyncio.sleep(max(0.0, espera))  # ~60 FPS (menos con la simulación degradada)
+
+
+async def loop_transmision():
+    """
+    Loop que genera la transmisión de espectadores a baja frecuencia
+    (un frame codificado por sala, sin importar cuántos espectadores tenga).
+    """
+    while True:
+        ahora = time.monotonic()
+        for sala in list(salas.values()):
+            if sala["espectadores"]:
+                transmitir_sala(sala, ahora)
+        # Con el servidor sobrecargado los espectadores son de los primeros en recibir menos
+        await asyncio.sleep(INTERVALO_TRANSMISION * control_calidad.config["transmision"])
+
+
+async def loop_explorador():
+    """
+    Loop que avisa a quienes exploran los cambios del índice de salas públicas:
+    un solo mensaje codificado por intervalo, sin importar cuántos exploren.
+    """
+    while True:
+        await asyncio.sleep(INTERVALO_EXPLORADOR)
+        cambios = indice_salas.tomar_cambios()
+        if cambios is None or not indice_salas.suscriptores:
+            continue
+        mensaje = json.dumps(cambios)
+        websockets.broadcast(indice_salas.suscriptores, mensaje)
+        metricas.incrementar("cambios_explorador")
+        metricas.incrementar("bytes_explorador", len(mensaje) * len(indice_salas.suscriptores))
+
+
+async def loop_limpieza_salas():
+    """Loop que libera periódicamente salas abandonadas y conexiones muertas."""
+    while True:
+        await asyncio.sleep(INTERVALO_LIMPIEZA)
+        
+        liberado = await recolectar_salas()
+        if any(liberado.values()):
+            resumen = ", ".join(f"{clave}={cantidad}" for clave, cantidad in liberado.items() if cantidad)
+            totales = ", ".join(f"{clave}={cantidad}" for clave, cantidad in estadisticas_limpieza.items())
+            print(f"Limpieza: liberado {resumen} (totales: {totales}; salas activas: {len(salas)})")
+
+
+async def loop_canales_udp():
+    """
+    Loop que vuelve al WebSocket a los canales UDP que dejaron de recibir datagramas
+    del cliente (latidos o posiciones) y le avisa al cliente.
+    """
+    while True:
+        await asyncio.sleep(INTERVALO_REVISION_UDP)
+        ahora = time.monotonic()
+        activos = 0
+        for websocket, datos in list(conexiones.items()):
+            canal = datos.get("udp")
+            if canal is None or not canal["activo"]:
+                continue
+            if ahora - canal["ultimo_recibido"] > TIMEOUT_UDP:
+                desactivar_udp(websocket, f"{TIMEOUT_UDP}s sin datagramas")
+                try:
+                    await websocket.send(json.dumps({"tipo": "udp_cerrado", "motivo": "sin datagramas"}))
+                except websockets.exceptions.ConnectionClosed:
+                    pass
+            else:
+                activos += 1
+        metricas.fijar("canales_udp_activos", activos)
+
+
+async def loop_medir_lag():
+    """Loop que mide cuánto se retrasa el event loop respecto a lo programado."""
+    while True:
+        esperado = time.perf_counter() + INTERVALO_MEDICION_LAG
+        await asyncio.sleep(INTERVALO_MEDICION_LAG)
+        actualizar_salud("lag_loop", max(0.0, time.perf_counter() - esperado))
+
+
+def serializar_sala(sala: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copia compacta del estado de una sala para el checkpoint (sin conexiones,
+    temporizadores ni salida pendiente). Las copias permiten escribirla en otro hilo.
+    """
+    return {
+        "codigo_sala": sala["codigo_sala"],
+        "host_id": sala["host_id"],
+        "estado_partida": sala["estado_partida"],
+        "creada_en": sala["creada_en"],
+        "estado_desde": sala["estado_desde"],
+        "jugadores": [
+            {
+                "id": info["id"],
+                "nombre": info["nombre"],
+                "es_host": info["es_host"],
+                "sprite_index": info["sprite_index"],
+                "token": info["token"],
+                "es_bot": info.get("es_bot", False)
+            }
+            for info in sala["jugadores_info"].values()
+        ],
+        "estado": {pid: dict(pos) for pid, pos in sala["estado"].items()},
+        # La traza de una bala no sobrevive al reinicio (el archivo de trazas es otro)
+        "balas": {
+            bala_id: {clave: valor for clave, valor in bala.items() if clave != "traza"}
+            for bala_id, bala in sala["balas"].items()
+        },
+        "puntuacion": dict(sala["puntuacion"]),
+        "jugadores_listos": dict(sala["jugadores_listos"]),
+        "estrella_actual": dict(sala["estrella_actual"]) if sala["estrella_actual"] else None,
+        "jugadores_invencibles": dict(sala["jugadores_invencibles"]),
+        "siguiente_bala_id": sala["siguiente_bala_id"],
+        "ultima_estrella_tiempo": sala["ultima_estrella_tiempo"],
+        "participantes": dict(sala["participantes"]),
+        "publica": sala["publica"],
+        "sala_de_bots": sala["sala_de_bots"],
+        "modo": sala["modo"],
+        "duelo": {
+            "ids": list(sala["duelo"]["ids"]),
+            "estado": sala["duelo"]["estado"].copiar().a_dict()
+        } if sala["duelo"] is not None else None
+    }
+
+
+def restaurar_sala(datos: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reconstruye una sala de un checkpoint. Todos sus jugadores quedan suspendidos
+    hasta que reanuden su sesión con el mismo token que tenían.
+    """
+    codigo_sala = datos["codigo_sala"]
+    sala = crear_estructura_sala(codigo_sala, datos["host_id"])
+    sala["estado_partida"] = datos["estado_partida"]
+    sala["creada_en"] = datos["creada_en"]
+    sala["estado_desde"] = datos["estado_desde"]
+    # JSON guarda las claves como texto: volver a enteros
+    sala["estado"] = {int(pid): pos for pid, pos in datos["estado"].items()}
+    sala["balas"] = {int(bala_id): bala for bala_id, bala in datos["balas"].items()}
+    sala["puntuacion"] = {int(pid): n for pid, n in datos["puntuacion"].items()}
+    sala["jugadores_listos"] = {int(pid): listo for pid, listo in datos["jugadores_listos"].items()}
+    sala["estrella_actual"] = datos["estrella_actual"]
+    sala["jugadores_invencibles"] = {int(pid): fin for pid, fin in datos["jugadores_invencibles"].items()}
+    sala["siguiente_bala_id"] = datos["siguiente_bala_id"]
+    sala["ultima_estrella_tiempo"] = datos["ultima_estrella_tiempo"]
+    sala["participantes"] = {int(pid): nombre for pid, nombre in datos.get("participantes", {}).items()}
+    sala["modo"] = datos.get("modo", "normal")
+    sala["publica"] = datos.get("publica", False)
+    sala["sala_de_bots"] = datos.get("sala_de_bots", False)
+    if datos.get("duelo"):
+        # El duelo sigue cuando reanuden: reanudar_sesion lo resincroniza desde este estado
+        sala["duelo"] = crear_duelo(
+            datos["duelo"]["ids"], duelo.EstadoDuelo.desde_dict(datos["duelo"]["estado"]), time.monotonic(), 0
+        )
+    
+    for info in datos["jugadores"]:
+        if info.get("es_bot"):
+            # Los bots no se desconectan: vuelven a jugar enseguida, con una semilla nueva
+            bot = bots.Bot(info["id"], f"{SEMILLA_BOTS}-restaurado-{info['id']}")
+            sala["jugadores"].append(bot.conexion)
+            sala["jugadores_info"][bot.conexion] = dict(info)
+            sala["bots"][info["id"]] = bot
+            websocket_a_sala[bot.conexion] = codigo_sala
+            continue
+        marcador = ConexionRestaurada(info["id"])
+        sala["jugadores_info"][marcador] = dict(info)
+        sala["suspendidos"][info["id"]] = marcador
+        sesiones[info["token"]] = {"codigo_sala": codigo_sala, "player_id": info["id"]}
+        programar_temporizador_sala(
+            sala, f"reanudacion_{info['id']}", VENTANA_REANUDACION,
+            expirar_reanudacion, codigo_sala, info["id"]
+        )
+    
+    # Volver a programar los eventos de la sala
+    programar_expiracion_sala(sala)
+    if sala["estado_partida"] == "jugando":
+        ahora = time.time()
+        for pid, fin in sala["jugadores_invencibles"].items():
+            programar_temporizador_sala(
+                sala, f"invencible_{pid}", fin - ahora,
+                terminar_invencibilidad, codigo_sala, pid
+            )
+        if sala["estrella_actual"] is None and sala["duelo"] is None:
+            espera = sala["ultima_estrella_tiempo"] + TIEMPO_ENTRE_ESTRELLAS - ahora
+            programar_temporizador_sala(sala, "estrella", espera, generar_estrella_sala, codigo_sala)
+    return sala
+
+
+async def guardar_checkpoint(drenado: bool = False):
+    """Escribe un checkpoint de las salas en curso (lobby y partidas) fuera del event loop."""
+    async with bloqueo_checkpoint:
+        inicio = time.perf_counter()
+        datos = {
+            "drenado": drenado,
+            "siguiente_player_id": siguiente_player_id,
+            "salas": [
+                serializar_sala(sala) for sala in salas.values()
+                if sala["estado_partida"] in ("lobby", "jugando")
+            ]
+        }
+        try:
+            tamaño = await asyncio.to_thread(checkpoint.escribir, ARCHIVO_CHECKPOINT, datos)
+        except OSError as e:
+            print(f"Error al escribir el checkpoint: {e}")
+            return
+        metricas.observar("checkpoint_s", time.perf_counter() - inicio)
+        metricas.fijar("checkpoint_bytes", tamaño)
+        metricas.incrementar("checkpoints")
+
+
+def restaurar_checkpoint() -> int:
+    """Restaura las salas del último checkpoint, si es reciente. Devuelve cuántas se restauraron."""
+    global siguiente_player_id
+    
+    datos = checkpoint.leer(ARCHIVO_CHECKPOINT, ANTIGUEDAD_MAXIMA_CHECKPOINT)
+    if datos is None:
+        return 0
+    
+    siguiente_player_id = max(siguiente_player_id, datos.get("siguiente_player_id", 1))
+    restauradas = 0
+    for datos_sala in datos.get("salas", []):
+        if datos_sala["codigo_sala"] in salas:
+            continue
+        sala = restaurar_sala(datos_sala)
+        salas[datos_sala["codigo_sala"]] = sala
+        indice_salas.actualizar(sala["codigo_sala"], resumen_sala_publica(sala))
+        restauradas += 1
+    
+    origen = "drenaje" if datos.get("drenado") else "checkpoint periódico"
+    print(f"Restauradas {restauradas} salas ({origen}); los jugadores tienen {VENTANA_REANUDACION}s para reanudar")
+    metricas.incrementar("salas_restauradas", restauradas)
+    return restauradas
+
+
+async def drenar_servidor(servidor: Any):
+    """
+    Modo drenaje para reinicios sin cortes: deja de aceptar salas y jugadores,
+    escribe un checkpoint final y cierra las conexiones con 1012 ("reinicio del
+    servidor") para que los clientes reanuden en el proceso nuevo.
+    """
+    global drenando
+    drenando = True
+    metricas.fijar("drenando", 1)
+    print(f"Drenando servidor: guardando {len(salas)} salas en {ARCHIVO_CHECKPOINT}")
+    
+    await guardar_checkpoint(drenado=True)
+    servidor.close(code=1012, reason="Reinicio del servidor")
+    await servidor.wait_closed()
+    print("Servidor drenado")
+
+
+def estimar_memoria_conexion(websocket: Any) -> int:
+    """Bytes que el servidor mantiene por una conexión fuera de tracemalloc (contextos de zlib)."""
+    total = 0
+    for extension in getattr(getattr(websocket, "protocol", None), "extensions", []):
+        if isinstance(extension, PerMessageDeflate):
+            mem_level = extension.compress_settings.get("memLevel", 8)
+            compresor, _ = memoria.memoria_zlib(extension.local_max_window_bits or 15, mem_level)
+            _, descompresor = memoria.memoria_zlib(extension.remote_max_window_bits or 15, mem_level)
+            total += compresor + descompresor
+    return total
+
+
+async def generar_reporte_memoria():
+    """
+    Escribe en ARCHIVO_MEMORIA un reporte de memoria: bytes aproximados por sala y
+    por conexión, conteo de entidades vivas (y mapeos huérfanos), cuántas salas
+    caben en PRESUPUESTO_MEMORIA y la diferencia de tracemalloc con el reporte
+    anterior agrupada por función del servidor.
+    
+    tracemalloc cuesta mucha CPU: el primer reporte lo activa y toma la línea base,
+    el segundo compara contra ella y lo vuelve a desactivar.
+    """
+    global snapshot_memoria_anterior
+    
+    memoria.iniciar_rastreo()
+    
+    # Tamaño de cada sala por estado (las conexiones se cuentan aparte)
+    bytes_por_estado: Dict[str, list] = defaultdict(list)
+    jugadores_por_estado: Dict[str, list] = defaultdict(list)
+    for sala in salas.values():
+        bytes_por_estado[sala["estado_partida"]].append(memoria.tamaño_profundo(sala))
+        jugadores_por_estado[sala["estado_partida"]].append(len(sala["jugadores_info"]))
+    
+    # Diferencia de tracemalloc contra la línea base (si la hay)
+    snapshot = await asyncio.to_thread(memoria.tomar_snapshot)
+    diferencia, bytes_websockets = [], 0
+    if snapshot_memoria_anterior is not None:
+        diferencia, bytes_websockets = await asyncio.to_thread(
+            memoria.diferencia_por_funcion, snapshot_memoria_anterior, snapshot
+        )
+    
+    # Por conexión: datos propios + zlib (estimado) + lo que websockets asignó en la ventana de rastreo
+    bytes_registro = sum(memoria.tamaño_profundo(datos) for datos in conexiones.values())
+    bytes_zlib = sum(estimar_memoria_conexion(ws) for ws in conexiones)
+    n_conexiones = len(conexiones)
+    bytes_conexion = (
+        (bytes_registro + bytes_zlib + bytes_websockets) / n_conexiones if n_conexiones else None
+    )
+    
+    # Entidades vivas y mapeos que apuntan a salas o jugadores inexistentes (fugas)
+    entidades = {
+        "salas": len(salas),
+        "conexiones": n_conexiones,
+        "websocket_a_sala": len(websocket_a_sala),
+        "espectador_a_sala": len(espectador_a_sala),
+        "sesiones": len(sesiones),
+        "jugadores": sum(len(sala["jugadores_info"]) for sala in salas.values()),
+        "suspendidos": sum(len(sala["suspendidos"]) for sala in salas.values()),
+        "espectadores": sum(len(sala["espectadores"]) for sala in salas.values()),
+        "balas": sum(len(sala["balas"]) for sala in salas.values()),
+        "temporizadores_pendientes": len(rueda_temporizadores),
+        "tareas_cierre": len(tareas_cierre),
+        "mapeos_huerfanos": sum(
+            1 for ws, codigo in websocket_a_sala.items()
+            if codigo not in salas or ws not in salas[codigo]["jugadores_info"]
+        ),
+        "sesiones_huerfanas": sum(1 for sesion in sesiones.values() if sesion["codigo_sala"] not in salas),
+    }
+    
+    # Capacidad: cuántas salas de cada tipo caben en el presupuesto
+    rss = memoria.rss_bytes()
+    memoria_salas = sum(sum(tamaños) for tamaños in bytes_por_estado.values())
+    memoria_conexiones = (bytes_conexion or 0) * n_conexiones
+    base = rss - memoria_salas - memoria_conexiones if rss is not None else 0
+    disponible = max(0, PRESUPUESTO_MEMORIA - base)
+    por_sala = {}
+    capacidad = {}
+    for estado, tamaños in bytes_por_estado.items():
+        promedio_sala = sum(tamaños) / len(tamaños)
+        promedio_jugadores = sum(jugadores_por_estado[estado]) / len(tamaños)
+        por_sala[estado] = {
+            "salas": len(tamaños),
+            "bytes_promedio": promedio_sala,
+            "jugadores_promedio": promedio_jugadores,
+        }
+        bytes_sala_completa = promedio_sala + promedio_jugadores * (bytes_conexion or 0)
+        capacidad[estado] = int(disponible // bytes_sala_completa) if bytes_sala_completa else None
+    
+    reporte = {
+        "generado_en": time.time(),
+        "rss_bytes": rss,
+        "presupuesto_bytes": PRESUPUESTO_MEMORIA,
+        "memoria_base_bytes": base,
+        "por_sala": por_sala,
+        "por_conexion": {
+            "bytes_promedio": bytes_conexion,
+            "registro_bytes": bytes_registro,
+            "zlib_bytes": bytes_zlib,
+            "websockets_bytes": bytes_websockets,  # Solo lo asignado durante la ventana de rastreo
+        },
+        "salas_que_caben": capacidad,
+        "entidades": entidades,
+        "tracemalloc": {
+            # Solo se rastrea lo asignado desde el reporte anterior
+            "linea_base": snapshot_memoria_anterior is None,
+            "diferencia_por_funcion": diferencia,
+        },
+    }
+    if snapshot_memoria_anterior is None:
+        snapshot_memoria_anterior = snapshot
+    else:
+        snapshot_memoria_anterior = None
+        memoria.detener_rastreo()
+    
+    try:
+        await asyncio.to_thread(metricas.exportar, ARCHIVO_MEMORIA, reporte)
+        print(f"Reporte de memoria escrito en {ARCHIVO_MEMORIA}")
+    except OSError as e:
+        print(f"Error al escribir el reporte de memoria: {e}")
+
+
+async def loop_reporte_memoria():
+    """Loop que genera un reporte de memoria cada vez que se pide (SIGUSR1)."""
+    while True:
+        await solicitud_reporte_memoria.wait()
+        solicitud_reporte_memoria.clear()
+        await generar_reporte_memoria()
+
+
+async def loop_checkpoint():
+    """Loop que escribe periódicamente un checkpoint de las salas (hasta que empieza el drenaje)."""
+    while True:
+        await asyncio.sleep(INTERVALO_CHECKPOINT)
+        if drenando:
+            return
+        await guardar_checkpoint()
+
+
+async def loop_exportar_metricas():
+    """Loop que exporta periódicamente las métricas del servidor a ARCHIVO_METRICAS."""
+    while True:
+        await asyncio.sleep(INTERVALO_EXPORTAR_METRICAS)
         
-        await asyncio.sleep(0.016)  # ~60 FPS
+        metricas.fijar("conexiones", len(conexiones))
+        metricas.fijar("salas", len(salas))
+        metricas.fijar("temporizadores_pendientes", len(rueda_temporizadores))
+        metricas.fijar("bots", sum(len(sala["bots"]) for sala in salas.values()))
+        metricas.fijar("nivel_calidad", control_calidad.nivel)
+        metricas.fijar("salas_publicas", len(indice_salas.salas))
+        metricas.fijar("exploradores", len(indice_salas.suscriptores))
+        if escritor_historial is not None:
+            metricas.fijar("historial_pendientes", escritor_historial.pendientes())
+            metricas.fijar("historial_partidas_guardadas", escritor_historial.partidas_guardadas)
+            metricas.fijar("historial_lotes", escritor_historial.lotes_escritos)
+            metricas.fijar("historial_errores", escritor_historial.errores)
+            metricas.fijar("historial_ultimo_lote_s", escritor_historial.ultimo_lote_s)
+        if trazador is not None:
+            metricas.fijar("trazas", trazador.trazas)
+            metricas.fijar("eventos_traza_guardados", trazador.guardados)
+            metricas.fijar("eventos_traza_descartados", trazador.descartados)
+            metricas.fijar("archivos_traza_rotados", trazador.rotaciones)
+        exportar_recoleccion()
+        datos = metricas.instantanea()
+        datos["compresion"] = compresion.reporte()
+        datos["calidad"] = control_calidad.reporte()
+        try:
+            # Escribir fuera del event loop
+            await asyncio.to_thread(metricas.exportar, ARCHIVO_METRICAS, datos)
+        except OSError as e:
+            print(f"Error al exportar métricas: {e}")
+
+
+def exportar_recoleccion():
+    """Pasa a las métricas las pausas del recolector de ciclos medidas desde la última exportación."""
+    for generacion, duracion, en_hueco in control_gc.tomar_pausas():
+        metricas.observar("pausa_gc", duracion)
+        metricas.observar(f"pausa_gc_gen{generacion}", duracion)
+        if not en_hueco:
+            # Recolección automática: pudo caer en medio de un tick
+            metricas.incrementar("pausas_gc_automaticas")
+    for generacion, cantidad in enumerate(control_gc.colecciones):
+        metricas.fijar(f"colecciones_gc_gen{generacion}", cantidad)
+    metricas.fijar("colecciones_gc_forzadas", control_gc.forzadas)
+    metricas.fijar("objetos_gc_congelados", control_gc.congelados)
+
+
+async def escribir_trazas():
+    """Pasa al archivo de trazas los eventos acumulados (fuera del event loop)."""
+    try:
+        await asyncio.to_thread(trazador.escribir, trazador.tomar())
+    except OSError as e:
+        print(f"Error al escribir las trazas: {e}")
+
+
+async def loop_escribir_trazas():
+    """Loop que escribe periódicamente las trazas muestreadas en ARCHIVO_TRAZAS."""
+    while True:
+        await asyncio.sleep(INTERVALO_ESCRITURA_TRAZAS)
+        await escribir_trazas()
 
 
 async def main():
     """
     Función principal que inicia el servidor WebSocket.
     """
+    global escritor_historial, protocolo_udp, publicador_telemetria, trazador
+    
     print("Iniciando servidor Cowboy Battle...")
     print("Escuchando en 0.0.0.0:9000")
     
+    # Retomar las salas de un proceso anterior (caída o reinicio con drenaje)
+    restaurar_checkpoint()
+    
+    # Reconstruir el ranking con el historial y arrancar su escritor
+    ranking.cargar(historial.totales_por_jugador(ARCHIVO_HISTORIAL))
+    escritor_historial = historial.EscritorHistorial(ARCHIVO_HISTORIAL)
+    
+    # Telemetría para procesos externos; sin ella el servidor funciona igual
+    if PUBLICAR_TELEMETRIA:
+        try:
+            publicador_telemetria = telemetria.PublicadorTelemetria()
+            print(f"Telemetría en memoria compartida '{telemetria.NOMBRE_TELEMETRIA}'")
+        except OSError as e:
+            print(f"No se pudo crear la memoria compartida de telemetría ({e})")
+    
+    # Trazas muestreadas de mensajes y ticks (TASA_TRAZAS_* = 0 las desactiva)
+    if TASA_TRAZAS_MENSAJES > 0 or TASA_TRAZAS_TICKS > 0:
+        trazador = trazas.Trazador(ARCHIVO_TRAZAS, TASA_TRAZAS_MENSAJES, TASA_TRAZAS_TICKS, MAX_EVENTOS_TRAZAS,
+                                   MAX_BYTES_ARCHIVO_TRAZAS, ARCHIVOS_TRAZAS_VIEJOS)
+        print(f"Trazas muestreadas en {ARCHIVO_TRAZAS}")
+    
+    # Salas solo de bots como carga de prueba (SALAS_DE_BOTS = 0 en producción)
+    for _ in range(SALAS_DE_BOTS):
+        await comenzar_partida(crear_sala_de_bots(BOTS_POR_SALA_DE_BOTS))
+    
     # Iniciar el servidor WebSocket
     # 0.0.0.0 permite conexiones desde cualquier interfaz de red
-    async with websockets.serve(manejar_cliente, "0.0.0.0", 9000):
+    # Compresión decidida por tipo y tamaño de mensaje (mismos parámetros que el
+    # permessage-deflate por defecto de websockets)
+    politica_compresion = compresion.PoliticaCompresion(UMBRALES_COMPRESION, UMBRAL_COMPRESION_POR_DEFECTO)
+    extensiones = [
+        compresion.FabricaDeflateSelectivo(
+            politica_compresion,
+            server_max_window_bits=12,
+            client_max_window_bits=12,
+            compress_settings={"memLevel": 5}
+        )
+    ]
+    
+    # Los pings detectan conexiones muertas, que el recolector termina de limpiar
+    async with websockets.serve(
+        manejar_cliente, "0.0.0.0", 9000,
+        ping_interval=PING_INTERVALO,
+        ping_timeout=PING_TIMEOUT,
+        compression=None,
+        extensions=extensiones
+    ) as servidor:
         # Iniciar el loop de actualización de balas en segundo plano
         asyncio.create_task(loop_actualizacion_balas())
-        # Iniciar el loop de generación de estrellas
-        asyncio.create_task(loop_generar_estrellas())
+        # Iniciar el loop de temporizadores (estrellas, invencibilidad, expiración)
+        asyncio.create_task(loop_temporizadores())
+        # Iniciar la transmisión para espectadores
+        asyncio.create_task(loop_transmision())
+        # Iniciar los avisos del explorador de salas públicas
+        asyncio.create_task(loop_explorador())
+        # Iniciar el emparejamiento de partidas rápidas
+        asyncio.create_task(loop_emparejamiento())
+        # Iniciar el recolector de salas abandonadas
+        asyncio.create_task(loop_limpieza_salas())
+        # Iniciar la medición de salud y la exportación de métricas
+        asyncio.create_task(loop_medir_lag())
+        asyncio.create_task(loop_exportar_metricas())
+        # Iniciar los checkpoints periódicos de las salas
+        asyncio.create_task(loop_checkpoint())
+        # Iniciar el reporte de memoria a pedido
+        asyncio.create_task(loop_reporte_memoria())
+        # Iniciar la escritura de las trazas muestreadas
+        if trazador is not None:
+            asyncio.create_task(loop_escribir_trazas())
+        
+        # Canal UDP opcional para snapshots; sin él todo sigue por WebSocket
+        try:
+            _, protocolo_udp = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: datagramas.ProtocoloDatagramas(procesar_datagrama),
+                local_addr=("0.0.0.0", PUERTO_UDP)
+            )
+            asyncio.create_task(loop_canales_udp())
+            print(f"Canal UDP en 0.0.0.0:{PUERTO_UDP}")
+        except OSError as e:
+            print(f"No se pudo abrir el canal UDP ({e}), solo WebSocket")
+        
+        # Con todo cargado, congelar lo que vive hasta el final y aplicar el modo del recolector
+        control_gc.iniciar()
+        print(f"Recolector de ciclos en modo {MODO_GC} ({control_gc.congelados} objetos congelados)")
+        
+        # SIGTERM (reinicio o despliegue) activa el modo drenaje
+        senal_drenaje = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, senal_drenaje.set)
+            # SIGUSR1 pide un reporte de memoria (kill -USR1 <pid>)
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, solicitud_reporte_memoria.set)
+        except (NotImplementedError, AttributeError):
+            pass  # Windows: sin señales, el servidor solo se detiene con Ctrl+C
         
-        # Mantener el servidor corriendo indefinidamente
-        await asyncio.Future()  # Ejecutar para siempre
+        try:
+            # Mantener el servidor corriendo hasta que se pida drenarlo
+            await senal_drenaje.wait()
+            await drenar_servidor(servidor)
+        finally:
+            # Escribir las partidas que queden en la cola (también con Ctrl+C)
+            escritor_historial.cerrar()
+            if publicador_telemetria is not None:
+                publicador_telemetria.cerrar()
+            if trazador is not None:
+                trazador.escribir(trazador.tomar())
+            control_gc.detener()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+"""
+Ritmo y presupuesto de snapshots por cliente del servidor de Cowboy Battle.
+Cada cliente puede declarar cuántos snapshots por segundo quiere y cuántos bytes
+por segundo le caben, y el servidor baja el ritmo por su cuenta si la conexión
+se atrasa (su buffer de salida crece). Cuando el presupuesto no alcanza para el
+estado completo, se envían primero las entidades más importantes para ese
+jugador (sus balas, las balas y los rivales cercanos, la estrella) y el resto
+espera a otro snapshot: cuanto más tiempo lleva una entidad sin enviarse, más
+sube su prioridad.
+"""
+
+import math
+from typing import Dict, List, Tuple
+
+# Snapshots por segundo: el máximo es el ritmo del loop del servidor
+TASA_MAXIMA = 60
+TASA_MINIMA = 5
+
+# Presupuesto mínimo aceptado (bytes por segundo): por debajo no cabe ni un estado chico
+PRESUPUESTO_MINIMO = 2000
+
+# Segundos de presupuesto que se pueden acumular sin usar (permite una ráfaga corta)
+RAFAGA = 0.5
+
+# Tolerancia para no saltear un snapshot por la variación del tick (en segundos)
+MARGEN_TICK = 0.004
+
+# Adaptación al atraso de la conexión: buffer de salida (bytes) que cuenta como congestión,
+# espera mínima entre dos reducciones y cada cuánto (y cuánto) se recupera la tasa
+BUFFER_CONGESTION = 64 * 1024
+ESPERA_REDUCCION = 0.5
+ESPERA_RECUPERACION = 1.0
+PASO_RECUPERACION = 5
+
+# Prioridad base por tipo de entidad
+PRIORIDADES = {
+    "bala_propia": 100,
+    "bala": 70,
+    "rival": 60,
+    "estrella": 50,
+    "propio": 20
+}
+
+# Las balas ajenas y los rivales suman hasta BONO_CERCANIA según lo cerca que estén
+ALCANCE_CERCANIA = 400
+BONO_CERCANIA = 40
+
+# Prioridad que gana una entidad por cada segundo sin enviarse (hasta EDAD_MAXIMA segundos)
+PRIORIDAD_POR_SEGUNDO = 200
+EDAD_MAXIMA = 2.0
+
+# Entidad del estado lista para elegir:
+# (clave, fragmento JSON, tipo "jugador" | "bala" | "estrella", x, y, player_id dueño o None)
+Entidad = Tuple[str, str, str, float, float, int | None]
+
+
+class FlujoSnapshots:
+    """
+    Snapshots de una conexión: tasa y presupuesto declarados por el cliente,
+    tasa efectiva (adaptada a la congestión), crédito de bytes disponible y
+    momento en que se envió por última vez cada entidad.
+    """
+
+    def __init__(self, ahora: float):
+        self.tasa = TASA_MAXIMA
+        self.presupuesto: int | None = None  # None = sin límite
+        self.tasa_actual = float(TASA_MAXIMA)
+        self.credito = 0.0
+        self.proximo = ahora
+        self.ultima_recarga = ahora
+        self.ultima_reduccion = 0.0
+        self.ultimo_completo = 0.0
+        self.enviados: Dict[str, float] = {}  # clave de entidad -> último envío (solo en parciales)
+
+    def configurar(self, tasa, presupuesto) -> Tuple[int, int | None]:
+        """Aplica la tasa y el presupuesto que declara el cliente (ajustados a los límites)."""
+        if isinstance(tasa, (int, float)) and not isinstance(tasa, bool):
+            self.tasa = int(max(TASA_MINIMA, min(TASA_MAXIMA, tasa)))
+        if presupuesto is None:
+            self.presupuesto = None
+        elif isinstance(presupuesto, (int, float)) and not isinstance(presupuesto, bool):
+            self.presupuesto = int(max(PRESUPUESTO_MINIMO, presupuesto))
+        self.tasa_actual = float(self.tasa)
+        self.credito = 0.0
+        return self.tasa, self.presupuesto
+
+    def sin_limites(self) -> bool:
+        """Indica si la conexión recibe todos los snapshots completos (el caso común)."""
+        return self.tasa_actual >= TASA_MAXIMA and self.presupuesto is None
+
+    def toca_enviar(self, ahora: float) -> bool:
+        """Recarga el crédito e indica si en este tick corresponde un snapshot."""
+        if self.presupuesto is not None:
+            self.credito = min(
+                self.credito + self.presupuesto * (ahora - self.ultima_recarga),
+                self.presupuesto * RAFAGA
+            )
+        self.ultima_recarga = ahora
+        if ahora + MARGEN_TICK < self.proximo:
+            return False
+        intervalo = 1.0 / self.tasa_actual
+        # Si se atrasó más de un intervalo no se intenta "recuperar" snapshots perdidos
+        self.proximo = max(self.proximo, ahora - intervalo) + intervalo
+        return True
+
+    def credito_lleno(self) -> bool:
+        """Indica si el crédito llegó a su máximo (esperar más no lo haría crecer)."""
+        return self.presupuesto is not None and self.credito >= self.presupuesto * RAFAGA - 1
+
+    def adaptar(self, buffer_salida: int, ahora: float) -> bool:
+        """
+        Baja la tasa a la mitad si la conexión no da abasto (el buffer de salida
+        crece) y la vuelve a subir de a poco mientras no haya congestión.
+        Devuelve True si la tasa se redujo.
+        """
+        if buffer_salida > BUFFER_CONGESTION:
+            if ahora - self.ultima_reduccion >= ESPERA_REDUCCION and self.tasa_actual > TASA_MINIMA:
+                self.tasa_actual = max(float(TASA_MINIMA), self.tasa_actual / 2)
+                self.ultima_reduccion = ahora
+                return True
+        elif self.tasa_actual < self.tasa and ahora - self.ultima_reduccion >= ESPERA_RECUPERACION:
+            self.tasa_actual = min(float(self.tasa), self.tasa_actual + PASO_RECUPERACION)
+            self.ultima_reduccion = ahora
+        return False
+
+    def registrar_completo(self, tamaño: int, ahora: float):
+        """Descuenta un snapshot completo: todas las entidades quedan al día."""
+        if self.presupuesto is not None:
+            self.credito -= tamaño
+        self.ultimo_completo = ahora
+        self.enviados.clear()
+
+    def elegir(self, entidades: List[Entidad], player_id: int | None, disponible: int,
+               ahora: float) -> List[Entidad]:
+        """
+        Elige las entidades que entran en `disponible` bytes, de mayor a menor
+        prioridad para `player_id`, y las marca como enviadas.
+        """
+        propia = None
+        for _, _, tipo, x, y, dueño in entidades:
+            if tipo == "jugador" and dueño == player_id:
+                propia = (x, y)
+                break
+
+        def prioridad(entidad: Entidad) -> float:
+            clave, _, tipo, x, y, dueño = entidad
+            if tipo == "jugador":
+                base = PRIORIDADES["propio" if dueño == player_id else "rival"]
+            elif tipo == "bala":
+                base = PRIORIDADES["bala_propia" if dueño == player_id else "bala"]
+            else:
+                base = PRIORIDADES["estrella"]
+            if propia is not None and dueño != player_id and tipo != "estrella":
+                distancia = math.hypot(x - propia[0], y - propia[1])
+                base += BONO_CERCANIA * (1 - min(distancia, ALCANCE_CERCANIA) / ALCANCE_CERCANIA)
+            ultimo = max(self.enviados.get(clave, 0.0), self.ultimo_completo)
+            return base + PRIORIDAD_POR_SEGUNDO * min(ahora - ultimo, EDAD_MAXIMA)
+
+        elegidas = []
+        # Las entidades que no caben se saltean: una más chica de menor prioridad aún puede entrar
+        for entidad in sorted(entidades, key=prioridad, reverse=True):
+            tamaño = len(entidad[1]) + 2  # Más el separador ", "
+            if tamaño <= disponible:
+                elegidas.append(entidad)
+                disponible -= tamaño
+
+        # Olvidar las entidades que ya no existen
+        presentes = {entidad[0] for entidad in entidades}
+        self.enviados = {clave: t for clave, t in self.enviados.items() if clave in presentes}
+        for entidad in elegidas:
+            self.enviados[entidad[0]] = ahora
+        return elegidas
@@ -0,0 +1,263 @@
+"""
+Telemetría en memoria compartida del servidor de Cowboy Battle.
+En cada tick el servidor escribe un registro compacto por sala (y uno con los
+contadores del servidor) en un buffer circular de `multiprocessing.shared_memory`.
+Otros procesos (paneles, análisis anti-trampas, overlays de transmisión) leen
+con `LectorTelemetria` sin conectarse por WebSocket: el servidor solo copia
+bytes en memoria, sin bloqueos ni llamadas al sistema, y un lector lento nunca
+lo frena (si se atrasa más que el buffer, pierde los registros más viejos).
+
+Uso desde otro proceso:
+
+    from telemetria import LectorTelemetria
+    lector = LectorTelemetria()
+    for registro in lector.leer():
+        ...
+
+o bien `python servidor/telemetria.py` para ver las salas en vivo.
+"""
+
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List
+
+# Nombre del segmento de memoria compartida y cantidad de registros del buffer circular
+NOMBRE_TELEMETRIA = "cowboy_telemetria"
+CAPACIDAD_TELEMETRIA = 8192
+
+# Formato (cambia si cambia la disposición de los registros)
+MAGIA = b"CBTL"
+VERSION = 1
+
+# Cabecera: magia, versión, tamaño de registro, capacidad, registros escritos en total
+_CABECERA = struct.Struct("<4sHHIQ")
+TAMAÑO_CABECERA = 64
+
+# Registro: secuencia (índice + 1; 0 mientras se escribe), tipo, tick y hora del servidor
+_PREFIJO = struct.Struct("<QBId")
+TAMAÑO_REGISTRO = 96
+
+# Tipos de registro
+TIPO_SALA = 1
+TIPO_SERVIDOR = 2
+
+# Sala: código, estado_partida, modo, jugadores, hay estrella, espectadores, balas
+_SALA = struct.Struct("<6sBBBBHH")
+# Jugador (hasta MAX_JUGADORES_REGISTRO por sala): player_id, x, y, puntuación, invencible
+_JUGADOR = struct.Struct("<IffBB")
+MAX_JUGADORES_REGISTRO = 4
+# Servidor: conexiones, salas, jugadores en partida, uso de tick, lag del loop, nivel de calidad
+_SERVIDOR = struct.Struct("<IIIffB")
+
+ESTADOS_PARTIDA = ("lobby", "jugando", "game_over")
+MODOS = ("normal", "duelo")
+
+_OFFSET_DATOS = _PREFIJO.size
+_OFFSET_JUGADORES = _OFFSET_DATOS + _SALA.size
+assert _OFFSET_JUGADORES + _JUGADOR.size * MAX_JUGADORES_REGISTRO <= TAMAÑO_REGISTRO
+
+# Registro de sala completo según cuántos jugadores tiene (se escribe con un solo pack_into);
+# con menos del máximo, un player_id 0 marca el fin de la lista
+_REGISTROS_SALA = [
+    struct.Struct(
+        "<" + (_PREFIJO.format + _SALA.format + _JUGADOR.format * cantidad).replace("<", "")
+        + ("I" if cantidad < MAX_JUGADORES_REGISTRO else "")
+    )
+    for cantidad in range(MAX_JUGADORES_REGISTRO + 1)
+]
+_INDICE_ESTADO = {estado: i for i, estado in enumerate(ESTADOS_PARTIDA)}
+_INDICE_MODO = {modo: i for i, modo in enumerate(MODOS)}
+
+
+class PublicadorTelemetria:
+    """
+    Escritor (único) del buffer. Cada registro se escribe con la secuencia en 0 y
+    al final se pone su secuencia real; la cabecera se actualiza después del lote,
+    así un lector nunca ve como válido un registro a medio escribir.
+    """
+
+    def __init__(self, nombre: str = NOMBRE_TELEMETRIA, capacidad: int = CAPACIDAD_TELEMETRIA):
+        tamaño = TAMAÑO_CABECERA + capacidad * TAMAÑO_REGISTRO
+        try:
+            self.memoria = shared_memory.SharedMemory(nombre, create=True, size=tamaño)
+        except FileExistsError:
+            # Quedó de un proceso anterior que terminó sin limpiar
+            anterior = shared_memory.SharedMemory(nombre)
+            anterior.close()
+            anterior.unlink()
+            self.memoria = shared_memory.SharedMemory(nombre, create=True, size=tamaño)
+        self.buffer = self.memoria.buf
+        self.capacidad = capacidad
+        self.escritos = 0
+        _CABECERA.pack_into(self.buffer, 0, MAGIA, VERSION, TAMAÑO_REGISTRO, capacidad, 0)
+
+    def _registro(self, tipo: int, tick: int, t_servidor: float) -> int:
+        """Reserva el próximo lugar del buffer (con la secuencia en 0) y devuelve su offset."""
+        offset = TAMAÑO_CABECERA + (self.escritos % self.capacidad) * TAMAÑO_REGISTRO
+        _PREFIJO.pack_into(self.buffer, offset, 0, tipo, tick & 0xFFFFFFFF, t_servidor)
+        return offset
+
+    def _cerrar_registro(self, offset: int):
+        self.escritos += 1
+        struct.pack_into("<Q", self.buffer, offset, self.escritos)
+
+    def publicar_sala(self, sala: Dict[str, Any], tick: int, t_servidor: float):
+        """Escribe el registro de una sala: estado, contadores y posición y puntaje de cada jugador."""
+        offset = TAMAÑO_CABECERA + (self.escritos % self.capacidad) * TAMAÑO_REGISTRO
+        valores = [
+            0, TIPO_SALA, tick & 0xFFFFFFFF, t_servidor,
+            sala["codigo_sala"].encode("ascii")[:6],
+            _INDICE_ESTADO[sala["estado_partida"]],
+            _INDICE_MODO[sala["modo"]],
+            len(sala["jugadores"]),
+            sala["estrella_actual"] is not None,
+            min(len(sala["espectadores"]), 0xFFFF),
+            min(len(sala["balas"]), 0xFFFF)
+        ]
+        cantidad = 0
+        puntuacion = sala["puntuacion"]
+        invencibles = sala["jugadores_invencibles"]
+        for pid, pos in sala["estado"].items():
+            if cantidad == MAX_JUGADORES_REGISTRO:
+                break
+            valores += (pid, pos["x"], pos["y"], min(puntuacion.get(pid, 0), 0xFF), pid in invencibles)
+            cantidad += 1
+        if cantidad < MAX_JUGADORES_REGISTRO:
+            valores.append(0)
+        # Todo el registro de una vez (con la secuencia en 0) y después la secuencia
+        _REGISTROS_SALA[cantidad].pack_into(self.buffer, offset, *valores)
+        self._cerrar_registro(offset)
+
+    def publicar_servidor(self, tick: int, t_servidor: float, conexiones: int, salas: int,
+                          jugando: int, uso_tick: float, lag_loop: float, nivel_calidad: int):
+        """Escribe el registro con los contadores generales del servidor."""
+        offset = self._registro(TIPO_SERVIDOR, tick, t_servidor)
+        _SERVIDOR.pack_into(
+            self.buffer, offset + _OFFSET_DATOS,
+            conexiones, salas, jugando, uso_tick, lag_loop, nivel_calidad
+        )
+        self._cerrar_registro(offset)
+
+    def confirmar(self):
+        """Publica en la cabecera los registros escritos (al final de cada tick)."""
+        struct.pack_into("<Q", self.buffer, _CABECERA.size - 8, self.escritos)
+
+    def cerrar(self):
+        """Libera y borra el segmento (al detener el servidor)."""
+        self.buffer.release()
+        self.memoria.close()
+        self.memoria.unlink()
+
+
+class LectorTelemetria:
+    """
+    Lector del buffer desde otro proceso. `leer()` devuelve los registros
+    nuevos desde la lectura anterior; `perdidos` cuenta los que se sobrescribieron
+    antes de que se leyeran (lector demasiado lento).
+    """
+
+    def __init__(self, nombre: str = NOMBRE_TELEMETRIA, desde_el_principio: bool = False):
+        self.memoria = shared_memory.SharedMemory(nombre)
+        # Solo el servidor debe borrar el segmento: que el lector no lo haga al terminar
+        # (en POSIX, Python registra también los segmentos que solo se abren)
+        if os.name == "posix":
+            resource_tracker.unregister(self.memoria._name, "shared_memory")
+        self.buffer = self.memoria.buf
+        magia, version, tamaño_registro, self.capacidad, escritos = _CABECERA.unpack_from(self.buffer, 0)
+        if magia != MAGIA or version != VERSION or tamaño_registro != TAMAÑO_REGISTRO:
+            self.cerrar()
+            raise ValueError(f"Formato de telemetría desconocido ({magia!r}, versión {version})")
+        self.siguiente = 0 if desde_el_principio else escritos
+        self.perdidos = 0
+
+    def escritos(self) -> int:
+        """Registros que el servidor publicó en total."""
+        return struct.unpack_from("<Q", self.buffer, _CABECERA.size - 8)[0]
+
+    def leer(self) -> List[Dict[str, Any]]:
+        """Registros nuevos (los de sala y los del servidor, en el orden en que se escribieron)."""
+        escritos = self.escritos()
+        if escritos - self.siguiente > self.capacidad:
+            self.perdidos += escritos - self.capacidad - self.siguiente
+            self.siguiente = escritos - self.capacidad
+        registros = []
+        while self.siguiente < escritos:
+            offset = TAMAÑO_CABECERA + (self.siguiente % self.capacidad) * TAMAÑO_REGISTRO
+            self.siguiente += 1
+            registro = self._decodificar(offset)
+            # Si la secuencia cambió mientras se leía, el servidor ya lo sobrescribió
+            if registro is None or struct.unpack_from("<Q", self.buffer, offset)[0] != self.siguiente:
+                self.perdidos += 1
+                continue
+            registros.append(registro)
+        return registros
+
+    def _decodificar(self, offset: int) -> Dict[str, Any] | None:
+        secuencia, tipo, tick, t_servidor = _PREFIJO.unpack_from(self.buffer, offset)
+        if secuencia != self.siguiente:
+            return None
+        registro: Dict[str, Any] = {"tick": tick, "t_servidor": t_servidor}
+        if tipo == TIPO_SERVIDOR:
+            conexiones, salas, jugando, uso_tick, lag_loop, nivel = _SERVIDOR.unpack_from(
+                self.buffer, offset + _OFFSET_DATOS
+            )
+            registro.update({
+                "tipo": "servidor", "conexiones": conexiones, "salas": salas, "jugando": jugando,
+                "uso_tick": uso_tick, "lag_loop": lag_loop, "nivel_calidad": nivel
+            })
+            return registro
+        codigo, estado, modo, cantidad, estrella, espectadores, balas = _SALA.unpack_from(
+            self.buffer, offset + _OFFSET_DATOS
+        )
+        jugadores = []
+        posicion = offset + _OFFSET_JUGADORES
+        for _ in range(MAX_JUGADORES_REGISTRO):
+            pid, x, y, puntuacion, invencible = _JUGADOR.unpack_from(self.buffer, posicion)
+            if pid == 0:
+                break
+            jugadores.append({"player_id": pid, "x": x, "y": y, "puntuacion": puntuacion,
+                              "invencible": bool(invencible)})
+            posicion += _JUGADOR.size
+        registro.update({
+            "tipo": "sala", "codigo_sala": codigo.decode("ascii"),
+            "estado_partida": ESTADOS_PARTIDA[estado], "modo": MODOS[modo],
+            "cantidad_jugadores": cantidad, "estrella": bool(estrella),
+            "espectadores": espectadores, "balas": balas, "jugadores": jugadores
+        })
+        return registro
+
+    def ultimo_por_sala(self) -> Dict[str, Dict[str, Any]]:
+        """Lee lo nuevo y devuelve el registro más reciente de cada sala."""
+        return {r["codigo_sala"]: r for r in self.leer() if r["tipo"] == "sala"}
+
+    def cerrar(self):
+        self.buffer.release()
+        self.memoria.close()
+
+
+if __name__ == "__main__":
+    # Ejemplo de lector: muestra las salas del servidor una vez por segundo
+    lector = LectorTelemetria()
+    try:
+        while True:
+            time.sleep(1.0)
+            registros = lector.leer()
+            servidor = next((r for r in reversed(registros) if r["tipo"] == "servidor"), None)
+            if servidor is not None:
+                print(f"tick {servidor['tick']} - {servidor['conexiones']} conexiones, "
+                      f"{servidor['salas']} salas, uso de tick {servidor['uso_tick']:.0%}, "
+                      f"calidad {servidor['nivel_calidad']}")
+            salas = {r["codigo_sala"]: r for r in registros if r["tipo"] == "sala"}
+            for codigo, sala in sorted(salas.items()):
+                jugadores = ", ".join(
+                    f"{j['player_id']}@({j['x']:.0f},{j['y']:.0f}) {j['puntuacion']}" for j in sala["jugadores"]
+                )
+                print(f"  {codigo} {sala['estado_partida']:<9} balas={sala['balas']} {jugadores}")
+            if lector.perdidos:
+                print(f"  ({lector.perdidos} registros perdidos por leer tarde)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lector.cerrar()
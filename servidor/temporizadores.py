@@ -0,0 +1,117 @@
+"""
+Rueda jerárquica de temporizadores para el servidor de Cowboy Battle.
+Permite que las salas registren eventos con fecha límite (siguiente estrella,
+fin de invencibilidad, expiración de la sala) y que solo se procesen los que vencen,
+sin recorrer todas las salas en cada revisión.
+"""
+
+from typing import Any, Callable, List
+
+
+class Temporizador:
+    """Un evento programado en la rueda. Se puede cancelar antes de que venza."""
+
+    __slots__ = ("tick_vencimiento", "callback", "args", "cancelado")
+
+    def __init__(self, tick_vencimiento: int, callback: Callable[..., Any], args: tuple):
+        self.tick_vencimiento = tick_vencimiento
+        self.callback = callback
+        self.args = args
+        self.cancelado = False
+
+    def cancelar(self):
+        """Marca el temporizador como cancelado; la rueda lo descarta al alcanzarlo."""
+        self.cancelado = True
+
+
+class RuedaTemporizadores:
+    """
+    Rueda de temporizadores jerárquica.
+
+    El nivel 0 tiene una ranura por tick (de `resolucion` segundos). Cada nivel
+    superior cubre `ranuras` veces más tiempo que el anterior; cuando el nivel
+    inferior da una vuelta completa, la ranura correspondiente del nivel superior
+    se redistribuye hacia abajo. Programar y cancelar cuesta O(1), y cada tick
+    solo toca los temporizadores que vencen en él.
+    """
+
+    def __init__(self, resolucion: float, ahora: float, ranuras: int = 64, niveles: int = 4):
+        self.resolucion = resolucion
+        self.ranuras = ranuras
+        self.niveles: List[List[List[Temporizador]]] = [
+            [[] for _ in range(ranuras)] for _ in range(niveles)
+        ]
+        self.tick_actual = int(ahora / resolucion)
+        self.pendientes = 0
+
+    def __len__(self) -> int:
+        return self.pendientes
+
+    def programar(self, retraso: float, ahora: float, callback: Callable[..., Any], *args: Any) -> Temporizador:
+        """Programa `callback(*args)` para dentro de `retraso` segundos."""
+        tick = int((ahora + max(0.0, retraso)) / self.resolucion)
+        # Lo que ya venció se dispara en el siguiente tick
+        tick = max(tick, self.tick_actual + 1)
+        temporizador = Temporizador(tick, callback, args)
+        self._insertar(temporizador)
+        self.pendientes += 1
+        return temporizador
+
+    def _insertar(self, temporizador: Temporizador):
+        """Coloca el temporizador en el nivel y ranura que le corresponden."""
+        delta = temporizador.tick_vencimiento - self.tick_actual
+        alcance = self.ranuras
+        for nivel, ranuras_nivel in enumerate(self.niveles):
+            if delta < alcance or nivel == len(self.niveles) - 1:
+                divisor = alcance // self.ranuras
+                indice = (temporizador.tick_vencimiento // divisor) % self.ranuras
+                ranuras_nivel[indice].append(temporizador)
+                return
+            alcance *= self.ranuras
+
+    def _cascada(self, nivel: int):
+        """Redistribuye hacia niveles inferiores la ranura actual de `nivel`."""
+        divisor = self.ranuras ** nivel
+        indice = (self.tick_actual // divisor) % self.ranuras
+        ranura = self.niveles[nivel][indice]
+        self.niveles[nivel][indice] = []
+        for temporizador in ranura:
+            if temporizador.cancelado:
+                self.pendientes -= 1
+            else:
+                self._insertar(temporizador)
+
+    def avanzar(self, ahora: float) -> List[Temporizador]:
+        """
+        Avanza la rueda hasta `ahora` y devuelve los temporizadores vencidos,
+        en orden de vencimiento. Los cancelados se descartan.
+        """
+        vencidos: List[Temporizador] = []
+        tick_objetivo = int(ahora / self.resolucion)
+
+        while self.tick_actual < tick_objetivo:
+            self.tick_actual += 1
+
+            # Al completar una vuelta de un nivel, bajar la ranura del nivel superior
+            divisor = self.ranuras
+            for nivel in range(1, len(self.niveles)):
+                if self.tick_actual % divisor != 0:
+                    break
+                self._cascada(nivel)
+                divisor *= self.ranuras
+
+            indice = self.tick_actual % self.ranuras
+            ranura = self.niveles[0][indice]
+            if not ranura:
+                continue
+            self.niveles[0][indice] = []
+            for temporizador in ranura:
+                if temporizador.tick_vencimiento > self.tick_actual:
+                    # Aún no vence (quedó aquí desde el nivel superior): reinsertar
+                    self._insertar(temporizador)
+                    continue
+                self.pendientes -= 1
+                if not temporizador.cancelado:
+                    vencidos.append(temporizador)
+
+        return vencidos
@@ -0,0 +1,137 @@
+"""
+Trazas muestreadas del servidor de Cowboy Battle.
+Una fracción de los mensajes (y de los ticks) se sigue de punta a punta con un
+id de traza: recepción, decodificación, manejo y, si el mensaje es un disparo,
+la bala lleva el id por cada paso de la simulación hasta el impacto, la
+codificación del estado y el envío. Los eventos se escriben en el formato
+Trace Event de Chrome (JSON), que abren chrome://tracing, Perfetto
+(ui.perfetto.dev) o Speedscope: cada traza aparece como una fila propia.
+El archivo rota al llegar a un tamaño máximo y se conservan pocos archivos
+viejos, así que el disco que ocupan las trazas tiene un límite.
+"""
+
+import json
+import os
+import random
+from typing import Any, Iterable, List
+
+# Fila de los ticks muestreados (las trazas de mensajes usan su id como fila)
+FILA_TICKS = 0
+
+
+class Trazador:
+    """
+    Junta los eventos de las trazas muestreadas en memoria; `tomar()` y
+    `escribir()` los pasan al archivo (la escritura va fuera del event loop).
+    Cuando el archivo pasa `max_bytes`, se renombra a `<nombre>.1.json` (el
+    `.1` anterior pasa a `.2`, y así hasta `archivos_viejos`) y se empieza otro.
+    Si se juntan `max_eventos` pendientes (la escritura se atrasó o llegan
+    demasiadas trazas), descarta los nuevos y los cuenta hasta el próximo `tomar()`.
+    """
+
+    def __init__(self, ruta: str, tasa_mensajes: float, tasa_ticks: float, max_eventos: int,
+                 max_bytes: int, archivos_viejos: int):
+        self.ruta = ruta
+        self.tasa_mensajes = tasa_mensajes
+        self.tasa_ticks = tasa_ticks
+        self.max_eventos = max_eventos
+        self.max_bytes = max_bytes
+        self.archivos_viejos = archivos_viejos
+        self.pid = os.getpid()
+        self.eventos: List[str] = []
+        self.guardados = 0
+        self.descartados = 0
+        self.trazas = 0
+        self.siguiente_id = 1
+        self.rotaciones = 0
+        self._bytes_archivo = 0
+        self._archivo_iniciado = False
+        # Cada archivo empieza nombrando la fila de los ticks (los visores abren uno por vez)
+        self._nombre_ticks = json.dumps({
+            "name": "thread_name", "ph": "M", "pid": self.pid, "tid": FILA_TICKS,
+            "args": {"name": "ticks"}
+        })
+
+    def _agregar(self, evento: dict):
+        if len(self.eventos) >= self.max_eventos:
+            self.descartados += 1
+            return
+        self.guardados += 1
+        self.eventos.append(json.dumps(evento))
+
+    def muestrear_mensaje(self) -> int | None:
+        """Devuelve un id de traza nuevo para una fracción `tasa_mensajes` de los mensajes (None para el resto)."""
+        if self.tasa_mensajes <= 0 or random.random() >= self.tasa_mensajes:
+            return None
+        traza = self.siguiente_id
+        self.siguiente_id += 1
+        return traza
+
+    def muestrear_tick(self) -> bool:
+        return self.tasa_ticks > 0 and random.random() < self.tasa_ticks
+
+    def nombrar(self, traza: int, nombre: str):
+        """Da nombre a la fila de una traza (por ejemplo, "shoot #12")."""
+        self.trazas += 1
+        self._agregar({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": traza, "args": {"name": nombre}})
+
+    def tramo(self, traza: int, nombre: str, inicio: float, fin: float, **args: Any):
+        """Registra un tramo de `inicio` a `fin` (segundos de time.perf_counter)."""
+        self._agregar({
+            "name": nombre, "ph": "X", "pid": self.pid, "tid": traza,
+            "ts": round(inicio * 1e6, 1), "dur": round((fin - inicio) * 1e6, 1), "args": args
+        })
+
+    def tramos(self, trazas: Iterable[int], nombre: str, inicio: float, fin: float, **args: Any):
+        """El mismo tramo en varias trazas (un trabajo compartido, como codificar el estado de una sala)."""
+        for traza in trazas:
+            self.tramo(traza, nombre, inicio, fin, **args)
+
+    def instante(self, traza: int, nombre: str, momento: float, **args: Any):
+        """Registra un evento sin duración (por ejemplo, un impacto)."""
+        self._agregar({
+            "name": nombre, "ph": "i", "s": "t", "pid": self.pid, "tid": traza,
+            "ts": round(momento * 1e6, 1), "args": args
+        })
+
+    def tomar(self) -> List[str]:
+        """Devuelve los eventos pendientes de escribir y vacía la lista."""
+        eventos, self.eventos = self.eventos, []
+        return eventos
+
+    def escribir(self, eventos: List[str]):
+        """
+        Agrega eventos al archivo (bloqueante). El formato JSON de arreglo no
+        necesita el "]" final, así que el archivo es válido aunque el proceso
+        termine sin cerrarlo.
+        """
+        if not eventos:
+            return
+        if self._archivo_iniciado and self._bytes_archivo >= self.max_bytes:
+            self._rotar()
+        if not self._archivo_iniciado:
+            eventos = [self._nombre_ticks] + eventos
+        texto = (",\n" if self._archivo_iniciado else "[\n") + ",\n".join(eventos)
+        modo = "a" if self._archivo_iniciado else "w"
+        with open(self.ruta, modo, encoding="utf-8") as archivo:
+            # La coma va antes de cada evento: el archivo nunca termina en una coma colgando
+            archivo.write(texto)
+        self._archivo_iniciado = True
+        self._bytes_archivo += len(texto.encode("utf-8"))
+
+    def _ruta_vieja(self, numero: int) -> str:
+        base, extension = os.path.splitext(self.ruta)
+        return f"{base}.{numero}{extension}"
+
+    def _rotar(self):
+        """Corre los archivos viejos un número (el último se borra) y deja libre el actual."""
+        if self.archivos_viejos <= 0:
+            os.remove(self.ruta)
+        else:
+            for numero in range(self.archivos_viejos - 1, 0, -1):
+                if os.path.exists(self._ruta_vieja(numero)):
+                    os.replace(self._ruta_vieja(numero), self._ruta_vieja(numero + 1))
+            os.replace(self.ruta, self._ruta_vieja(1))
+        self._archivo_iniciado = False
+        self._bytes_archivo = 0
+        self.rotaciones += 1